@@ -2,10 +2,10 @@
 import json
 import os
 import random
-import numpy as np
+import re
+import threading
+import time
 from django.conf import settings
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 # --- 1. SAFETY FIRST: Hardcoded Crisis Logic ---
 # AI models can make mistakes. Safety triggers MUST be hardcoded regex.
@@ -14,6 +14,78 @@ CRISIS_KEYWORDS = [
     "disappear", "can't handle this", "hopeless"
 ]
 
+def load_crisis_keywords():
+    """
+    The safety list can be extended from settings without a code change:
+    AI_CRISIS_KEYWORDS (list of phrases) replaces the defaults, and
+    AI_CRISIS_KEYWORDS_FILE (one phrase per line, '#' comments) adds to them.
+    """
+    keywords = list(getattr(settings, 'AI_CRISIS_KEYWORDS', CRISIS_KEYWORDS))
+    keywords_file = getattr(settings, 'AI_CRISIS_KEYWORDS_FILE', None)
+    if keywords_file:
+        with open(keywords_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    keywords.append(line)
+    return keywords
+
+def _trie_pattern(phrases):
+    """
+    One regex for all phrases, factored on shared prefixes ("hurt myself" and
+    "hopeless" share one 'h' branch). At each position the engine follows one
+    path down the trie, so a scan costs about the same for 50 phrases or 5,000.
+    Phrases must start a word but may end mid-word (see CrisisMatcher).
+    """
+    trie = {}
+    for phrase in sorted(phrases, key=len):
+        node = trie
+        for char in phrase:
+            if '' in node:
+                break  # A shorter phrase already matches here
+            node = node.setdefault(char, {})
+        else:
+            node.clear()
+            node[''] = True
+
+    def emit(node):
+        if '' in node:
+            return ''
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    return re.compile(r'(?<!\w)' + emit(trie) if trie else r'(?!)')
+
+class CrisisMatcher:
+    """
+    Flags text containing any crisis phrase, in one scan of the lowercased
+    text with a trie-factored regex (`manage.py bench_crisis`). A phrase has
+    to start at a word boundary but may run on into a longer word, so
+    inflections still hit ("hopelessness", "died") while words that merely
+    contain a phrase do not ("studied", "bodies"). A straight apostrophe in a
+    phrase also matches a curly one.
+
+    Words that start with a phrase are still flagged, "diet" included: for a
+    safety check we keep that false alarm rather than add a trailing boundary
+    that would also drop "died" and "dies".
+    """
+    def __init__(self, keywords):
+        phrases = set()
+        for keyword in keywords:
+            phrase = keyword.strip().lower()
+            if phrase:
+                phrases.add(phrase)
+                phrases.add(phrase.replace("'", "\u2019"))
+        self.phrases = tuple(sorted(phrases))
+        self.pattern = _trie_pattern(self.phrases)
+
+    def search(self, text):
+        """The first phrase found in `text`, or None."""
+        match = self.pattern.search(text.lower())
+        return match.group() if match else None
+
+CRISIS_MATCHER = CrisisMatcher(load_crisis_keywords())
+
 CRISIS_RESPONSE = (
     "I'm hearing that you're in a lot of pain right now. You are not alone. \n\n"
     "🚨 **Emergency Resources**:\n"
@@ -40,84 +112,205 @@ COPING_TOOLS = {
     )
 }
 
-# --- 3. Machine Learning Initialization ---
+# --- 3. Machine Learning Initialization (lazy) ---
+def intents_path():
+    return os.path.join(settings.BASE_DIR, 'core', 'intents.json')
+
+def index_dir():
+    # Where `manage.py build_ai_index` writes the compiled, mmap-able index.
+    return str(getattr(settings, 'AI_INDEX_DIR', os.path.join(settings.BASE_DIR, 'core', 'ai_index')))
+
+# numpy / scipy / scikit-learn are only imported (via .intent_index) the first
+# time the engine is needed, so migrate/check/admin processes never pay for them.
+
+def build_index():
+    """Fits a fresh index from intents.json (no artifact involved)."""
+    from .intent_index import IntentIndex, source_version
+
+    json_path = intents_path()
+    with open(json_path, 'r') as file:
+        data = json.load(file)
+    return IntentIndex.from_intents(data, version=source_version(json_path))
+
 def load_and_train_model():
     """
-    Loads the intents.json and trains a simple TF-IDF Vectorizer.
-    This runs once when the server starts.
+    Loads the compiled index if one was built from the current intents.json,
+    memory-mapping its arrays so all workers share the same pages. Otherwise
+    falls back to fitting the TF-IDF index in-process.
     """
-    json_path = os.path.join(settings.BASE_DIR, 'core', 'intents.json')
+    from .intent_index import IntentIndex, source_version
+
     try:
-        with open(json_path, 'r') as file:
-            data = json.load(file)
+        version = source_version(intents_path())
     except FileNotFoundError:
         print("ERROR: intents.json not found!")
-        return None, None, None
-
-    corpus = []
-    tags = []
-    
-    # Flatten the data for training
-    for intent in data['intents']:
-        for pattern in intent['patterns']:
-            corpus.append(pattern)
-            tags.append(intent['tag'])
-            
-    # Train the vectorizer
-    vectorizer = TfidfVectorizer().fit(corpus)
-    return data, vectorizer, tags
-
-# Initialize global model variables
-INTENT_DATA, VECTORIZER, TAGS = load_and_train_model()
-
-def get_ai_response(user_input):
-    if not VECTORIZER:
-        return "System Error: AI Brain not loaded."
+        return None
+
+    index = IntentIndex.load(index_dir(), expected_version=version)
+    if index is None:
+        print("AI index artifact missing or stale; fitting in-process (run `manage.py build_ai_index`).")
+        index = build_index()
+
+    if getattr(settings, 'AI_MATCH_MODE', 'exact') == 'ann':
+        index.enable_ann(
+            query_terms=getattr(settings, 'AI_ANN_QUERY_TERMS', 8),
+            postings_per_term=getattr(settings, 'AI_ANN_POSTINGS_PER_TERM', 2000),
+        )
+
+    cache_size = getattr(settings, 'AI_MATCH_CACHE_SIZE', 0)
+    if cache_size:
+        index.enable_cache(cache_size)
+    return index
+
+# Lazily initialized engine singleton (see get_index / warm_up).
+# A reload builds the new index off to the side and then rebinds _INDEX in one
+# assignment; requests that already hold the old index finish with it.
+_INDEX = None
+_INDEX_LOADED = False
+_INDEX_LOCK = threading.Lock()
+_RELOAD_LOCK = threading.Lock()
+_SOURCE_SIGNATURE = None
+_NEXT_SOURCE_CHECK = 0.0
+_RELOAD_COUNT = 0
+
+def _source_signature():
+    """Cheap stat-based fingerprint of intents.json and the artifact pointer."""
+    signature = []
+    for path in (intents_path(), os.path.join(index_dir(), 'CURRENT')):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def reload_index():
+    """
+    Rebuilds (or re-maps) the index from the current sources and atomically
+    swaps it in. Returns the new version, or None if another reload is running.
+    """
+    global _SOURCE_SIGNATURE, _RELOAD_COUNT
+    if not _RELOAD_LOCK.acquire(blocking=False):
+        return None
+    try:
+        signature = _source_signature()
+        index = load_and_train_model()
+        if index is None:
+            return None  # Keep serving the old index rather than going dark
+        _SOURCE_SIGNATURE = signature
+        swap_index(index)
+        _RELOAD_COUNT += 1
+        return index.version
+    finally:
+        _RELOAD_LOCK.release()
+
+def swap_index(index):
+    """Atomically makes `index` the active one (also used by benchmarks to inject corpora)."""
+    global _INDEX, _INDEX_LOADED
+    _INDEX = index
+    _INDEX_LOADED = True
 
-    # Convert user text to numbers
-    user_vec = VECTORIZER.transform([user_input])
-    
-    # Compare user text with all patterns in our "brain"
-    # (We re-transform the original corpus here for simplicity in this scale)
-    corpus_vectors = VECTORIZER.transform([p for intent in INTENT_DATA['intents'] for p in intent['patterns']])
-    similarities = cosine_similarity(user_vec, corpus_vectors)
-    
-    # Find the best match
-    best_match_index = np.argmax(similarities)
-    confidence = similarities[0][best_match_index]
+def _maybe_reload():
+    # At most one stat() pair per AI_INDEX_RELOAD_INTERVAL seconds per process
+    global _NEXT_SOURCE_CHECK
+    interval = getattr(settings, 'AI_INDEX_RELOAD_INTERVAL', None)
+    if not interval:
+        return
+    now = time.monotonic()
+    if now < _NEXT_SOURCE_CHECK:
+        return
+    _NEXT_SOURCE_CHECK = now + interval
+    if _source_signature() != _SOURCE_SIGNATURE and not _RELOAD_LOCK.locked():
+        threading.Thread(target=reload_index, name='ai-reload', daemon=True).start()
 
+def get_index():
+    """Returns the intent index, loading it on first use. Thread-safe."""
+    global _INDEX, _INDEX_LOADED, _SOURCE_SIGNATURE
+    if not _INDEX_LOADED:
+        with _INDEX_LOCK:
+            if not _INDEX_LOADED:
+                _SOURCE_SIGNATURE = _source_signature()
+                _INDEX = load_and_train_model()
+                _INDEX_LOADED = True
+    else:
+        _maybe_reload()
+    return _INDEX
+
+def model_status():
+    """Active model version, reload count and match-cache counters, for metrics."""
+    index = _INDEX
+    return {
+        "model_version": index.version if index else None,
+        "reloads": _RELOAD_COUNT,
+        "cache": index.cache_info() if index else None,
+    }
+
+def warm_up(background=True):
+    """
+    Loads the engine ahead of the first chat request (called at server start
+    when AI_WARMUP_ON_STARTUP is set). In the background the server can accept
+    connections meanwhile; an early AI request simply waits on the load lock.
+    """
+    if not background:
+        get_index()
+        return None
+    thread = threading.Thread(target=get_index, name='ai-warmup', daemon=True)
+    thread.start()
+    return thread
+
+CONFIDENCE_THRESHOLD = 0.3
+
+FALLBACK_RESPONSE = "I'm listening. Could you tell me a bit more about that? I want to understand better."
+
+BUSY_RESPONSE = "I'm here with you. Give me a moment and tell me a little more about how you're feeling."
+
+def _pick_response(index, matched_tag, confidence):
     # Threshold: If confidence is too low (< 0.3), the bot is confused
-    if confidence < 0.3:
+    if confidence < CONFIDENCE_THRESHOLD:
         return None
 
-    # Get the tag associated with the best match
-    matched_tag = TAGS[best_match_index]
-    
     # Return a random response from that tag
-    for intent in INTENT_DATA['intents']:
-        if intent['tag'] == matched_tag:
-            return {
-                "response": random.choice(intent['responses']),
-                "tag": matched_tag
-            }
-    return None
+    return {
+        "response": random.choice(index.responses[matched_tag]),
+        "tag": matched_tag
+    }
 
-def analyze_message(text):
-    text_lower = text.lower()
+def get_ai_response(user_input, index=None):
+    index = index or get_index()
+    if not index:
+        return "System Error: AI Brain not loaded."
 
-    # 1. Crisis Check (Priority #1)
-    for keyword in CRISIS_KEYWORDS:
-        if keyword in text_lower:
-            return {
-                "response": CRISIS_RESPONSE,
-                "mood_score": 1,
-                "emotion": "Crisis",
-                "action": "CRISIS"
-            }
-
-    # 2. AI Response (Priority #2)
-    ai_result = get_ai_response(text)
-    
+    # One sparse dot product against the precomputed corpus matrix (or an LRU hit);
+    # the reply itself is still drawn at random below
+    matched_tag, confidence = index.best_match(user_input)
+    return _pick_response(index, matched_tag, confidence)
+
+def _is_crisis(text):
+    return CRISIS_MATCHER.search(text) is not None
+
+def screen_crisis(text):
+    """Crisis result for `text`, or None. Pure regex: safe to run anywhere, never offloaded."""
+    return _crisis_result() if _is_crisis(text) else None
+
+def _crisis_result():
+    return {
+        "response": CRISIS_RESPONSE,
+        "mood_score": 1,
+        "emotion": "Crisis",
+        "action": "CRISIS"
+    }
+
+def busy_result():
+    """Served when the AI workers are saturated or too slow; flagged so clients can retry."""
+    return {
+        "response": BUSY_RESPONSE,
+        "mood_score": 5,
+        "emotion": "Neutral",
+        "action": "REPLY",
+        "degraded": True
+    }
+
+def _reply_result(ai_result):
     if ai_result:
         # Map tags to emotions for the UI
         emotion = "Neutral"
@@ -139,10 +332,52 @@ def analyze_message(text):
             "action": "REPLY"
         }
 
-    # 3. Fallback (If AI is confused)
+    # Fallback (If AI is confused)
     return {
-        "response": "I'm listening. Could you tell me a bit more about that? I want to understand better.",
+        "response": FALLBACK_RESPONSE,
         "mood_score": 5,
         "emotion": "Neutral",
         "action": "REPLY"
-    }
\ No newline at end of file
+    }
+
+def analyze_message(text):
+    # Pin one index for the whole request so a concurrent reload can't mix versions
+    index = get_index()
+
+    # 1. Crisis Check (Priority #1)
+    if _is_crisis(text):
+        result = _crisis_result()
+    else:
+        # 2. AI Response (Priority #2), 3. Fallback
+        result = _reply_result(get_ai_response(text, index))
+
+    result["model_version"] = index.version if index else None
+    return result
+
+def analyze_messages(texts):
+    """
+    Batch version of analyze_message. Crisis screening runs per item, then every
+    remaining text is vectorized and scored against the corpus in one pass.
+    Returns one result dict per input, in order.
+    """
+    results = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        if _is_crisis(text):
+            results[i] = _crisis_result()
+        else:
+            pending.append(i)
+
+    index = get_index()
+    if index:
+        matches = index.best_matches([texts[i] for i in pending])
+        for i, (matched_tag, confidence) in zip(pending, matches):
+            results[i] = _reply_result(_pick_response(index, matched_tag, confidence))
+    else:
+        for i in pending:
+            results[i] = _reply_result(None)
+
+    version = index.version if index else None
+    for result in results:
+        result["model_version"] = version
+    return results
@@ -0,0 +1,176 @@
+# core/ai_worker.py
+"""
+Runs AI classification in a small pool of worker PROCESSES.
+
+sklearn/numpy work holds the GIL for most of a request, so running it in the
+daphne process stalls the event loop that serves the chat websockets. The
+pool keeps that CPU work out of the server process. Requests beyond
+AI_WORKER_MAX_PENDING, or slower than AI_WORKER_TIMEOUT, get a fallback
+reply instead of queueing forever. Crisis screening is plain regex and always
+runs inline, so a saturated pool never delays a crisis response.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import ai_utils
+
+
+class AIUnavailable(Exception):
+    """The worker pool is saturated, timed out or crashed."""
+
+
+# (executor, slots): each pool has its own pending-request semaphore, so a
+# task finishing after a reset releases the semaphore it was admitted by
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _worker_init():
+    # Runs in each (spawned) worker: set Django up and load the index eagerly
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediprior_backend.settings')
+    import django
+    django.setup()
+    ai_utils.warm_up(background=False)
+
+
+def _worker_analyze(text):
+    return ai_utils.analyze_message(text)
+
+
+def _worker_analyze_batch(texts):
+    return ai_utils.analyze_messages(texts)
+
+
+def _worker_ping():
+    return ai_utils.model_status()
+
+
+def pool_size():
+    return getattr(settings, 'AI_WORKER_PROCESSES', 0)
+
+
+def _get_pool():
+    """Returns the current (executor, slots) pair, starting the pool on first use."""
+    global _POOL
+    pool = _POOL
+    if pool is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                # spawn, not fork: forking a threaded server process is unsafe
+                executor = ProcessPoolExecutor(
+                    max_workers=pool_size(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_worker_init,
+                )
+                _POOL = (executor, threading.BoundedSemaphore(getattr(settings, 'AI_WORKER_MAX_PENDING', 32)))
+            pool = _POOL
+    return pool
+
+
+def _reset_pool(broken):
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL[0] is broken:
+            _POOL = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(fn, *args):
+    """Queues fn(*args) on the pool, or raises AIUnavailable when the queue is full."""
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise AIUnavailable("AI request queue is full")
+    try:
+        future = pool.submit(fn, *args)
+    except (BrokenProcessPool, RuntimeError) as exc:
+        slots.release()
+        _reset_pool(pool)
+        raise AIUnavailable(str(exc)) from exc
+    # The slot stays taken until the worker actually finishes, even if the caller gave up
+    future.add_done_callback(lambda _: slots.release())
+    return pool, future
+
+
+def run(fn, *args, timeout=None):
+    """Blocking call into the pool (the calling thread waits without holding the GIL)."""
+    pool, future = _submit(fn, *args)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout as exc:
+        raise AIUnavailable("AI worker timed out") from exc
+    except BrokenProcessPool as exc:
+        _reset_pool(pool)
+        raise AIUnavailable("AI worker crashed") from exc
+
+
+async def run_async(fn, *args, timeout=None):
+    """Awaitable call into the pool; never blocks the event loop."""
+    pool, future = _submit(fn, *args)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError as exc:
+        raise AIUnavailable("AI worker timed out") from exc
+    except BrokenProcessPool as exc:
+        _reset_pool(pool)
+        raise AIUnavailable("AI worker crashed") from exc
+
+
+def _timeout():
+    return getattr(settings, 'AI_WORKER_TIMEOUT', 5)
+
+
+def _with_version(result):
+    # Inline crisis replies carry model_version like every other path. The
+    # index loaded in this process is used if there is one; loading it here
+    # would delay the crisis reply, so otherwise it stays None.
+    result["model_version"] = ai_utils.model_status()["model_version"]
+    return result
+
+
+def analyze(text):
+    """analyze_message() through the pool, with crisis screening inline and a fallback reply."""
+    crisis = ai_utils.screen_crisis(text)
+    if crisis:
+        return _with_version(crisis)
+    if not pool_size():
+        return ai_utils.analyze_message(text)
+    try:
+        return run(_worker_analyze, text, timeout=_timeout())
+    except AIUnavailable:
+        return ai_utils.busy_result()
+
+
+async def analyze_async(text):
+    """Async twin of analyze() for consumers running on the event loop."""
+    crisis = ai_utils.screen_crisis(text)
+    if crisis:
+        return _with_version(crisis)
+    if not pool_size():
+        return await asyncio.to_thread(ai_utils.analyze_message, text)
+    try:
+        return await run_async(_worker_analyze, text, timeout=_timeout())
+    except AIUnavailable:
+        return ai_utils.busy_result()
+
+
+def analyze_batch(texts):
+    """analyze_messages() through the pool. Raises AIUnavailable instead of degrading."""
+    if not pool_size():
+        return ai_utils.analyze_messages(texts)
+    return run(_worker_analyze_batch, texts, timeout=getattr(settings, 'AI_WORKER_BATCH_TIMEOUT', 60))
+
+
+def warm_up():
+    """Starts the pool (each worker loads the index) or, without a pool, loads it in-process."""
+    if not pool_size():
+        return ai_utils.warm_up()
+    pool, _ = _get_pool()
+    for _ in range(pool_size()):
+        pool.submit(_worker_ping)
+    return None
@@ -0,0 +1,87 @@
+# core/appointment_scheduler.py
+"""
+Marks BOOKED appointments whose end_time has passed as COMPLETED.
+
+Reads never write: AppointmentSerializer already reports such rows as
+COMPLETED, so this job only has to catch the stored status up eventually.
+Each server process runs it in a daemon thread every
+APPOINTMENT_SCHEDULER_INTERVAL seconds (see asgi.py). Deployments that set
+the interval to 0 must run `manage.py complete_appointments` from cron.
+
+The lookup walks the (status, end_time) index, and rows are updated in
+batches of APPOINTMENT_SCHEDULER_BATCH_SIZE so the SQLite write lock is
+only ever held briefly.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Appointment
+
+logger = logging.getLogger(__name__)
+
+_THREAD = None
+_STOP = threading.Event()
+
+
+def batch_size():
+    return getattr(settings, 'APPOINTMENT_SCHEDULER_BATCH_SIZE', 500)
+
+
+def due_appointments(now=None):
+    return Appointment.objects.filter(
+        status=Appointment.AppointmentStatus.BOOKED,
+        end_time__lt=now or timezone.now(),
+    )
+
+
+def complete_past_appointments(now=None, batch=None):
+    """Completes every appointment that has ended by `now`. Returns how many."""
+    now = now or timezone.now()
+    batch = batch or batch_size()
+    completed = 0
+    while True:
+        ids = list(due_appointments(now).order_by('end_time').values_list('id', flat=True)[:batch])
+        if not ids:
+            return completed
+        # Re-checks status, so a cancel that lands in between isn't overwritten
+        completed += due_appointments(now).filter(id__in=ids).update(
+            status=Appointment.AppointmentStatus.COMPLETED
+        )
+        if len(ids) < batch:
+            return completed
+
+
+def _run(interval):
+    while not _STOP.wait(interval):
+        try:
+            close_old_connections()
+            count = complete_past_appointments()
+            if count:
+                logger.info("Completed %d past appointments", count)
+        except Exception:
+            logger.exception("Appointment completion run failed")
+        finally:
+            close_old_connections()
+
+
+def start(interval=None):
+    """Starts the in-process scheduler thread (once per process). Returns it, or None if disabled."""
+    global _THREAD
+    interval = interval or getattr(settings, 'APPOINTMENT_SCHEDULER_INTERVAL', 0)
+    if not interval:
+        return None
+    if _THREAD is None or not _THREAD.is_alive():
+        _STOP.clear()
+        _THREAD = threading.Thread(target=_run, args=(interval,), name='appointment-scheduler', daemon=True)
+        _THREAD.start()
+    return _THREAD
+
+
+def stop():
+    _STOP.set()
+    if _THREAD is not None:
+        _THREAD.join()
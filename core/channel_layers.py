@@ -0,0 +1,368 @@
+# core/channel_layers.py
+"""
+Channel layer that works across worker processes on ONE host, with no
+external service: messages and group memberships live in a shared SQLite
+database in WAL mode.
+
+- Sends are INSERTs. Each process runs one poller per event loop. The poller
+  watches `PRAGMA data_version`, which changes whenever another connection
+  commits, so it queries only when something was written. It then pulls every
+  message for this process's channels in one batch.
+- An idle poller backs off from `poll_interval` (5ms) to `max_poll_interval`
+  (50ms), i.e. at most 20 cheap PRAGMA reads a second per event loop. The cost
+  is latency after a quiet spell: the first message from ANOTHER process can
+  wait up to max_poll_interval. Sends from this process wake the poller at once.
+- Messages for a channel that isn't being received yet are buffered until
+  they expire, then dropped with their queue, so channels that never receive
+  again (a closed socket still in a group) don't keep the poller running.
+- group_send fans out inside ONE transaction: one INSERT per member channel
+  that is under capacity. Full channels are skipped, as the in-memory and
+  Redis layers do.
+- Messages and memberships expire (`expiry`, `group_expiry`); expired rows
+  are swept periodically.
+- Messages are serialized as JSON, so they must be JSON-safe (ours are).
+
+Enable it with CHANNEL_LAYER_SQLITE_PATH (see settings); benchmark it with
+`manage.py bench_channel_layer`.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    inbox TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_inbox ON channel_messages (inbox, id);
+CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, expires);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+) WITHOUT ROWID;
+"""
+
+
+class _LoopState:
+    """Per-event-loop receive side: one poller feeding per-channel queues."""
+    def __init__(self):
+        self.queues = {}            # specific channel -> asyncio.Queue of (expires, message)
+        self.newest = {}            # specific channel -> expiry of its newest queued message
+        self.receivers = {}         # specific channel -> receive() calls waiting on it
+        self.plain_receivers = 0    # receive() calls waiting on non-specific channels
+        self.changed = asyncio.Event()
+        self.wake = asyncio.Event()  # set by local sends: skip the idle back-off
+        self.poller = None
+
+    def evict(self, now):
+        """Drops buffered queues nobody is receiving once their newest message has expired."""
+        for channel in [c for c, expires in self.newest.items() if expires <= now and c not in self.receivers]:
+            del self.queues[channel], self.newest[channel]
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 poll_interval=0.005, max_poll_interval=0.05, cleanup_interval=5, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.cleanup_interval = cleanup_interval
+        # Channels from new_channel() are "<prefix>.<client_prefix>!<id>"; everything
+        # before the "!" is this process's inbox
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self._inboxes = set()
+        self._loops = {}
+        # One connection, used only from this thread: SQLite calls never block the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self._db = None
+        self._data_version = None
+        self._local_commits = 0
+        self._seen_local_commits = 0
+        self._next_cleanup = 0.0
+
+    # --- Database (executor thread only) ---
+
+    def _connection(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')  # WAL: durable enough for transient messages
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def _write(self, fn, *args):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(db, *args)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        self._local_commits += 1
+        return result
+
+    def _has_changes(self):
+        """True when anything was committed since the last call (by any process)."""
+        version = self._connection().execute('PRAGMA data_version').fetchone()[0]
+        changed = version != self._data_version or self._local_commits != self._seen_local_commits
+        self._data_version = version
+        self._seen_local_commits = self._local_commits
+        return changed
+
+    def _backlog(self, db, channel, now):
+        return db.execute(
+            'SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires > ?', (channel, now)
+        ).fetchone()[0]
+
+    def _insert(self, db, channel, body, now):
+        if self._backlog(db, channel, now) >= self.get_capacity(channel):
+            raise ChannelFull(channel)
+        db.execute(
+            'INSERT INTO channel_messages (channel, inbox, body, expires) VALUES (?, ?, ?, ?)',
+            (channel, self.non_local_name(channel), body, now + self.expiry)
+        )
+
+    def _fan_out(self, db, group, body, now):
+        members = db.execute(
+            'SELECT channel FROM channel_groups WHERE group_name = ? AND expires > ?', (group, now)
+        ).fetchall()
+        rows = [
+            (channel, self.non_local_name(channel), body, now + self.expiry)
+            for (channel,) in members
+            if self._backlog(db, channel, now) < self.get_capacity(channel)
+        ]
+        db.executemany('INSERT INTO channel_messages (channel, inbox, body, expires) VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def _pop_inboxes(self, inboxes):
+        """Removes and returns every pending (channel, expires, body) for our inboxes, oldest first."""
+        db = self._connection()
+        marks = ','.join('?' * len(inboxes))
+        # Plain read first: an empty inbox never takes the write lock
+        if db.execute(f'SELECT 1 FROM channel_messages WHERE inbox IN ({marks}) LIMIT 1', inboxes).fetchone() is None:
+            return []
+
+        def pop(db):
+            rows = db.execute(
+                f'SELECT id, channel, expires, body FROM channel_messages WHERE inbox IN ({marks}) ORDER BY id', inboxes
+            ).fetchall()
+            if rows:
+                db.execute(f'DELETE FROM channel_messages WHERE inbox IN ({marks}) AND id <= ?', (*inboxes, rows[-1][0]))
+            return rows
+        return [row[1:] for row in self._write(pop)]
+
+    def _pop_channel(self, channel):
+        """Removes and returns the oldest live message on a (non-specific) channel, or None."""
+        db = self._connection()
+        now = time.time()
+        if db.execute('SELECT 1 FROM channel_messages WHERE channel = ? AND expires > ? LIMIT 1', (channel, now)).fetchone() is None:
+            return None
+
+        def pop(db):
+            row = db.execute(
+                'SELECT id, body FROM channel_messages WHERE channel = ? AND expires > ? ORDER BY id LIMIT 1', (channel, now)
+            ).fetchone()
+            if row:
+                db.execute('DELETE FROM channel_messages WHERE id = ?', (row[0],))
+            return row
+        row = self._write(pop)
+        return row[1] if row else None
+
+    def _tick(self):
+        self._cleanup()
+        return self._has_changes()
+
+    def _cleanup(self):
+        now = time.time()
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + self.cleanup_interval
+
+        def sweep(db):
+            db.execute('DELETE FROM channel_messages WHERE expires <= ?', (now,))
+            db.execute('DELETE FROM channel_groups WHERE expires <= ?', (now,))
+        self._write(sweep)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # --- Channel layer API ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        body = json.dumps(message)
+        await self._run(self._write, self._insert, channel, body, time.time())
+        self._wake()
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        state = self._loop_state()
+        if '!' not in channel:
+            return await self._receive_plain(channel, state)
+
+        queue = state.queues.get(channel)
+        if queue is None:
+            queue = state.queues[channel] = asyncio.Queue()
+        state.receivers[channel] = state.receivers.get(channel, 0) + 1
+        self._ensure_poller(state)
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires > time.time():
+                    return message
+        finally:
+            state.receivers[channel] -= 1
+            if not state.receivers[channel]:
+                del state.receivers[channel]
+                if queue.empty() and state.queues.get(channel) is queue:
+                    del state.queues[channel]
+                    state.newest.pop(channel, None)
+
+    async def _receive_plain(self, channel, state):
+        # Shared (non-specific) channels: any process may take the message
+        state.plain_receivers += 1
+        try:
+            self._ensure_poller(state)
+            while True:
+                changed = state.changed
+                body = await self._run(self._pop_channel, channel)
+                if body is not None:
+                    return json.loads(body)
+                await changed.wait()
+        finally:
+            state.plain_receivers -= 1
+
+    async def new_channel(self, prefix='specific'):
+        inbox = f'{prefix}.{self.client_prefix}!'
+        self._inboxes.add(inbox)
+        return f'{inbox}{uuid.uuid4().hex}'
+
+    # --- Receive side ---
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = _LoopState()
+        return state
+
+    def _ensure_poller(self, state):
+        if state.poller is None or state.poller.done():
+            state.poller = asyncio.get_running_loop().create_task(self._poll(state))
+
+    def _wake(self):
+        state = self._loops.get(asyncio.get_running_loop())
+        if state is not None:
+            state.wake.set()
+
+    async def _poll(self, state):
+        # Runs while this loop has receivers or buffered messages. A fresh poller
+        # always drains once, since commits may have landed while none was running.
+        changed = True
+        delay = self.poll_interval
+        try:
+            while True:
+                state.evict(time.time())
+                if not (state.receivers or state.plain_receivers or state.queues):
+                    return
+                if changed:
+                    inboxes = sorted(self._inboxes)
+                    rows = await self._run(self._pop_inboxes, inboxes) if inboxes else []
+                    self._dispatch(state, rows)
+                    # Wake plain receivers to retry their channel
+                    state.changed.set()
+                    state.changed = asyncio.Event()
+                    delay = self.poll_interval
+                else:
+                    try:
+                        await asyncio.wait_for(state.wake.wait(), delay)
+                    except asyncio.TimeoutError:
+                        delay = min(delay * 2, self.max_poll_interval)
+                    else:
+                        delay = self.poll_interval
+                    state.wake.clear()
+                changed = await self._run(self._tick)
+        finally:
+            state.poller = None
+
+    def _dispatch(self, state, rows):
+        now = time.time()
+        for channel, expires, body in rows:
+            if expires <= now:
+                continue
+            queue = state.queues.get(channel)
+            if queue is None:
+                # Arrived before the consumer started receiving; buffer it until it expires
+                queue = state.queues[channel] = asyncio.Queue()
+            if queue.qsize() < self.get_capacity(channel):
+                queue.put_nowait((expires, json.loads(body)))
+                state.newest[channel] = max(expires, state.newest.get(channel, 0))
+
+    # --- Groups extension ---
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        def add(db):
+            db.execute(
+                'INSERT OR REPLACE INTO channel_groups (group_name, channel, expires) VALUES (?, ?, ?)',
+                (group, channel, time.time() + self.group_expiry)
+            )
+        await self._run(self._write, add)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+
+        def discard(db):
+            db.execute('DELETE FROM channel_groups WHERE group_name = ? AND channel = ?', (group, channel))
+        await self._run(self._write, discard)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        body = json.dumps(message)
+        await self._run(self._write, self._fan_out, group, body, time.time())
+        self._wake()
+
+    # --- Flush extension ---
+
+    async def flush(self):
+        def clear(db):
+            db.execute('DELETE FROM channel_messages')
+            db.execute('DELETE FROM channel_groups')
+        await self._run(self._write, clear)
+        for state in self._loops.values():
+            state.queues.clear()
+            state.newest.clear()
+
+    async def close(self):
+        def close_db():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        await self._run(close_db)
@@ -0,0 +1,110 @@
+# core/chat_state.py
+"""
+Chat state kept out of the per-message database path: recent-message state
+for ChatConsumer's spam rules, and the pushed doctor chat_status.
+
+Each socket keeps a sliding window of the conversation's last few messages
+(seeded once on connect, then fed by the messages it relays). The "tail" of
+that window -- the last message's id, who sent it, what it said, and how many
+in a row they've sent -- is also written to a shared cache (CHAT_STATE_CACHE)
+on every send, so the limits hold across a user's other sockets and, with a
+shared cache backend, across worker processes.
+
+The cached tail is only a hint: a per-process cache misses sends made through
+other workers, so it can lag behind what this socket has already relayed.
+Whichever of the two tails ends at the newer message id wins (see newest).
+"""
+from collections import deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+
+# The rules only ever look at the last 5 messages
+WINDOW = 5
+
+
+def _cache():
+    return caches[getattr(settings, 'CHAT_STATE_CACHE', 'default')]
+
+
+def _key(conversation_id):
+    return f'chat:tail:{conversation_id}'
+
+
+class MessageWindow:
+    """The last WINDOW (id, sender_id, lowercased content) triples of a conversation, newest last."""
+    def __init__(self, messages=()):
+        self.messages = deque(maxlen=WINDOW)
+        for message_id, sender_id, content in messages:
+            self.push(message_id, sender_id, content)
+
+    def push(self, message_id, sender_id, content):
+        self.messages.append((int(message_id), sender_id, (content or '').lower()))
+
+    def tail(self):
+        if not self.messages:
+            return None
+        message_id, sender_id, content = self.messages[-1]
+        streak = 0
+        for _, sender, _ in reversed(self.messages):
+            if sender != sender_id:
+                break
+            streak += 1
+        return {'id': message_id, 'sender_id': sender_id, 'content': content, 'streak': streak}
+
+
+def next_tail(tail, message_id, sender_id, content):
+    """The tail after `sender_id` sends `content` as message `message_id`."""
+    streak = tail['streak'] + 1 if tail and tail['sender_id'] == sender_id else 1
+    return {'id': int(message_id), 'sender_id': sender_id, 'content': content.lower(), 'streak': min(streak, WINDOW)}
+
+
+def newest(*tails):
+    """The tail ending at the newest message; a stale cached tail never outranks the socket's own window."""
+    return max((tail for tail in tails if tail), key=lambda tail: tail.get('id', 0), default=None)
+
+
+def check_rules(tail, user_id, content):
+    """Same rules as before: no repeating your last message, at most 5 in a row without a reply."""
+    if not tail or tail['sender_id'] != user_id:
+        return None
+    if tail['content'] == content.lower():
+        return {'blocked': True, 'code': 'spam', 'message': "Repetitive message."}
+    if tail['streak'] >= WINDOW:
+        return {'blocked': True, 'code': 'limit_reached', 'message': "Please wait for response."}
+    return None
+
+
+async def get_tail(conversation_id):
+    return await _cache().aget(_key(conversation_id))
+
+
+async def set_tail(conversation_id, tail):
+    await _cache().aset(_key(conversation_id), tail, getattr(settings, 'CHAT_STATE_TTL', 24 * 60 * 60))
+
+
+async def seed_tail(conversation_id, tail):
+    """Publishes a socket's DB-seeded tail unless another socket already has a fresher one."""
+    if tail:
+        await _cache().aadd(_key(conversation_id), tail, getattr(settings, 'CHAT_STATE_TTL', 24 * 60 * 60))
+
+
+# --- Doctor chat_status ---
+# Every chat socket involving a doctor joins that doctor's status group and
+# caches the status it loaded on connect; a change is pushed, never polled.
+
+def doctor_status_group(doctor_id):
+    return f'doctor_status_{doctor_id}'
+
+
+def broadcast_doctor_status(doctor_id, status):
+    """Tells every open chat with `doctor_id` about a new chat_status (sync; for views)."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        doctor_status_group(doctor_id),
+        {'type': 'doctor_status', 'doctor_id': doctor_id, 'status': status}
+    )
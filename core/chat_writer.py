@@ -0,0 +1,270 @@
+# core/chat_writer.py
+"""
+Optional write-behind persistence for chat messages (CHAT_WRITE_BEHIND).
+
+With it on, ChatConsumer gives each new message its id and timestamp in
+memory and fans it out at once. A background task on the event loop then
+saves queued messages with bulk_create in small batches: every
+CHAT_WRITE_BEHIND_INTERVAL seconds, or sooner once CHAT_WRITE_BEHIND_BATCH_SIZE
+are waiting. Bursts then cost one INSERT per batch instead of one round-trip
+per message.
+
+- A failed batch is retried; if it keeps failing, rows are saved one by one
+  so only the bad ones are lost. Each lost message's sender is sent a
+  'chat_message_failed' event. A row already stored under a message's id
+  only counts as that message if it is the same message (an earlier attempt
+  that did commit); anything else is an id collision and the message is lost.
+- Whatever is still queued at interpreter exit is flushed synchronously.
+- A message becomes visible to history queries once its batch is written,
+  i.e. within about one interval.
+- Run every worker with the same CHAT_WRITE_BEHIND setting: ids are only
+  ordered against each other, and against sequence ids issued before the
+  switch (see SnowflakeIds).
+- Each worker needs its own CHAT_WRITE_BEHIND_WORKER_ID. The pid-derived
+  default is only accepted with the in-process channel layer, i.e. a single
+  worker (see worker_id).
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Snowflake-style ids: 41 bits of ms since EPOCH_MS | 8 bits worker | 4 bits sequence.
+# 53 bits in all, so ids stay exact as JSON numbers in the browser. They grow
+# with time, so (timestamp, id) ordering and the clear-history watermark keep
+# working, and they sit far above the old autoincrement ids. A worker that
+# sends more than 16 messages in one millisecond borrows the next one.
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+WORKER_BITS = 8
+SEQUENCE_BITS = 4
+
+
+class SnowflakeIds:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id & ((1 << WORKER_BITS) - 1)
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now <= self._last_ms:
+                # Same millisecond (or the clock stepped back): stay monotonic
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    now += 1  # Sequence exhausted: borrow the next millisecond
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+class _Pending:
+    __slots__ = ('message', 'reply_channel', 'connection_id')
+
+    def __init__(self, message, reply_channel, connection_id):
+        self.message = message
+        self.reply_channel = reply_channel
+        self.connection_id = connection_id
+
+
+class MessageWriter:
+    def __init__(self, batch_size=100, flush_interval=0.05, retries=3, worker_id=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.ids = SnowflakeIds(os.getpid() if worker_id is None else worker_id)
+        self._lock = threading.Lock()
+        self._queue = []
+        self._inflight = []
+        self._wake = None
+        self._task = None
+        self._stopped = False
+        atexit.register(self.flush_sync)
+
+    def enqueue(self, conversation_id, sender_id, content, reply_channel=None, connection_id=None):
+        """Returns the (not yet saved) Message, with its final id and timestamp."""
+        from .models import Message
+
+        message = Message(
+            id=self.ids.next_id(), conversation_id=conversation_id, sender_id=sender_id,
+            content=content, timestamp=timezone.now()
+        )
+        with self._lock:
+            self._queue.append(_Pending(message, reply_channel, connection_id))
+            full = len(self._queue) >= self.batch_size
+        self._ensure_task()
+        if full:
+            self._wake.set()
+        return message
+
+    def latest_id(self, conversation_id):
+        """Newest queued or in-flight message id in a conversation, or None."""
+        with self._lock:
+            ids = [p.message.id for p in self._queue + self._inflight if p.message.conversation_id == conversation_id]
+        return max(ids, default=None)
+
+    # --- Background flusher ---
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def _take(self):
+        with self._lock:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            self._inflight = batch
+        return batch
+
+    async def flush(self):
+        """Saves everything queued so far, one bulk_create per batch."""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                await self._persist(batch)
+            finally:
+                with self._lock:
+                    self._inflight = []
+
+    async def _persist(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                await database_sync_to_async(self._write)(batch)
+                return
+            except Exception:
+                if attempt < self.retries:
+                    await asyncio.sleep(0.05 * 2 ** attempt)
+
+        # The batch keeps failing: save what can be saved, report the rest
+        failed = await database_sync_to_async(self._write_each)(batch)
+        channel_layer = get_channel_layer()
+        for pending in failed:
+            logger.error("Chat write-behind: message %s could not be saved", pending.message.id)
+            if pending.reply_channel and channel_layer is not None:
+                await channel_layer.send(pending.reply_channel, {
+                    'type': 'chat_message_failed',
+                    'connection_id': pending.connection_id,
+                    'id': pending.message.id,
+                })
+
+    def _write(self, batch):
+        from .models import Message
+
+        with transaction.atomic():
+            Message.objects.bulk_create([p.message for p in batch])
+            # SQLite and MySQL move the autoincrement past explicit ids themselves;
+            # sequence backends (PostgreSQL, Oracle) are moved here, so a message
+            # saved without write-behind never gets an id below ours
+            sequence_sql = connection.ops.sequence_reset_sql(no_style(), [Message])
+            if sequence_sql:
+                with connection.cursor() as cursor:
+                    for sql in sequence_sql:
+                        cursor.execute(sql)
+
+    def _write_each(self, batch):
+        failed = []
+        for pending in batch:
+            try:
+                self._write([pending])
+            except Exception:
+                if not self._already_saved(pending):
+                    failed.append(pending)
+        return failed
+
+    def _already_saved(self, pending):
+        """True if the row under this message's id is this very message, not another one that took its id."""
+        from .models import Message
+
+        message = pending.message
+        try:
+            return Message.objects.filter(
+                id=message.id, conversation_id=message.conversation_id,
+                sender_id=message.sender_id, content=message.content,
+            ).exists()
+        except Exception:
+            return False
+
+    def flush_sync(self):
+        """Durable shutdown flush (atexit): writes everything still queued or in flight."""
+        self._stopped = True
+        with self._lock:
+            # In-flight rows may already be committed; _write_each recognises them
+            remaining, self._queue, self._inflight = self._inflight + self._queue, [], []
+        for start in range(0, len(remaining), self.batch_size):
+            batch = remaining[start:start + self.batch_size]
+            try:
+                self._write(batch)
+            except Exception:
+                for pending in self._write_each(batch):
+                    logger.error("Chat write-behind: message %s lost at shutdown", pending.message.id)
+
+
+# Lazily created per process (see get_writer)
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+def worker_id():
+    """
+    CHAT_WRITE_BEHIND_WORKER_ID, or the pid when this is the only worker.
+
+    pids collide modulo 256 across processes, and two workers sharing an id
+    hand out the same message ids. Any channel layer other than the
+    in-process one means several workers, so an explicit id is required then.
+    """
+    value = getattr(settings, 'CHAT_WRITE_BEHIND_WORKER_ID', None)
+    if value is None:
+        backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND')
+        if backend != 'channels.layers.InMemoryChannelLayer':
+            raise ImproperlyConfigured(
+                "CHAT_WRITE_BEHIND needs a distinct CHAT_WRITE_BEHIND_WORKER_ID per worker "
+                f"when running several workers (channel layer {backend})."
+            )
+        return os.getpid()
+    if not 0 <= value < 1 << WORKER_BITS:
+        raise ImproperlyConfigured(f"CHAT_WRITE_BEHIND_WORKER_ID must be 0-{(1 << WORKER_BITS) - 1}, not {value}.")
+    return value
+
+
+def get_writer():
+    global _WRITER
+    if _WRITER is None:
+        with _WRITER_LOCK:
+            if _WRITER is None:
+                _WRITER = MessageWriter(
+                    batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100),
+                    flush_interval=getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL', 0.05),
+                    retries=getattr(settings, 'CHAT_WRITE_BEHIND_RETRIES', 3),
+                    worker_id=worker_id(),
+                )
+    return _WRITER
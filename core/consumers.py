@@ -2,55 +2,124 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from asgiref.sync import async_to_sync
-from .models import Conversation, Message, User, DoctorPatientConnection, DoctorProfile
-from django.db.models import Count
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from .models import Message, DoctorPatientConnection, DoctorProfile, ConversationClearMark
+from django.db.models import Q
+from .ai_utils import COPING_TOOLS
+from . import ai_worker, chat_state, chat_writer
+
+class ChatRoom:
+    """
+    One conversation as seen from one user's socket: what a socket resolves
+    once and keeps in memory (ids, group, doctor status, spam-rule window).
+    """
+    def __init__(self, connection, doctor_chat_status):
+        self.connection_id = connection.id
+        self.patient_id = connection.patient_id
+        self.doctor_id = connection.doctor_id
+        self.conversation_id = connection.get_or_create_conversation_id()
+        self.group_name = f'chat_{connection.id}'
+        self.doctor_chat_status = doctor_chat_status
+        self.window = None  # Seeded on first send (see ensure_window)
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    # ... (connect, disconnect, receive, chat_message are unchanged) ...
+    """
+    ws/chat/<connection_id>/: one socket per conversation. Everything below
+    works on ChatRoom objects in self.rooms, so UserChatConsumer reuses it
+    with many rooms on one socket.
+    """
+    # Multiplexed sockets tag every frame with its connection_id
+    multiplexed = False
+
     async def connect(self):
         self.user = self.scope['user']
+        self.rooms = {}
         if not self.user or self.user.is_anonymous:
             await self.close()
             return
-        self.connection_id = self.scope['url_route']['kwargs']['connection_id']
-        self.room_group_name = f'chat_{self.connection_id}'
+        connection_id = int(self.scope['url_route']['kwargs']['connection_id'])
 
-        if not await self.is_user_participant(self.user, self.connection_id):
+        # Resolves participation and the conversation once; both are cached for the socket's lifetime
+        room = await self.load_room(connection_id)
+        if room is None:
             await self.close()
             return
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.join(room)
         await self.accept()
-        await self.send_message_history()
+        await self.send_message_history(room)
+        await self.send_doctor_status(room.doctor_id, room.doctor_chat_status)
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        for room in self.rooms.values():
+            await self.channel_layer.group_discard(room.group_name, self.channel_name)
+        for doctor_id in {room.doctor_id for room in self.rooms.values()}:
+            await self.channel_layer.group_discard(chat_state.doctor_status_group(doctor_id), self.channel_name)
+
+    async def join(self, room):
+        known_doctor = any(other.doctor_id == room.doctor_id for other in self.rooms.values())
+        self.rooms[room.connection_id] = room
+        await self.channel_layer.group_add(room.group_name, self.channel_name)
+        if not known_doctor:
+            await self.channel_layer.group_add(chat_state.doctor_status_group(room.doctor_id), self.channel_name)
+
+    async def room_for(self, data):
+        return next(iter(self.rooms.values()), None)
+
+    async def send_frame(self, room, payload):
+        if self.multiplexed:
+            payload = {'connection_id': room.connection_id, **payload}
+        await self.send(text_data=json.dumps(payload))
 
     async def receive(self, text_data):
         data = json.loads(text_data)
-        
-        # --- 1. HANDLE CLEAR HISTORY (SOFT DELETE) ---
+        room = await self.room_for(data)
+        if room is None:
+            return
+
+        # --- 1. PAGE BACK THROUGH HISTORY ---
+        if data.get('command') == 'load_older':
+            await self.send_message_history(room, before=data.get('before'))
+            return
+
+        # --- 2. HANDLE CLEAR HISTORY (SOFT DELETE) ---
         if data.get('command') == 'clear_history':
-            await self.soft_delete_history()
+            await self.soft_delete_history(room)
             # Send 'cleared' event ONLY to the user who cleared it
-            await self.send(text_data=json.dumps({'type': 'cleared'}))
+            await self.send_frame(room, {'type': 'cleared'})
             return
 
         message_content = data.get('message', '').strip()
         if not message_content: return
 
+        # The shared tail may be ahead (another socket's send not relayed yet) or
+        # behind (a per-process cache missing other workers' sends): take the newer
+        await self.ensure_window(room)
+        tail = chat_state.newest(await chat_state.get_tail(room.conversation_id), room.window.tail())
+
         if self.user.user_type == 'PATIENT':
-            check = await self.check_spam_rules(message_content)
+            check = await self.check_spam_rules(room, message_content, tail)
             if check['blocked']:
-                await self.send(text_data=json.dumps({'type': 'error', 'code': check['code'], 'message': check['message']}))
+                await self.send_frame(room, {'type': 'error', 'code': check['code'], 'message': check['message']})
                 return 
 
-        new_message = await self.create_new_message(message_content)
+        if chat_writer.enabled():
+            # Id and timestamp are assigned in memory; the INSERT is batched in the background
+            new_message = chat_writer.get_writer().enqueue(
+                room.conversation_id, self.user.id, message_content,
+                reply_channel=self.channel_name, connection_id=room.connection_id
+            )
+        else:
+            new_message = await self.create_new_message(room, message_content)
+        await chat_state.set_tail(room.conversation_id, chat_state.next_tail(tail, new_message.id, self.user.id, message_content))
         await self.channel_layer.group_send(
-            self.room_group_name,
+            room.group_name,
             {
                 'type': 'chat_message',
+                'connection_id': room.connection_id,
+                'id': new_message.id,
                 'message': new_message.content,
                 'sender_id': self.user.id,
                 'timestamp': new_message.timestamp.isoformat(),
@@ -58,77 +127,237 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        room = self.rooms.get(event['connection_id'])
+        if room is None:
+            return
+        if room.window is not None:
+            room.window.push(event['id'], event['sender_id'], event['message'])
+        await self.send_frame(room, {
             'type': 'message',
+            'id': event['id'],
             'message': event['message'],
             'sender_id': event['sender_id'],
             'timestamp': event['timestamp'],
-        }))
+        })
 
-    # --- Logic Helpers (Unchanged) ---
-    @database_sync_to_async
-    def check_spam_rules(self, new_content):
-        # ... (Same spam logic as before) ...
-        try:
-            connection = DoctorPatientConnection.objects.get(id=self.connection_id)
-            doctor_profile = connection.doctor.doctor_profile
-            if doctor_profile.chat_status == 'BUSY': return {'blocked': True, 'code': 'busy', 'message': "Doctor is currently unavailable."}
-            if doctor_profile.chat_status == 'OFFLINE': return {'blocked': True, 'code': 'offline', 'message': "Doctor is currently Offline."}
-            
-            conversation = self._get_conversation_sync()
-            last_messages = conversation.messages.order_by('-timestamp')[:5]
-            if last_messages and last_messages[0].sender == self.user:
-                if last_messages[0].content.lower() == new_content.lower(): return {'blocked': True, 'code': 'spam', 'message': "Repetitive message."}
-            consecutive = 0
-            for msg in last_messages:
-                if msg.sender == self.user: consecutive += 1
-                else: break
-            if consecutive >= 5: return {'blocked': True, 'code': 'limit_reached', 'message': "Please wait for response."}
-            return {'blocked': False}
-        except: return {'blocked': False}
-
-    def _get_conversation_sync(self):
-        connection = DoctorPatientConnection.objects.get(id=self.connection_id)
-        conversation = Conversation.objects.annotate(count=Count('participants')).filter(count=2, participants=connection.patient).filter(participants=connection.doctor).first()
-        if not conversation:
-            conversation = Conversation.objects.create()
-            conversation.participants.set([connection.patient, connection.doctor])
-            conversation.save()
-        return conversation
+    async def chat_message_failed(self, event):
+        # Write-behind gave up on one of this socket's messages
+        room = self.rooms.get(event['connection_id'])
+        if room is None:
+            return
+        await self.send_frame(room, {'type': 'error', 'code': 'not_saved', 'id': event['id'], 'message': "Message could not be saved."})
+
+    async def doctor_status(self, event):
+        # Pushed by ProfileView when the doctor changes chat_status
+        for room in self.rooms.values():
+            if room.doctor_id == event['doctor_id']:
+                room.doctor_chat_status = event['status']
+        await self.send_doctor_status(event['doctor_id'], event['status'])
+
+    async def send_doctor_status(self, doctor_id, status):
+        # One frame per doctor, even when the socket has many rooms with them
+        await self.send(text_data=json.dumps({'type': 'doctor_status', 'doctor_id': doctor_id, 'status': status}))
+
+    # --- Logic Helpers ---
+    async def check_spam_rules(self, room, new_content, tail):
+        # Both checks use socket-local state: no queries per message
+        if room.doctor_chat_status == 'BUSY': return {'blocked': True, 'code': 'busy', 'message': "Doctor is currently unavailable."}
+        if room.doctor_chat_status == 'OFFLINE': return {'blocked': True, 'code': 'offline', 'message': "Doctor is currently Offline."}
+        return chat_state.check_rules(tail, self.user.id, new_content) or {'blocked': False}
+
+    async def ensure_window(self, room):
+        # Seed the spam-rule window once; after this it's fed by relayed messages
+        if room.window is None:
+            room.window = await self.load_window(room)
+            await chat_state.seed_tail(room.conversation_id, room.window.tail())
 
     @database_sync_to_async
-    def get_conversation(self): return self._get_conversation_sync()
+    def load_window(self, room):
+        recent = Message.objects.filter(conversation_id=room.conversation_id).order_by('-timestamp', '-id').values_list('id', 'sender_id', 'content')[:chat_state.WINDOW]
+        return chat_state.MessageWindow(reversed(list(recent)))
 
     @database_sync_to_async
-    def is_user_participant(self, user, connection_id):
+    def load_room(self, connection_id, accepted_only=False):
         try:
             connection = DoctorPatientConnection.objects.get(id=connection_id)
-            return user == connection.patient or user == connection.doctor
-        except: return False
+        except DoctorPatientConnection.DoesNotExist:
+            return None
+        if self.user.id not in (connection.patient_id, connection.doctor_id):
+            return None
+        if accepted_only and connection.status != DoctorPatientConnection.ConnectionStatus.ACCEPTED:
+            return None
+        chat_status = DoctorProfile.objects.filter(user_id=connection.doctor_id).values_list('chat_status', flat=True).first()
+        return ChatRoom(connection, chat_status)
+
+    # --- History: latest page on connect, older pages on demand ---
+    async def send_message_history(self, room, before=None):
+        """
+        Sends one page of history, oldest first. Without `before` it's the latest
+        page (sent on connect); with a {'timestamp', 'id'} cursor (the oldest
+        message the client has) it's the page just before it, as 'older_history'.
+        """
+        if before is not None:
+            try:
+                before = (parse_datetime(before['timestamp']), int(before['id']))
+            except (KeyError, TypeError, ValueError):
+                before = None
+            if before is None or before[0] is None:
+                await self.send_frame(room, {'type': 'error', 'code': 'bad_cursor', 'message': "Invalid history cursor."})
+                return
+
+        messages, has_more = await self.get_message_page(room, before)
+        await self.send_frame(room, {
+            'type': 'history' if before is None else 'older_history',
+            'messages': messages,
+            'has_more': has_more,
+        })
 
-    # --- UPDATED: Filter deleted messages ---
     @database_sync_to_async
-    def send_message_history(self):
-        conversation = async_to_sync(self.get_conversation)()
-        if not conversation: return
-        
-        # Exclude messages where the current user is in the 'deleted_by' list
-        messages = conversation.messages.exclude(deleted_by=self.user).order_by('timestamp')
-        
-        message_list = []
-        for msg in messages:
-            message_list.append({'type': 'message', 'message': msg.content, 'sender_id': msg.sender.id, 'timestamp': msg.timestamp.isoformat()})
-        async_to_sync(self.send)(text_data=json.dumps({'type': 'history', 'messages': message_list}))
+    def get_message_page(self, room, before=None):
+        page_size = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+
+        # Hide everything up to this user's "clear history" watermark (indexed range predicate)
+        cleared_up_to = ConversationClearMark.objects.filter(
+            conversation_id=room.conversation_id, user_id=self.user.id
+        ).values_list('cleared_up_to', flat=True).first() or 0
+        messages = Message.objects.filter(conversation_id=room.conversation_id, id__gt=cleared_up_to)
+        if before is not None:
+            # Keyset pagination on (timestamp, id): constant cost at any depth
+            timestamp, message_id = before
+            messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+        rows = list(
+            messages.order_by('-timestamp', '-id')
+            .values('id', 'content', 'sender_id', 'timestamp')[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+
+        message_list = [
+            {'type': 'message', 'id': row['id'], 'message': row['content'], 'sender_id': row['sender_id'], 'timestamp': row['timestamp'].isoformat()}
+            for row in rows
+        ]
+        return message_list, has_more
 
     @database_sync_to_async
-    def create_new_message(self, content):
-        conversation = async_to_sync(self.get_conversation)()
-        return Message.objects.create(conversation=conversation, sender=self.user, content=content)
+    def create_new_message(self, room, content):
+        # A single INSERT: the conversation id is already cached on the room
+        return Message.objects.create(conversation_id=room.conversation_id, sender_id=self.user.id, content=content)
 
     # --- NEW: Soft Delete ---
     @database_sync_to_async
-    def soft_delete_history(self):
-        conversation = async_to_sync(self.get_conversation)()
-        if conversation:
-            for msg in conversation.messages.all():
-                msg.deleted_by.add(self.user)
\ No newline at end of file
+    def soft_delete_history(self, room):
+        # O(1): move the watermark to the newest message instead of marking each one
+        last_id = Message.objects.filter(conversation_id=room.conversation_id).order_by('-id').values_list('id', flat=True).first()
+        if chat_writer.enabled():
+            # Also cover messages still waiting in the write-behind queue
+            pending_id = chat_writer.get_writer().latest_id(room.conversation_id)
+            if pending_id is not None:
+                last_id = max(last_id or 0, pending_id)
+        if last_id is None:
+            return
+        ConversationClearMark.objects.update_or_create(
+            conversation_id=room.conversation_id, user_id=self.user.id,
+            defaults={'cleared_up_to': last_id}
+        )
+
+
+class UserChatConsumer(ChatConsumer):
+    """
+    ws/chat/: ONE socket per user, subscribed to all of their accepted
+    connections (e.g. a doctor dashboard). Every frame in either direction
+    carries the connection_id it belongs to. Nothing but a 'rooms' frame is
+    pushed on connect; clients ask for each conversation's history with
+    {'command': 'load_history', 'connection_id': ...}.
+    """
+    multiplexed = True
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.rooms = {}
+        if not self.user or self.user.is_anonymous:
+            await self.close()
+            return
+
+        for room in await self.load_rooms():
+            await self.join(room)
+        await self.accept()
+        await self.send(text_data=json.dumps({
+            'type': 'rooms',
+            'rooms': [
+                {'connection_id': room.connection_id, 'doctor_id': room.doctor_id, 'patient_id': room.patient_id, 'doctor_status': room.doctor_chat_status}
+                for room in self.rooms.values()
+            ],
+        }))
+
+    async def room_for(self, data):
+        try:
+            connection_id = int(data.get('connection_id'))
+        except (TypeError, ValueError):
+            connection_id = None
+        room = self.rooms.get(connection_id)
+        if room is None and connection_id is not None:
+            # Connection accepted after this socket opened: subscribe on first use
+            room = await self.load_room(connection_id, accepted_only=True)
+            if room is not None:
+                await self.join(room)
+        if room is None:
+            await self.send(text_data=json.dumps({'type': 'error', 'code': 'unknown_connection', 'connection_id': data.get('connection_id'), 'message': "Not a chat you belong to."}))
+        return room
+
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        if data.get('command') == 'load_history':
+            room = await self.room_for(data)
+            if room is not None:
+                await self.send_message_history(room)
+            return
+        await super().receive(text_data)
+
+    @database_sync_to_async
+    def load_rooms(self):
+        # One query for the connections, one for their doctors' statuses
+        connections = list(DoctorPatientConnection.objects.filter(
+            Q(patient_id=self.user.id) | Q(doctor_id=self.user.id),
+            status=DoctorPatientConnection.ConnectionStatus.ACCEPTED
+        ))
+        statuses = dict(DoctorProfile.objects.filter(
+            user_id__in={connection.doctor_id for connection in connections}
+        ).values_list('user_id', 'chat_status'))
+        return [ChatRoom(connection, statuses.get(connection.doctor_id)) for connection in connections]
+
+
+class AIChatConsumer(AsyncWebsocketConsumer):
+    """
+    Websocket twin of AIChatView. Classification is awaited on the AI worker
+    pool, so a busy AI companion never stalls the event loop shared with ChatConsumer.
+    """
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user or self.user.is_anonymous:
+            await self.close()
+            return
+        await self.accept()
+
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        tool_request = data.get('tool')
+        user_message = (data.get('message') or '').strip()
+
+        # If user clicked a tool button
+        if tool_request and tool_request in COPING_TOOLS:
+            await self.send(text_data=json.dumps({
+                "response": COPING_TOOLS[tool_request],
+                "mood_score": 5,
+                "emotion": "Calm",
+                "action": "TOOL"
+            }))
+            return
+
+        if not user_message:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': "Message is required"}))
+            return
+
+        result = await ai_worker.analyze_async(user_message)
+        await self.send(text_data=json.dumps(result))
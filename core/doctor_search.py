@@ -0,0 +1,145 @@
+# core/doctor_search.py
+"""
+Full-text search over the doctor directory (name, specialization,
+qualification, hospital_name, bio).
+
+- SQLite: an external-content FTS5 table kept in sync by triggers, ranked by bm25.
+- PostgreSQL: a GIN expression index on to_tsvector('simple', ...), ranked by ts_rank.
+- Anything else (or SQLite built without FTS5): AND of icontains per word, unranked.
+
+Search terms are reduced to plain words and matched as prefixes
+("card" finds "Cardiology"), so user input never reaches the query syntax.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_FIELDS = ('name', 'specialization', 'qualification', 'hospital_name', 'bio')
+
+FTS_TABLE = 'core_doctorprofile_fts'
+
+SQLITE_FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, specialization, qualification, hospital_name, bio,
+        content='core_doctorprofile', content_rowid='user_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON core_doctorprofile BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES (new.user_id, new.name, new.specialization, new.qualification, new.hospital_name, new.bio);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON core_doctorprofile BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES ('delete', old.user_id, old.name, old.specialization, old.qualification, old.hospital_name, old.bio);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON core_doctorprofile BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES ('delete', old.user_id, old.name, old.specialization, old.qualification, old.hospital_name, old.bio);
+        INSERT INTO {FTS_TABLE} (rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES (new.user_id, new.name, new.specialization, new.qualification, new.hospital_name, new.bio);
+    END""",
+]
+
+POSTGRES_DOCUMENT = "to_tsvector('simple', " + " || ' ' || ".join(
+    f'coalesce("core_doctorprofile"."{field}", \'\')' for field in SEARCH_FIELDS
+) + ")"
+
+POSTGRES_INDEX_SQL = f'CREATE INDEX IF NOT EXISTS core_doctorprofile_search_idx ON core_doctorprofile USING GIN (({POSTGRES_DOCUMENT}))'
+
+
+def install_search_index(conn):
+    """
+    Creates the vendor's search index if it's missing (idempotent). Run by the
+    migration and again after every migrate: SQLite drops triggers whenever
+    Django rebuilds core_doctorprofile for a later AlterField.
+    """
+    if conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", [f'{FTS_TABLE}_a%']
+            )
+            if cursor.fetchone()[0] == 3:
+                return
+            try:
+                for statement in SQLITE_FTS_SQL:
+                    cursor.execute(statement)
+            except Exception as error:
+                if 'fts5' not in str(error):
+                    raise
+                return  # SQLite built without FTS5: search falls back to icontains
+            # (Re)index everything the triggers may have missed
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+    elif conn.vendor == 'postgresql':
+        with conn.cursor() as cursor:
+            cursor.execute(POSTGRES_INDEX_SQL)
+
+
+def repair_search_index(sender=None, using='default', **kwargs):
+    """post_migrate: restores the SQLite triggers if a table rebuild dropped them."""
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor == 'sqlite' and FTS_TABLE in conn.introspection.table_names():
+        install_search_index(conn)
+
+
+def remove_search_index(conn):
+    if conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif conn.vendor == 'postgresql':
+        with conn.cursor() as cursor:
+            cursor.execute('DROP INDEX IF EXISTS core_doctorprofile_search_idx')
+
+
+_FTS_AVAILABLE = None
+
+
+def _sqlite_fts_available():
+    global _FTS_AVAILABLE
+    if _FTS_AVAILABLE is None:
+        _FTS_AVAILABLE = FTS_TABLE in connection.introspection.table_names()
+    return _FTS_AVAILABLE
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text or '')[:10]
+
+
+def search_doctors(queryset, text):
+    """
+    Filters a DoctorProfile queryset to `text` matches. Returns (queryset, ranked).
+    When ranked, rows carry `search_rank`, where lower is a better match.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset, False
+
+    if connection.vendor == 'sqlite' and _sqlite_fts_available():
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # Joined rather than a correlated subquery: one MATCH for the whole
+        # query instead of one per candidate row
+        queryset = queryset.filter(search_entry__isnull=False).filter(
+            RawSQL(f'"{FTS_TABLE}" MATCH %s', [match], output_field=BooleanField())
+        ).annotate(search_rank=F('search_entry__rank'))
+        return queryset, True
+
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        queryset = queryset.filter(
+            RawSQL(f"{POSTGRES_DOCUMENT} @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField())
+        ).annotate(search_rank=RawSQL(
+            f"-ts_rank({POSTGRES_DOCUMENT}, to_tsquery('simple', %s))", [tsquery], output_field=FloatField()
+        ))
+        return queryset, True
+
+    for term in terms:
+        any_field = Q()
+        for field in SEARCH_FIELDS:
+            any_field |= Q(**{f'{field}__icontains': term})
+        queryset = queryset.filter(any_field)
+    return queryset, False
@@ -1,6 +1,12 @@
-import pandas as pd
+import argparse
+import hashlib
+import itertools
 import json
 import os
+import tempfile
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
 
 # 1. Define the Conversational Intents (Small talk, greetings, etc.)
 conversational_intents = [
@@ -58,41 +64,129 @@ conversational_intents = [
     }
 ]
 
-def generate():
-    print("Generating intents.json...")
-    
-    # 2. Process the CSV Data
-    # Make sure Mental_Health_FAQ.csv is in the same folder!
-    try:
-        df = pd.read_csv('Mental_Health_FAQ.csv')
-        
-        csv_intents = []
-        for index, row in df.iterrows():
-            # Skip empty rows
-            if pd.isna(row['Questions']) or pd.isna(row['Answers']):
-                continue
-            
+def iter_csv_intents(csv_path, chunksize=50000, dedupe=True):
+    """
+    Streams one intent per FAQ row, reading the CSV in chunks so memory stays
+    bounded by the chunk size. Empty rows are dropped per chunk (vectorized),
+    and repeated questions (case/whitespace-insensitive) keep their first answer.
+    De-duplication remembers an 8-byte digest per distinct question.
+    """
+    seen = set()
+    reader = pd.read_csv(csv_path, chunksize=chunksize, usecols=['Question_ID', 'Questions', 'Answers'], dtype=str)
+    for chunk in reader:
+        # Skip empty rows
+        chunk = chunk.dropna(subset=['Questions', 'Answers'])
+        if dedupe:
+            keys = chunk['Questions'].str.lower().str.split().str.join(' ')
+            keep = ~keys.duplicated()
+            chunk, keys = chunk[keep], keys[keep]
+        else:
+            keys = itertools.repeat(None)
+
+        for question_id, question, answer, key in zip(chunk['Question_ID'], chunk['Questions'], chunk['Answers'], keys):
+            if dedupe:
+                digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+
             # Create an intent object for each row
-            intent = {
-                "tag": f"fact-{row['Question_ID']}",
-                "patterns": [row['Questions']],
-                "responses": [row['Answers']]
+            yield {
+                "tag": f"fact-{question_id}",
+                "patterns": [question],
+                "responses": [answer]
             }
-            csv_intents.append(intent)
-            
-        print(f"Processed {len(csv_intents)} Q&A pairs from CSV.")
 
-        # 3. Merge and Save
-        all_intents = conversational_intents + csv_intents
-        final_data = {"intents": all_intents}
 
-        with open('intents.json', 'w') as f:
-            json.dump(final_data, f, indent=4)
+class IntentsWriter:
+    """
+    Writes {"intents": [...]} incrementally, one intent per line, into a temp
+    file that replaces the target only when complete. Running servers hot-reload
+    intents.json, so they must never observe a half-written file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.intents-', suffix='.json', dir=os.path.dirname(os.path.abspath(self.path)))
+        self.file = os.fdopen(fd, 'w', encoding='utf-8')
+        self.file.write('{\n    "intents": [')
+        return self
+
+    def write(self, intent):
+        self.file.write(',\n        ' if self.count else '\n        ')
+        self.file.write(json.dumps(intent, ensure_ascii=False))
+        self.count += 1
+
+    def tee(self, intents):
+        """Writes each intent as it passes through, so one pass can also feed the index builder."""
+        for intent in intents:
+            self.write(intent)
+            yield intent
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.file.write('\n    ]\n}\n')
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
+
+
+def generate(csv_path=None, output_path=None, index_dir=None, chunksize=50000, dedupe=True):
+    csv_path = csv_path or os.path.join(HERE, 'Mental_Health_FAQ.csv')
+    output_path = output_path or os.path.join(HERE, 'intents.json')
+    print(f"Generating {output_path}...")
 
-        print(f"Success! 'intents.json' created with {len(all_intents)} total intents.")
-        
+    # 2. Process the CSV Data, 3. Merge and Save -- streamed, never held in memory at once
+    try:
+        with IntentsWriter(output_path) as writer:
+            intents = writer.tee(itertools.chain(conversational_intents, iter_csv_intents(csv_path, chunksize, dedupe)))
+            if index_dir:
+                index = _build_index(intents)
+            else:
+                for _ in intents:
+                    pass
     except FileNotFoundError:
-        print("Error: Could not find 'Mental_Health_FAQ.csv'. Please make sure it is in this folder.")
+        print(f"Error: Could not find '{csv_path}'. Please make sure it exists.")
+        return
+
+    print(f"Processed {writer.count - len(conversational_intents)} Q&A pairs from CSV.")
+    print(f"Success! '{output_path}' created with {writer.count} total intents.")
+
+    if index_dir:
+        index.version = _source_version(output_path)
+        path = index.save(index_dir)
+        print(f"Compiled AI index {index.version} ({len(index)} patterns) -> {path}")
+
+
+def _intent_index_module():
+    # Works both as `python -m core.generate_intents` and `python generate_intents.py`
+    try:
+        from . import intent_index
+    except ImportError:
+        import intent_index
+    return intent_index
+
+
+def _build_index(intents):
+    return _intent_index_module().IntentIndex.from_intent_stream(intents)
+
+
+def _source_version(path):
+    return _intent_index_module().source_version(path)
+
 
 if __name__ == "__main__":
-    generate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Builds intents.json from the conversational intents and the FAQ CSV.")
+    parser.add_argument('--csv', default=None, help="FAQ CSV (default: Mental_Health_FAQ.csv next to this script)")
+    parser.add_argument('--output', default=None, help="intents.json to write (default: next to this script)")
+    parser.add_argument('--index', default=None, metavar='DIR',
+                        help="Also compile the mmap-able AI index into DIR in the same pass (e.g. core/ai_index)")
+    parser.add_argument('--chunksize', type=int, default=50000, help="CSV rows per chunk")
+    parser.add_argument('--keep-duplicates', action='store_true', help="Don't drop repeated questions")
+    args = parser.parse_args()
+    generate(args.csv, args.output, args.index, args.chunksize, not args.keep_duplicates)
@@ -0,0 +1,442 @@
+# core/intent_index.py
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from array import array
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+# Bump when the on-disk layout changes so old artifacts are rebuilt, not misread.
+ARTIFACT_FORMAT = 2
+CURRENT_POINTER = 'CURRENT'
+# Upper bound on the dense (texts x patterns) score block best_matches() holds
+# at once; with 100k patterns that is ~80 texts per product.
+SCORE_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def normalize_text(text):
+    """
+    Cache key for a chat input. TfidfVectorizer lowercases and tokenizes on word
+    characters, so case and whitespace differences never change the match.
+    """
+    return ' '.join(text.lower().split())
+
+
+def source_version(path):
+    """Content hash of an intents file; identifies which corpus an index was built from."""
+    digest = hashlib.sha256(f'format-{ARTIFACT_FORMAT}:'.encode())
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class StringTable:
+    """
+    Read-only sequence of strings packed into one UTF-8 byte array plus an
+    offsets array. Saved as .npy files, so every worker maps the same pages
+    instead of holding its own Python strings. find() binary-searches by value:
+    through `order` (positions in sorted-string order) if given, otherwise the
+    table itself must be sorted.
+    """
+    def __init__(self, blob, offsets, order=None):
+        self.blob = blob          # uint8
+        self.offsets = offsets    # int64, len(self) + 1
+        self.order = order
+
+    @classmethod
+    def from_strings(cls, strings, sort=False):
+        strings = list(strings)
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        order = np.asarray(sorted(range(len(strings)), key=strings.__getitem__), dtype=np.int64) if sort else None
+        return cls(blob, offsets, order)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return bytes(self.blob[self.offsets[position]:self.offsets[position + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def find(self, value):
+        """Position of `value`, or None."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            position = middle if self.order is None else int(self.order[middle])
+            current = self[position]
+            if current == value:
+                return position
+            if current < value:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def save(self, directory, name):
+        np.save(os.path.join(directory, f'{name}.npy'), self.blob)
+        np.save(os.path.join(directory, f'{name}_offsets.npy'), self.offsets)
+        if self.order is not None:
+            np.save(os.path.join(directory, f'{name}_order.npy'), self.order)
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        def array(suffix):
+            return np.load(os.path.join(directory, f'{name}{suffix}.npy'), mmap_mode=mmap_mode)
+        order = array('_order') if os.path.exists(os.path.join(directory, f'{name}_order.npy')) else None
+        return cls(array(''), array('_offsets'), order)
+
+
+class TagResponses:
+    """tag -> [responses] over StringTables: all responses, plus each tag's [start, end) range in them."""
+    def __init__(self, tag_names, responses, ranges):
+        self.tag_names = tag_names    # StringTable with a sort order
+        self.responses = responses    # StringTable
+        self.ranges = ranges          # int64 (n_tags x 2)
+
+    @classmethod
+    def from_dict(cls, tag_names, responses):
+        ranges = np.zeros((len(tag_names), 2), dtype=np.int64)
+        flat = []
+        for position, tag in enumerate(tag_names):
+            ranges[position] = (len(flat), len(flat) + len(responses[tag]))
+            flat.extend(responses[tag])
+        return cls(StringTable.from_strings(tag_names, sort=True), StringTable.from_strings(flat), ranges)
+
+    def __getitem__(self, tag):
+        position = self.tag_names.find(tag)
+        if position is None:
+            raise KeyError(tag)
+        start, end = self.ranges[position]
+        return [self.responses[i] for i in range(start, end)]
+
+    def save(self, directory):
+        self.tag_names.save(directory, 'tags')
+        self.responses.save(directory, 'responses')
+        np.save(os.path.join(directory, 'response_ranges.npy'), self.ranges)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        return cls(
+            StringTable.load(directory, 'tags', mmap_mode),
+            StringTable.load(directory, 'responses', mmap_mode),
+            np.load(os.path.join(directory, 'response_ranges.npy'), mmap_mode=mmap_mode),
+        )
+
+
+class MappedVectorizer:
+    """
+    TfidfVectorizer.transform() for a loaded artifact: same tokenizer and the
+    same weighting (raw counts x idf, L2-normalized rows), but terms are found
+    by binary search in the mapped vocabulary rather than a per-process dict.
+    Recently seen terms are memoized in a small LRU.
+    """
+    def __init__(self, vocabulary, idf, lookup_cache=65536):
+        self.vocabulary = vocabulary  # StringTable of terms, sorted, so position == column
+        self.idf_ = idf
+        self._analyze = TfidfVectorizer().build_analyzer()
+        self._column = functools.lru_cache(maxsize=lookup_cache)(vocabulary.find)
+
+    def transform(self, texts):
+        indptr = [0]
+        indices = []
+        counts = []
+        for text in texts:
+            row = {}
+            for term in self._analyze(text):
+                column = self._column(term)
+                if column is not None:
+                    row[column] = row.get(column, 0) + 1
+            for column in sorted(row):
+                indices.append(column)
+                counts.append(row[column])
+            indptr.append(len(indices))
+
+        indices = np.asarray(indices, dtype=np.int32)
+        data = np.asarray(counts, dtype=np.float64) * self.idf_[indices]
+        matrix = csr_matrix((data, indices, np.asarray(indptr, dtype=np.int32)), shape=(len(texts), len(self.idf_)))
+        return normalize(matrix, copy=False)
+
+
+class IntentIndex:
+    """
+    Precomputed search index over the intent patterns.
+
+    The corpus is vectorized ONCE at build time. TfidfVectorizer L2-normalizes
+    every row, so cosine similarity against the corpus is a single sparse
+    dot product per query instead of a re-transform of every pattern.
+    """
+    def __init__(self, vectorizer, matrix, tag_ids, tag_names, responses, version=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix          # (n_patterns x n_terms) CSR, rows L2-normalized
+        self.tag_ids = tag_ids        # row -> position in tag_names
+        self.tag_names = tag_names
+        self.responses = responses    # tag -> [responses]
+        self.version = version
+        self._cached_best = None
+        # Impact-ordered inverted index for approximate matching (see enable_ann)
+        self.postings = None          # pattern rows, grouped by term, heaviest first
+        self.postings_indptr = None   # term -> slice of postings
+        self.ann = None               # (query_terms, postings_per_term) when enabled
+
+    @classmethod
+    def from_intents(cls, data, version=None):
+        return cls.from_intent_stream(data['intents'], version)
+
+    @classmethod
+    def from_intent_stream(cls, intents, version=None):
+        """
+        Builds the index in ONE pass over any iterable of intents, so a
+        generator (e.g. a streamed CSV) is never materialized as a list.
+        Responses are spooled to an unnamed temp file as they stream past and
+        mapped back as a StringTable; per-row tag ids go into a flat int32
+        array. Only the tag -> position map is kept as Python objects.
+        """
+        row_tags = array('i')
+        tag_positions = {}
+        ranges = array('q')          # 2 per tag: [start, end) of its responses
+        offsets = array('q', [0])    # response i is spool[offsets[i]:offsets[i + 1]]
+        spool = tempfile.TemporaryFile()
+
+        # Flatten the data for training
+        def patterns():
+            for intent in intents:
+                tag_id = tag_positions.setdefault(intent['tag'], len(tag_positions))
+                if tag_id * 2 == len(ranges):
+                    ranges.extend((0, 0))
+                # A repeated tag takes its last intent's responses
+                ranges[tag_id * 2] = len(offsets) - 1
+                for response in intent['responses']:
+                    data = response.encode('utf-8')
+                    spool.write(data)
+                    offsets.append(offsets[-1] + len(data))
+                ranges[tag_id * 2 + 1] = len(offsets) - 1
+                for pattern in intent['patterns']:
+                    row_tags.append(tag_id)
+                    yield pattern
+
+        with spool:
+            vectorizer = TfidfVectorizer()
+            matrix = vectorizer.fit_transform(patterns()).tocsr()
+            spool.flush()
+            blob = np.memmap(spool, dtype=np.uint8, mode='r') if offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+        tag_names = list(tag_positions)
+        responses = TagResponses(
+            StringTable.from_strings(tag_names, sort=True),
+            StringTable(blob, np.frombuffer(offsets, dtype=np.int64)),
+            np.frombuffer(ranges, dtype=np.int64).reshape(-1, 2),
+        )
+        return cls(vectorizer, matrix, np.frombuffer(row_tags, dtype=np.int32), tag_names, responses, version)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def tag_of(self, row):
+        return self.tag_names[self.tag_ids[row]]
+
+    def scores(self, text):
+        """Cosine similarity of `text` against every pattern (dense 1-D array)."""
+        user_vec = self.vectorizer.transform([text])
+        return (self.matrix @ user_vec.T).toarray().ravel()
+
+    def top_k(self, text, k=1):
+        """Returns the k best (tag, confidence) pairs, best first."""
+        scores = self.scores(text)
+        if k == 1:
+            best = int(np.argmax(scores))
+            return [(self.tag_of(best), float(scores[best]))]
+
+        k = min(k, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.tag_of(i), float(scores[i])) for i in ranked]
+
+    def build_postings(self):
+        """
+        Inverted index: for every term, the rows containing it sorted by that
+        term's weight (heaviest first), so truncating a posting list keeps the
+        rows where the term matters most.
+        """
+        if self.postings is None:
+            csc = self.matrix.tocsc()
+            cols = np.repeat(np.arange(csc.shape[1], dtype=np.int32), np.diff(csc.indptr))
+            order = np.lexsort((-csc.data, cols))
+            self.postings = csc.indices[order].astype(np.int32, copy=False)
+            self.postings_indptr = csc.indptr.astype(np.int64, copy=False)
+        return self
+
+    def enable_ann(self, query_terms=8, postings_per_term=2000):
+        """
+        Switches single-text matching to approximate mode: only the query's
+        `query_terms` highest-weighted terms are probed, each contributing at
+        most `postings_per_term` candidate rows, and candidates are re-ranked
+        exactly. Larger values trade latency for recall; with both unbounded
+        the result equals exact search (rows sharing no term score 0 anyway).
+        """
+        self.build_postings()
+        self.ann = (query_terms, postings_per_term)
+        return self
+
+    def ann_top(self, text):
+        """Approximate best (row, confidence) via candidate pruning + exact re-rank."""
+        query_terms, postings_per_term = self.ann
+        user_vec = self.vectorizer.transform([text])
+        if user_vec.nnz == 0:
+            return 0, 0.0
+
+        terms = user_vec.indices[np.argsort(-user_vec.data, kind='stable')[:query_terms]]
+        candidates = np.unique(np.concatenate([
+            self.postings[self.postings_indptr[t]:min(self.postings_indptr[t] + postings_per_term, self.postings_indptr[t + 1])]
+            for t in terms
+        ]))
+        if len(candidates) == 0:
+            return 0, 0.0
+
+        scores = (self.matrix[candidates] @ user_vec.T).toarray().ravel()
+        best = int(np.argmax(scores))
+        return int(candidates[best]), float(scores[best])
+
+    def _best(self, text):
+        if self.ann is not None:
+            row, confidence = self.ann_top(text)
+            return (self.tag_of(row), confidence)
+        return self.top_k(text, k=1)[0]
+
+    def enable_cache(self, maxsize):
+        """
+        Memoizes best_match() on normalized text in a bounded LRU. The cache
+        lives on this index, so swapping in a new corpus starts a fresh one.
+        """
+        self._cached_best = functools.lru_cache(maxsize=maxsize)(self._best)
+        return self
+
+    def cache_info(self):
+        if self._cached_best is None:
+            return None
+        info = self._cached_best.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+    def best_match(self, text):
+        """Best (tag, confidence) for one text (exact or ANN), served from the LRU when enabled."""
+        if self._cached_best is None:
+            return self._best(text)
+        return self._cached_best(normalize_text(text))
+
+    def best_matches(self, texts, chunk_size=1024, block_bytes=SCORE_BLOCK_BYTES):
+        """
+        Best (tag, confidence) for every text. Each chunk is scored as one
+        sparse matrix product; chunks are sized so the dense score block stays
+        under block_bytes however many patterns the corpus has.
+        """
+        n_patterns = max(1, self.matrix.shape[0])
+        chunk_size = max(1, min(chunk_size, block_bytes // (8 * n_patterns)))  # float64 scores
+        results = []
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            user_vecs = self.vectorizer.transform(chunk)
+            scores = (user_vecs @ self.matrix.T).toarray()  # (n_chunk x n_patterns)
+            best = scores.argmax(axis=1)
+            confidences = scores[np.arange(len(chunk)), best]
+            results.extend((self.tag_of(i), float(c)) for i, c in zip(best, confidences))
+        return results
+
+    # --- On-disk artifact ---
+    # Layout: <root>/<version>/{meta.json, *.npy} plus <root>/CURRENT naming the
+    # active version. The arrays are plain .npy files so every worker can map
+    # them read-only and share the same page-cache pages.
+
+    def save(self, root):
+        """Writes the index under root/<version>/ and atomically points CURRENT at it."""
+        if not self.version:
+            raise ValueError("Cannot save an index without a version.")
+        os.makedirs(root, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix='.build-', dir=root)
+        try:
+            np.save(os.path.join(build_dir, 'data.npy'), self.matrix.data)
+            np.save(os.path.join(build_dir, 'indices.npy'), self.matrix.indices)
+            np.save(os.path.join(build_dir, 'indptr.npy'), self.matrix.indptr)
+            np.save(os.path.join(build_dir, 'idf.npy'), np.asarray(self.vectorizer.idf_, dtype=np.float64))
+            np.save(os.path.join(build_dir, 'tag_ids.npy'), np.asarray(self.tag_ids, dtype=np.int32))
+            self.build_postings()
+            np.save(os.path.join(build_dir, 'postings.npy'), self.postings)
+            np.save(os.path.join(build_dir, 'postings_indptr.npy'), self.postings_indptr)
+            # Vocabulary, tags and responses go in as string tables too, so
+            # meta.json stays a few bytes and nothing is parsed per worker
+            terms = self.vectorizer.vocabulary if isinstance(self.vectorizer, MappedVectorizer) \
+                else StringTable.from_strings(self.vectorizer.get_feature_names_out())
+            terms.save(build_dir, 'terms')
+            responses = self.responses if isinstance(self.responses, TagResponses) \
+                else TagResponses.from_dict(self.tag_names, self.responses)
+            responses.save(build_dir)
+            with open(os.path.join(build_dir, 'meta.json'), 'w') as file:
+                json.dump({
+                    'format': ARTIFACT_FORMAT,
+                    'version': self.version,
+                    'shape': list(self.matrix.shape),
+                }, file)
+
+            version_dir = os.path.join(root, self.version)
+            if os.path.isdir(version_dir):
+                shutil.rmtree(build_dir)  # Same corpus already built
+            else:
+                os.replace(build_dir, version_dir)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+
+        pointer_tmp = os.path.join(root, f'.{CURRENT_POINTER}.{os.getpid()}')
+        with open(pointer_tmp, 'w') as file:
+            file.write(self.version)
+        os.replace(pointer_tmp, os.path.join(root, CURRENT_POINTER))
+        return os.path.join(root, self.version)
+
+    @classmethod
+    def load(cls, root, expected_version=None, mmap=True):
+        """
+        Loads the CURRENT artifact under root. Returns None when there is none,
+        or when it was built from a different corpus than expected_version.
+        """
+        try:
+            with open(os.path.join(root, CURRENT_POINTER)) as file:
+                version = file.read().strip()
+        except FileNotFoundError:
+            return None
+        if expected_version and version != expected_version:
+            return None
+
+        version_dir = os.path.join(root, version)
+        try:
+            with open(os.path.join(version_dir, 'meta.json')) as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return None
+        if meta.get('format') != ARTIFACT_FORMAT:
+            return None
+
+        mmap_mode = 'r' if mmap else None
+        def array(name):
+            return np.load(os.path.join(version_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        matrix = csr_matrix(
+            (array('data'), array('indices'), array('indptr')),
+            shape=tuple(meta['shape']), copy=False
+        )
+        vectorizer = MappedVectorizer(StringTable.load(version_dir, 'terms', mmap_mode), array('idf'))
+        responses = TagResponses.load(version_dir, mmap_mode)
+        index = cls(vectorizer, matrix, array('tag_ids'), responses.tag_names, responses, version)
+        if os.path.exists(os.path.join(version_dir, 'postings.npy')):
+            index.postings = array('postings')
+            index.postings_indptr = array('postings_indptr')
+        return index
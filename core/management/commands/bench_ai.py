@@ -0,0 +1,207 @@
+# core/management/commands/bench_ai.py
+import json
+import platform
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import ai_utils
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def synthetic_vocabulary(size, rng):
+    syllables = ['ba', 'ke', 'lo', 'mi', 'nu', 'ra', 'si', 'to', 'vy', 'ze', 'an', 'el', 'or', 'ul']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_intents(n_patterns, rng, patterns_per_intent=4):
+    """
+    An intents.json-shaped corpus with n_patterns patterns. Word frequencies are
+    Zipf-like, as in real FAQ text, so posting lists have a realistic skew.
+    """
+    vocab = synthetic_vocabulary(max(2000, n_patterns // 5), rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    intents = []
+    made = 0
+    while made < n_patterns:
+        count = min(patterns_per_intent, n_patterns - made)
+        patterns = [' '.join(rng.choices(vocab, weights, k=rng.randint(3, 12))) for _ in range(count)]
+        intents.append({"tag": f"synthetic-{len(intents)}", "patterns": patterns, "responses": [f"answer {len(intents)}"]})
+        made += count
+    return {"intents": intents}, vocab
+
+
+def synthetic_queries(data, vocab, n_queries, rng):
+    """Mostly perturbed corpus patterns (drop/add words), plus some pure noise."""
+    patterns = [p for intent in data['intents'] for p in intent['patterns']]
+    queries = []
+    for _ in range(n_queries):
+        if rng.random() < 0.2:
+            queries.append(' '.join(rng.choices(vocab, k=rng.randint(2, 10))))
+            continue
+        words = rng.choice(patterns).split()
+        if len(words) > 3:
+            words.pop(rng.randrange(len(words)))
+        words.append(rng.choice(vocab))
+        queries.append(' '.join(words))
+    return queries
+
+
+def latency_summary(latencies, n_items, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "throughput_per_s": round(n_items / elapsed, 1) if elapsed else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = "Benchmarks AI intent matching (single + batch) on synthetic corpora of growing size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help="Corpus sizes, in patterns.")
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--ann', action='store_true', help="Also compare approximate (ANN) matching against exact.")
+        parser.add_argument('--ann-terms', type=int, nargs='+', default=[4, 8],
+                            help="Query terms probed (AI_ANN_QUERY_TERMS values to sweep).")
+        parser.add_argument('--ann-postings', type=int, nargs='+', default=[500, 2000],
+                            help="Postings read per term (AI_ANN_POSTINGS_PER_TERM values to sweep).")
+        parser.add_argument('--output', default=None, help="Write machine-readable results (JSON) here.")
+
+    def handle(self, *args, **options):
+        from core.intent_index import IntentIndex
+
+        # The synthetic index is injected directly; don't let the hot-reload
+        # watcher swap the real corpus back in mid-run.
+        settings.AI_INDEX_RELOAD_INTERVAL = 0
+
+        results = []
+        for size in options['sizes']:
+            rng = random.Random(options['seed'])
+            data, vocab = synthetic_intents(size, rng)
+            queries = synthetic_queries(data, vocab, options['queries'], rng)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            index = IntentIndex.from_intents(data, version=f'synthetic-{size}')
+            build_s = time.perf_counter() - start
+            _, build_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            matrix = index.matrix
+            row = {
+                "patterns": size,
+                "terms": matrix.shape[1],
+                "nnz": int(matrix.nnz),
+                "build_s": round(build_s, 3),
+                "build_peak_mb": round(build_peak / 2**20, 1),
+                "index_mb": round((matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2**20, 2),
+            }
+
+            # Single: the full analyze_message path (crisis regex + match + reply), cache off
+            ai_utils.swap_index(index)
+            latencies = []
+            start = time.perf_counter()
+            for text in queries:
+                t0 = time.perf_counter()
+                ai_utils.analyze_message(text)
+                latencies.append(time.perf_counter() - t0)
+            row["single"] = latency_summary(latencies, len(queries), time.perf_counter() - start)
+
+            # Batch: analyze_messages in fixed-size batches
+            batch_size = options['batch_size']
+            latencies = []
+            start = time.perf_counter()
+            for i in range(0, len(queries), batch_size):
+                t0 = time.perf_counter()
+                ai_utils.analyze_messages(queries[i:i + batch_size])
+                latencies.append(time.perf_counter() - t0)
+            row["batch"] = dict(latency_summary(latencies, len(queries), time.perf_counter() - start),
+                                batch_size=batch_size)
+
+            if options['ann']:
+                row["ann"] = self.compare_ann(index, queries, options['ann_terms'], options['ann_postings'])
+
+            row["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            results.append(row)
+
+            self.stdout.write(
+                f"{size:>8} patterns | build {row['build_s']:.2f}s, index {row['index_mb']} MB | "
+                f"single p50 {row['single']['p50_ms']} ms p99 {row['single']['p99_ms']} ms "
+                f"({row['single']['throughput_per_s']}/s) | "
+                f"batch({batch_size}) p50 {row['batch']['p50_ms']} ms p99 {row['batch']['p99_ms']} ms "
+                f"({row['batch']['throughput_per_s']} msg/s) | rss {row['max_rss_mb']} MB"
+            )
+
+        if options['output']:
+            report = {
+                "ann": options['ann'],
+                "benchmark": "ai_intent_matching",
+                "commit": git_commit(),
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                "python": platform.python_version(),
+                "queries": options['queries'],
+                "seed": options['seed'],
+                "results": results,
+            }
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def compare_ann(self, index, queries, term_values, postings_values):
+        """Recall@1 (same tag as exact search) and latency for each ANN setting."""
+        exact, latencies = [], []
+        start = time.perf_counter()
+        for text in queries:
+            t0 = time.perf_counter()
+            exact.append(index.best_match(text)[0])
+            latencies.append(time.perf_counter() - t0)
+        rows = [dict(latency_summary(latencies, len(queries), time.perf_counter() - start),
+                     mode='exact', recall_at_1=1.0)]
+
+        index.build_postings()
+        for query_terms in term_values:
+            for postings_per_term in postings_values:
+                index.enable_ann(query_terms=query_terms, postings_per_term=postings_per_term)
+                hits, latencies = 0, []
+                start = time.perf_counter()
+                for text, expected in zip(queries, exact):
+                    t0 = time.perf_counter()
+                    tag = index.best_match(text)[0]
+                    latencies.append(time.perf_counter() - t0)
+                    hits += tag == expected
+                rows.append(dict(latency_summary(latencies, len(queries), time.perf_counter() - start),
+                                 mode='ann', query_terms=query_terms, postings_per_term=postings_per_term,
+                                 recall_at_1=round(hits / len(queries), 4)))
+        index.ann = None
+
+        for r in rows:
+            knobs = 'exact' if r['mode'] == 'exact' else f"ann terms={r['query_terms']} postings={r['postings_per_term']}"
+            self.stdout.write(f"    {knobs:<32} recall@1 {r['recall_at_1']:.3f}  p50 {r['p50_ms']} ms  p99 {r['p99_ms']} ms")
+        return rows
@@ -0,0 +1,152 @@
+# core/management/commands/bench_channel_layer.py
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.channel_layers import SQLiteChannelLayer
+
+
+def room_members(room, workers):
+    # Each chat room has two sockets (patient + doctor), normally on different workers
+    return [room % workers, (room + 1) % workers]
+
+
+def sends_per_room(rooms, workers, messages):
+    """Every worker sends `messages` group_sends round-robin over the rooms it 'owns' (room % workers)."""
+    counts = [0] * rooms
+    for worker in range(workers):
+        owned = [room for room in range(rooms) if room % workers == worker]
+        for i in range(messages if owned else 0):
+            counts[owned[i % len(owned)]] += 1
+    return counts
+
+
+async def _run_worker(path, worker, workers, rooms, messages, capacity, timeout, barrier):
+    layer = SQLiteChannelLayer(path, capacity=capacity)
+    counts = sends_per_room(rooms, workers, messages)
+
+    channels = []
+    expected = 0
+    for room in range(rooms):
+        for member in room_members(room, workers):
+            if member == worker:
+                channel = await layer.new_channel()
+                await layer.group_add(f'room{room}', channel)
+                channels.append(channel)
+                expected += counts[room]
+
+    latencies = []
+    done = asyncio.Event()
+    if not expected:
+        done.set()
+
+    async def receive(channel):
+        while True:
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message['sent'])
+            if len(latencies) >= expected:
+                done.set()
+
+    receivers = [asyncio.create_task(receive(channel)) for channel in channels]
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+    start = time.time()
+    owned = [room for room in range(rooms) if room % workers == worker]
+    for i in range(messages if owned else 0):
+        await layer.group_send(f'room{owned[i % len(owned)]}', {'type': 'chat.message', 'sent': time.time()})
+    sent_at = time.time()
+    try:
+        await asyncio.wait_for(done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    end = time.time()
+
+    for task in receivers:
+        task.cancel()
+    await layer.close()
+    return {
+        'worker': worker, 'sent': messages if owned else 0, 'expected': expected, 'received': len(latencies),
+        'start': start, 'sent_at': sent_at, 'end': end, 'latencies': latencies,
+    }
+
+
+def _worker(path, worker, workers, rooms, messages, capacity, timeout, barrier, results):
+    results.put(asyncio.run(_run_worker(path, worker, workers, rooms, messages, capacity, timeout, barrier)))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Measures the SQLite channel layer across worker processes: group_send throughput, "
+            "delivered messages/sec and delivery latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[4, 8])
+        parser.add_argument('--rooms', type=int, default=64, help="Chat rooms (two sockets each, on different workers).")
+        parser.add_argument('--messages', type=int, default=2000, help="group_send calls per worker.")
+        parser.add_argument('--capacity', type=int, default=1000)
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write the report to this file.")
+
+    def handle(self, *args, **options):
+        ctx = multiprocessing.get_context('spawn')
+        report = []
+        self.stdout.write(f"{'workers':>7}  {'sends/s':>9}  {'delivered/s':>11}  {'p50 ms':>7}  {'p99 ms':>7}  {'lost':>5}")
+        for workers in options['workers']:
+            with tempfile.TemporaryDirectory(prefix='bench-layer-') as tmp:
+                path = os.path.join(tmp, 'layer.sqlite3')
+                barrier = ctx.Barrier(workers)
+                results = ctx.Queue()
+                procs = [
+                    ctx.Process(target=_worker, args=(
+                        path, worker, workers, options['rooms'], options['messages'],
+                        options['capacity'], options['timeout'], barrier, results
+                    ))
+                    for worker in range(workers)
+                ]
+                for proc in procs:
+                    proc.start()
+                rows = []
+                try:
+                    for _ in procs:
+                        rows.append(results.get(timeout=options['timeout'] + 60))
+                except queue.Empty:
+                    self.stderr.write(f"{workers} workers: a worker did not report back")
+                for proc in procs:
+                    proc.join()
+
+            if not rows:
+                continue
+            start = min(row['start'] for row in rows)
+            sent = sum(row['sent'] for row in rows)
+            received = sum(row['received'] for row in rows)
+            latencies = [latency for row in rows for latency in row['latencies']]
+            result = {
+                'workers': workers,
+                'rooms': options['rooms'],
+                'group_sends': sent,
+                'sends_per_sec': round(sent / (max(row['sent_at'] for row in rows) - start), 1),
+                'delivered': received,
+                'delivered_per_sec': round(received / (max(row['end'] for row in rows) - start), 1),
+                'lost': sum(row['expected'] for row in rows) - received,
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            }
+            report.append(result)
+            self.stdout.write(f"{workers:>7}  {result['sends_per_sec']:>9}  {result['delivered_per_sec']:>11}  "
+                              f"{result['p50_ms']:>7}  {result['p99_ms']:>7}  {result['lost']:>5}")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump(report, file, indent=2)
@@ -0,0 +1,69 @@
+# core/management/commands/bench_crisis.py
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.ai_utils import CRISIS_KEYWORDS, CrisisMatcher
+
+
+def legacy_is_crisis(text, keywords):
+    # The original per-keyword substring loop, kept here as the baseline.
+    text_lower = text.lower()
+    for keyword in keywords:
+        if keyword in text_lower:
+            return True
+    return False
+
+
+def synthetic_keywords(count, rng):
+    keywords = list(CRISIS_KEYWORDS)
+    while len(keywords) < count:
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(rng.randint(1, 4))]
+        keywords.append(' '.join(words))
+    return keywords[:count]
+
+
+def synthetic_messages(count, rng):
+    # Everyday chat text that never contains a crisis phrase, i.e. the worst case:
+    # the legacy loop has to try every keyword before giving up.
+    vocab = ["i", "feel", "a", "bit", "tired", "today", "doctor",
+             "appointment", "sleep", "better", "anxious", "about", "work", "thanks"]
+    return [' '.join(rng.choices(vocab, k=rng.randint(5, 40))) for _ in range(count)]
+
+
+def per_message_us(check, messages):
+    start = time.perf_counter()
+    for text in messages:
+        check(text)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the crisis matcher (one trie-factored regex) against the legacy "
+        "per-keyword substring loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keywords', type=int, nargs='+', default=[8, 32, 64, 100, 500, 5000])
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        messages = synthetic_messages(options['messages'], rng)
+
+        self.stdout.write(
+            f"{'keywords':>8}  {'legacy us/msg':>14}  {'matcher us/msg':>15}  {'speedup':>8}"
+        )
+        for count in options['keywords']:
+            keywords = synthetic_keywords(count, rng)
+            matcher = CrisisMatcher(keywords)
+
+            legacy = per_message_us(lambda text: legacy_is_crisis(text, keywords), messages)
+            current = per_message_us(matcher.search, messages)
+            self.stdout.write(
+                f"{count:>8}  {legacy:>14.2f}  {current:>15.2f}  {legacy / current:>7.1f}x"
+            )
@@ -0,0 +1,83 @@
+# core/management/commands/bench_startup.py
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+HEAVY_MODULES = ('numpy', 'scipy', 'sklearn', 'pandas')
+
+
+def parse_importtime(stderr):
+    """Parses `python -X importtime` output into {module: (self_us, cumulative_us)}."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return modules
+
+
+class Command(BaseCommand):
+    help = "Measures cold-start import time of mediprior_backend.asgi in fresh interpreters (-X importtime)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help="How many slowest imports to list.")
+        parser.add_argument('--warmup', action='store_true', help="Keep AI_WARMUP_ON_STARTUP enabled (it runs in a background thread).")
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write the report to this file.")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='mediprior_backend.settings')
+        # Only measure import cost unless asked otherwise
+        code = (
+            "import django.conf;"
+            + ("" if options['warmup'] else "django.conf.settings.AI_WARMUP_ON_STARTUP = False;")
+            + "import mediprior_backend.asgi"
+        )
+
+        wall_times = []
+        modules = {}
+        for _ in range(options['runs']):
+            start = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', code],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+            )
+            wall_times.append(time.perf_counter() - start)
+            if proc.returncode != 0:
+                self.stderr.write(proc.stderr[-2000:])
+                return
+            modules = parse_importtime(proc.stderr)
+
+        wall_times.sort()
+        report = {
+            'runs': options['runs'],
+            'wall_ms_min': round(wall_times[0] * 1000, 1),
+            'wall_ms_median': round(wall_times[len(wall_times) // 2] * 1000, 1),
+            'import_ms_total': round(sum(s for s, _ in modules.values()) / 1000, 1),
+            'heavy_modules_loaded': [m for m in HEAVY_MODULES if m in modules],
+            'slowest': [
+                {'module': name, 'cumulative_ms': round(cum / 1000, 1), 'self_ms': round(own / 1000, 1)}
+                for name, (own, cum) in sorted(modules.items(), key=lambda item: -item[1][1])[:options['top']]
+            ],
+        }
+
+        self.stdout.write(f"Cold start of mediprior_backend.asgi over {report['runs']} runs: "
+                          f"min {report['wall_ms_min']} ms, median {report['wall_ms_median']} ms "
+                          f"(imports {report['import_ms_total']} ms)")
+        self.stdout.write(f"Heavy modules imported at startup: {', '.join(report['heavy_modules_loaded']) or 'none'}")
+        self.stdout.write(f"{'cumulative ms':>14}  {'self ms':>8}  module")
+        for row in report['slowest']:
+            self.stdout.write(f"{row['cumulative_ms']:>14}  {row['self_ms']:>8}  {row['module']}")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump(report, file, indent=2)
@@ -0,0 +1,33 @@
+# core/management/commands/build_ai_index.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.ai_utils import build_index, index_dir
+
+
+class Command(BaseCommand):
+    help = (
+        "Compiles core/intents.json into the memory-mapped AI index shared by all workers. "
+        "Running servers notice the new CURRENT pointer and hot-swap to it without a restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Index directory (defaults to settings.AI_INDEX_DIR).")
+
+    def handle(self, *args, **options):
+        root = options['output'] or index_dir()
+
+        start = time.perf_counter()
+        index = build_index()
+        path = index.save(root)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built AI index {index.version}: {len(index)} patterns, "
+            f"{index.matrix.shape[1]} terms, {len(index.tag_names)} tags -> {path} ({elapsed:.2f}s)"
+        ))
+        interval = getattr(settings, 'AI_INDEX_RELOAD_INTERVAL', None)
+        if interval:
+            self.stdout.write(f"Running workers will swap to it within {interval}s.")
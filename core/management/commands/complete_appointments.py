@@ -0,0 +1,27 @@
+# core/management/commands/complete_appointments.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.appointment_scheduler import complete_past_appointments
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks booked appointments that have ended as COMPLETED. Run it from cron, "
+        "or with --every to keep it running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None, help="Repeat every N seconds until interrupted.")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows per UPDATE (default: APPOINTMENT_SCHEDULER_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            count = complete_past_appointments(batch=options['batch_size'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"Completed {count} appointments ({elapsed * 1000:.0f}ms)")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,276 @@
+# core/management/commands/load_test_chat.py
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+from core import chat_writer
+
+
+class QueryCounter:
+    """
+    execute_wrapper counting every query on every DB connection, including the
+    ones database_sync_to_async threads open after it is installed.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self._attach)
+        for conn in connections.all():
+            self._attach(connection=conn)
+
+    def uninstall(self):
+        connection_created.disconnect(self._attach)
+        for conn in connections.all():
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def seed(doctors, patients_per_doctor, history):
+    """
+    Verified doctors, each with accepted patients and a `history`-message
+    conversation per pair. Returns [(connection_id, patient, doctor)].
+    """
+    from core.models import (
+        User, DoctorProfile, PatientProfile, DoctorPatientConnection, Conversation, Message
+    )
+
+    def users(prefix, user_type, count):
+        batch = []
+        for i in range(count):
+            user = User(email=f'{prefix}{i}@loadtest.local', user_type=user_type)
+            user.set_unusable_password()
+            batch.append(user)
+        return User.objects.bulk_create(batch)
+
+    doctor_users = users('doctor', User.UserType.DOCTOR, doctors)
+    patient_users = users('patient', User.UserType.PATIENT, doctors * patients_per_doctor)
+    DoctorProfile.objects.bulk_create([
+        DoctorProfile(user=user, name=f'Doctor {i}', verification_status=DoctorProfile.VerificationStatus.VERIFIED)
+        for i, user in enumerate(doctor_users)
+    ])
+    PatientProfile.objects.bulk_create([PatientProfile(user=user, name=f'Patient {i}') for i, user in enumerate(patient_users)])
+
+    pairs = [(patient, doctor_users[i // patients_per_doctor]) for i, patient in enumerate(patient_users)]
+    conversations = Conversation.objects.bulk_create([Conversation() for _ in pairs])
+    Participant = Conversation.participants.through
+    Participant.objects.bulk_create([
+        Participant(conversation_id=conversation.id, user_id=user.id)
+        for conversation, pair in zip(conversations, pairs) for user in pair
+    ])
+    connections_ = DoctorPatientConnection.objects.bulk_create([
+        DoctorPatientConnection(patient=patient, doctor=doctor, conversation=conversation,
+                                status=DoctorPatientConnection.ConnectionStatus.ACCEPTED)
+        for conversation, (patient, doctor) in zip(conversations, pairs)
+    ])
+
+    batch = []
+    for conversation, (patient, doctor) in zip(conversations, pairs):
+        for i in range(history):
+            batch.append(Message(conversation=conversation, sender=patient if i % 2 else doctor, content=f'seeded message {i}'))
+            if len(batch) >= 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+    Message.objects.bulk_create(batch)
+    return [(conn.id, patient, doctor) for conn, (patient, doctor) in zip(connections_, pairs)]
+
+
+class Socket:
+    """A WebsocketCommunicator whose frames are routed into per-connection queues with arrival times."""
+    def __init__(self, application, path, connection_id=None):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+        self.connection_id = connection_id  # None for the multiplexed socket
+        self.queues = {}
+        self.reader = None
+
+    def queue(self, connection_id):
+        return self.queues.setdefault(connection_id, asyncio.Queue())
+
+    async def connect(self, timeout):
+        connected, _ = await self.communicator.connect(timeout=timeout)
+        if connected:
+            self.reader = asyncio.create_task(self._read())
+        return connected
+
+    async def _read(self):
+        while True:
+            frame = json.loads(await self.communicator.receive_from(timeout=3600))
+            key = frame.get('connection_id', self.connection_id)
+            self.queue(key).put_nowait((time.perf_counter(), frame))
+
+    async def expect(self, connection_id, frame_type, timeout):
+        """Waits for the next `frame_type` frame of a connection; returns (arrival time, frame)."""
+        queue = self.queue(connection_id)
+        while True:
+            arrived, frame = await asyncio.wait_for(queue.get(), timeout)
+            if frame.get('type') == frame_type:
+                return arrived, frame
+            if frame.get('type') == 'error':
+                raise RuntimeError(f"{frame.get('code')}: {frame.get('message')}")
+
+    async def send(self, connection_id, message):
+        await self.communicator.send_to(text_data=json.dumps({'connection_id': connection_id, 'message': message}))
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+    help = ("Load-tests ChatConsumer in-process (WebsocketCommunicator) against a throwaway test database: "
+            "connects/sec, messages/sec, delivery latency and DB queries per connect/message.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=5)
+        parser.add_argument('--patients', type=int, default=40, help="Accepted patients per doctor.")
+        parser.add_argument('--history', type=int, default=1000, help="Seeded messages per conversation.")
+        parser.add_argument('--rounds', type=int, default=5, help="Patient message + doctor reply rounds per conversation.")
+        parser.add_argument('--multiplex', action='store_true', help="Doctors use one ws/chat/ socket instead of one per patient.")
+        parser.add_argument('--concurrency', type=int, default=100, help="Sockets connecting at once.")
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write the report to this file.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            start = time.perf_counter()
+            pairs = seed(options['doctors'], options['patients'], options['history'])
+            self.stdout.write(f"Seeded {len(pairs)} conversations x {options['history']} messages "
+                              f"in {time.perf_counter() - start:.1f}s")
+            report = asyncio.run(self.run(pairs, options))
+        finally:
+            if chat_writer.enabled():
+                # Whatever write-behind still holds belongs in the test database;
+                # the atexit flush would run against the real one
+                chat_writer.get_writer().flush_sync()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(
+            f"connect   {report['sockets']} sockets: {report['connects_per_sec']}/s, "
+            f"p50 {report['connect_p50_ms']} ms, p99 {report['connect_p99_ms']} ms, "
+            f"{report['queries_per_connect']} queries/connect"
+        )
+        self.stdout.write(
+            f"messages  {report['messages']} sent: {report['messages_per_sec']}/s, "
+            f"delivery p50 {report['delivery_p50_ms']} ms, p99 {report['delivery_p99_ms']} ms, "
+            f"{report['queries_per_message']} queries/message, {report['errors']} errors"
+        )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump(report, file, indent=2)
+
+    async def run(self, pairs, options):
+        from channels.routing import URLRouter
+        from core.middleware import TokenAuthMiddlewareStack
+        from core.serializers import MyTokenObtainPairSerializer
+        import core.routing
+
+        # The websocket half of mediprior_backend.asgi, without its AI warm-up
+        application = TokenAuthMiddlewareStack(URLRouter(core.routing.websocket_urlpatterns))
+        token = lambda user: str(MyTokenObtainPairSerializer.get_token(user).access_token)
+        timeout = options['timeout']
+
+        patient_sockets = {cid: Socket(application, f'/ws/chat/{cid}/?token={token(patient)}', cid) for cid, patient, _ in pairs}
+        if options['multiplex']:
+            by_doctor = {doctor.id: Socket(application, f'/ws/chat/?token={token(doctor)}') for _, _, doctor in pairs}
+            doctor_sockets = {cid: by_doctor[doctor.id] for cid, _, doctor in pairs}
+            sockets = list(patient_sockets.values()) + list(by_doctor.values())
+        else:
+            doctor_sockets = {cid: Socket(application, f'/ws/chat/{cid}/?token={token(doctor)}', cid) for cid, _, doctor in pairs}
+            sockets = list(patient_sockets.values()) + list(doctor_sockets.values())
+
+        counter = QueryCounter()
+        counter.install()
+        try:
+            # --- Connect: handshake until the first page of history (or the 'rooms' frame) ---
+            limit = asyncio.Semaphore(options['concurrency'])
+            connect_times = []
+
+            async def open_socket(socket):
+                async with limit:
+                    started = time.perf_counter()
+                    if not await socket.connect(timeout):
+                        raise RuntimeError("Connection refused")
+                    first = 'history' if socket.connection_id is not None else 'rooms'
+                    arrived, _ = await socket.expect(socket.connection_id, first, timeout)
+                    connect_times.append(arrived - started)
+
+            queries_before = counter.count
+            started = time.perf_counter()
+            await asyncio.gather(*(open_socket(socket) for socket in sockets))
+            connect_elapsed = time.perf_counter() - started
+            connect_queries = counter.count - queries_before
+
+            # --- Messages: every conversation alternates patient message / doctor reply ---
+            latencies = []
+            errors = 0
+
+            async def converse(cid):
+                nonlocal errors
+                patient, doctor = patient_sockets[cid], doctor_sockets[cid]
+                for round_ in range(options['rounds']):
+                    for sender, receiver, text in ((patient, doctor, 'question'), (doctor, patient, 'answer')):
+                        try:
+                            sent = time.perf_counter()
+                            await sender.send(cid, f'{text} {round_} in {cid}')
+                            await sender.expect(cid, 'message', timeout)
+                            arrived, _ = await receiver.expect(cid, 'message', timeout)
+                            latencies.append(arrived - sent)
+                        except (RuntimeError, asyncio.TimeoutError):
+                            errors += 1
+
+            queries_before = counter.count
+            started = time.perf_counter()
+            await asyncio.gather(*(converse(cid) for cid, _, _ in pairs))
+            message_elapsed = time.perf_counter() - started
+            message_queries = counter.count - queries_before
+        finally:
+            counter.uninstall()
+            for socket in sockets:
+                await socket.close()
+            if chat_writer.enabled():
+                await chat_writer.get_writer().flush()
+
+        messages = len(pairs) * options['rounds'] * 2
+        return {
+            'conversations': len(pairs),
+            'history': options['history'],
+            'multiplex': options['multiplex'],
+            'sockets': len(sockets),
+            'connects_per_sec': round(len(sockets) / connect_elapsed, 1),
+            'connect_p50_ms': ms(percentile(connect_times, 0.50)),
+            'connect_p99_ms': ms(percentile(connect_times, 0.99)),
+            'queries_per_connect': round(connect_queries / len(sockets), 2),
+            'messages': messages,
+            'messages_per_sec': round(messages / message_elapsed, 1),
+            'delivery_p50_ms': ms(percentile(latencies, 0.50)),
+            'delivery_p99_ms': ms(percentile(latencies, 0.99)),
+            'queries_per_message': round(message_queries / messages, 2),
+            'errors': errors,
+        }
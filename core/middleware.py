@@ -1,4 +1,7 @@
 # core/middleware.py
+import time
+from collections import OrderedDict
+
 import jwt
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -8,15 +11,118 @@ from urllib.parse import parse_qs
 
 User = get_user_model()
 
+
+class TokenPrincipal:
+    """
+    The websocket user as stated by a verified access token. MyTokenObtainPairSerializer
+    puts user_id, email and user_type in every token, which is all the consumers
+    use, so only the user's is_active flag is looked up (and cached, see
+    is_active_user). `await principal.get_user()` loads the full User for the
+    rare code that needs more.
+    """
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, user_id, email, user_type):
+        self.id = self.pk = user_id
+        self.email = email
+        self.user_type = user_type
+        self._user = None
+
+    async def get_user(self):
+        if self._user is None:
+            self._user = await database_sync_to_async(User.objects.get)(id=self.id)
+        return self._user
+
+    def __str__(self): return self.email or str(self.id)
+
+
+class TokenCache:
+    """
+    Bounded LRU of decoded token claims (and of users' is_active flags). An
+    entry lives at most `ttl` seconds and never past `expires`, so a reconnect
+    storm decodes each token once.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires=float('inf')):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (min(time.time() + self.ttl, expires), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_TOKEN_CACHE = TokenCache(
+    maxsize=getattr(settings, 'WS_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'WS_TOKEN_CACHE_TTL', 60),
+)
+# user_id -> is_active; a deactivated or deleted user is refused within one TTL
+_ACTIVE_USERS = TokenCache(
+    maxsize=getattr(settings, 'WS_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'WS_TOKEN_CACHE_TTL', 60),
+)
+
+
+def decode_token(token_key):
+    """Verified claims of an access token (cached), or None if it's invalid or expired."""
+    claims = _TOKEN_CACHE.get(token_key)
+    if claims is None:
+        try:
+            claims = jwt.decode(token_key, settings.SECRET_KEY, algorithms=["HS256"])
+        except jwt.InvalidTokenError:  # Expired, bad signature, malformed...
+            return None
+        _TOKEN_CACHE.set(token_key, claims, claims.get('exp', float('inf')))
+    return claims
+
+
+async def is_active_user(user_id):
+    """Whether the user still exists and is active: one query per user per WS_TOKEN_CACHE_TTL."""
+    active = _ACTIVE_USERS.get(user_id)
+    if active is None:
+        active = await database_sync_to_async(User.objects.filter(id=user_id, is_active=True).exists)()
+        _ACTIVE_USERS.set(user_id, active)
+    return active
+
+
 @database_sync_to_async
-def get_user(token_key):
+def get_user_from_db(user_id):
     try:
-        payload = jwt.decode(token_key, settings.SECRET_KEY, algorithms=["HS256"])
-        user = User.objects.get(id=payload['user_id'])
-        return user
-    except (jwt.ExpiredSignatureError, jwt.exceptions.DecodeError, User.DoesNotExist, KeyError):
+        return User.objects.get(id=user_id, is_active=True)
+    except User.DoesNotExist:
+        return AnonymousUser()
+
+
+async def get_user(token_key):
+    claims = decode_token(token_key)
+    if claims is None or 'user_id' not in claims:
         # Return AnonymousUser if token is bad or user_id is missing
         return AnonymousUser()
+    if 'user_type' not in claims:
+        # Tokens issued before the custom claims: fall back to the database
+        return await get_user_from_db(claims['user_id'])
+    if not await is_active_user(claims['user_id']):
+        return AnonymousUser()
+    return TokenPrincipal(claims['user_id'], claims.get('email'), claims['user_type'])
+
 
 class TokenAuthMiddleware:
     """
@@ -35,9 +141,9 @@ class TokenAuthMiddleware:
             scope['user'] = await get_user(token)
         else:
             scope['user'] = AnonymousUser()
-        
+
         return await self.inner(scope, receive, send)
 
 # Helper function to wrap the middleware
 def TokenAuthMiddlewareStack(inner):
-    return TokenAuthMiddleware(inner)
\ No newline at end of file
+    return TokenAuthMiddleware(inner)
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_medicalreport_shared_with_message_deleted_by"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="message_conv_ts_id_idx",
+            ),
+        ),
+    ]
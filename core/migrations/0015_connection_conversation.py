@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def link_existing_conversations(apps, schema_editor):
+    # Same lookup the chat consumer used to run on every message: the
+    # two-participant conversation between the connection's patient and doctor.
+    DoctorPatientConnection = apps.get_model("core", "DoctorPatientConnection")
+    Conversation = apps.get_model("core", "Conversation")
+
+    linked = set()
+    for connection in DoctorPatientConnection.objects.filter(conversation__isnull=True).iterator():
+        conversation = (
+            Conversation.objects.annotate(count=Count("participants"))
+            .filter(count=2, participants=connection.patient_id)
+            .filter(participants=connection.doctor_id)
+            .exclude(id__in=linked)
+            .order_by("id")
+            .first()
+        )
+        if conversation is not None:
+            connection.conversation = conversation
+            connection.save(update_fields=["conversation"])
+            linked.add(conversation.id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0014_message_history_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="doctorpatientconnection",
+            name="conversation",
+            field=models.OneToOneField(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="connection",
+                to="core.conversation",
+            ),
+        ),
+        migrations.RunPython(link_existing_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def deleted_by_to_watermarks(apps, schema_editor):
+    # "Clear history" always marked every message in the thread, so each
+    # (conversation, user) set of deleted_by rows collapses to its newest message id.
+    Message = apps.get_model("core", "Message")
+    ConversationClearMark = apps.get_model("core", "ConversationClearMark")
+    Through = Message.deleted_by.through
+
+    marks = (
+        Through.objects.values("message__conversation_id", "user_id")
+        .annotate(cleared_up_to=Max("message_id"))
+        .order_by()
+    )
+    ConversationClearMark.objects.bulk_create(
+        [
+            ConversationClearMark(
+                conversation_id=row["message__conversation_id"],
+                user_id=row["user_id"],
+                cleared_up_to=row["cleared_up_to"],
+            )
+            for row in marks
+        ],
+        batch_size=500,
+    )
+
+
+def watermarks_to_deleted_by(apps, schema_editor):
+    Message = apps.get_model("core", "Message")
+    ConversationClearMark = apps.get_model("core", "ConversationClearMark")
+    Through = Message.deleted_by.through
+
+    for mark in ConversationClearMark.objects.iterator():
+        message_ids = Message.objects.filter(
+            conversation_id=mark.conversation_id, id__lte=mark.cleared_up_to
+        ).values_list("id", flat=True)
+        Through.objects.bulk_create(
+            [Through(message_id=message_id, user_id=mark.user_id) for message_id in message_ids],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0015_connection_conversation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationClearMark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("cleared_up_to", models.BigIntegerField(default=0)),
+                ("cleared_at", models.DateTimeField(auto_now=True)),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="clear_marks",
+                        to="core.conversation",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="conversation_clear_marks",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("conversation", "user")},
+            },
+        ),
+        migrations.RunPython(deleted_by_to_watermarks, watermarks_to_deleted_by),
+        migrations.RemoveField(
+            model_name="message",
+            name="deleted_by",
+        ),
+    ]
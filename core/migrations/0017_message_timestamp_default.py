@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0016_conversation_clear_mark"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
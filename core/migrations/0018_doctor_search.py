@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The SQL is frozen here rather than imported from core.doctor_search, so
+# later changes to that module never change what this migration does.
+SQLITE_FTS_SQL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS core_doctorprofile_fts USING fts5(
+        name, specialization, qualification, hospital_name, bio,
+        content='core_doctorprofile', content_rowid='user_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS core_doctorprofile_fts_ai AFTER INSERT ON core_doctorprofile BEGIN
+        INSERT INTO core_doctorprofile_fts (rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES (new.user_id, new.name, new.specialization, new.qualification, new.hospital_name, new.bio);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_doctorprofile_fts_ad AFTER DELETE ON core_doctorprofile BEGIN
+        INSERT INTO core_doctorprofile_fts (core_doctorprofile_fts, rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES ('delete', old.user_id, old.name, old.specialization, old.qualification, old.hospital_name, old.bio);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_doctorprofile_fts_au AFTER UPDATE ON core_doctorprofile BEGIN
+        INSERT INTO core_doctorprofile_fts (core_doctorprofile_fts, rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES ('delete', old.user_id, old.name, old.specialization, old.qualification, old.hospital_name, old.bio);
+        INSERT INTO core_doctorprofile_fts (rowid, name, specialization, qualification, hospital_name, bio)
+        VALUES (new.user_id, new.name, new.specialization, new.qualification, new.hospital_name, new.bio);
+    END""",
+    "INSERT INTO core_doctorprofile_fts (core_doctorprofile_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_SQL = [
+    "DROP TRIGGER IF EXISTS core_doctorprofile_fts_ai",
+    "DROP TRIGGER IF EXISTS core_doctorprofile_fts_ad",
+    "DROP TRIGGER IF EXISTS core_doctorprofile_fts_au",
+    "DROP TABLE IF EXISTS core_doctorprofile_fts",
+]
+
+POSTGRES_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS core_doctorprofile_search_idx ON core_doctorprofile USING GIN (("
+    "to_tsvector('simple', "
+    "coalesce(\"core_doctorprofile\".\"name\", '') || ' ' || "
+    "coalesce(\"core_doctorprofile\".\"specialization\", '') || ' ' || "
+    "coalesce(\"core_doctorprofile\".\"qualification\", '') || ' ' || "
+    "coalesce(\"core_doctorprofile\".\"hospital_name\", '') || ' ' || "
+    "coalesce(\"core_doctorprofile\".\"bio\", '')"
+    ")))"
+)
+
+POSTGRES_DROP_SQL = "DROP INDEX IF EXISTS core_doctorprofile_search_idx"
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 table + sync triggers on SQLite, a GIN tsvector index on PostgreSQL,
+    # nothing elsewhere (search then falls back to icontains)
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        try:
+            for statement in SQLITE_FTS_SQL:
+                schema_editor.execute(statement, params=None)
+        except Exception as error:
+            if "fts5" not in str(error):
+                raise
+            # SQLite built without FTS5: search falls back to icontains
+    elif vendor == "postgresql":
+        schema_editor.execute(POSTGRES_INDEX_SQL, params=None)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for statement in SQLITE_DROP_SQL:
+            schema_editor.execute(statement, params=None)
+    elif vendor == "postgresql":
+        schema_editor.execute(POSTGRES_DROP_SQL, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0017_message_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="doctorprofile",
+            index=models.Index(
+                fields=["verification_status", "name"], name="doctor_directory_idx"
+            ),
+        ),
+        migrations.CreateModel(
+            name="DoctorSearchEntry",
+            fields=[
+                (
+                    "doctor",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search_entry",
+                        serialize=False,
+                        to="core.doctorprofile",
+                    ),
+                ),
+                ("rank", models.FloatField()),
+            ],
+            options={
+                "db_table": "core_doctorprofile_fts",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
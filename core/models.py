@@ -2,6 +2,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.conf import settings 
+from django.utils import timezone
 
 # ... (UserManager and User class - Keep as is) ...
 class UserManager(BaseUserManager):
@@ -98,8 +99,21 @@ class DoctorProfile(models.Model):
     profile_photo = models.ImageField(upload_to=get_photo_upload_path, null=True, blank=True)
     bio = models.TextField(max_length=250, blank=True)
     verification_status = models.CharField(max_length=20, choices=VerificationStatus.choices, default=VerificationStatus.PENDING)
+    class Meta:
+        # Directory listing: verified doctors in (name, user_id) keyset order.
+        # Full-text search uses a vendor-specific index (see core/doctor_search.py)
+        indexes = [models.Index(fields=['verification_status', 'name'], name='doctor_directory_idx')]
     def __str__(self): return f"Dr. {self.name} ({self.verification_status})"
 
+# Read-only view of the SQLite FTS5 index over DoctorProfile (created by
+# migration 0018, kept in sync by triggers); lets search join it for bm25 rank.
+class DoctorSearchEntry(models.Model):
+    doctor = models.OneToOneField(DoctorProfile, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', db_constraint=False, related_name='search_entry')
+    rank = models.FloatField()
+    class Meta:
+        managed = False
+        db_table = 'core_doctorprofile_fts'
+
 # --- THIS WAS MISSING ---
 def get_report_upload_path(instance, filename):
     return f'patients/{instance.patient.email}/reports/{filename}'
@@ -123,9 +137,38 @@ class DoctorPatientConnection(models.Model):
     doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='patient_connections', limit_choices_to={'user_type': User.UserType.DOCTOR})
     status = models.CharField(max_length=10, choices=ConnectionStatus.choices, default=ConnectionStatus.PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Direct link to this pair's chat thread, set the first time either side opens the chat
+    conversation = models.OneToOneField('Conversation', on_delete=models.SET_NULL, null=True, blank=True, related_name='connection')
     class Meta: unique_together = ('patient', 'doctor')
     def __str__(self): return f"{self.patient.email} -> {self.doctor.email} ({self.status})"
 
+    def get_or_create_conversation_id(self):
+        """
+        Returns the linked conversation's id, linking one on first use. A thread
+        left over from an earlier connection between the same pair is re-attached.
+        Safe against two sockets racing to link the same connection.
+        """
+        if self.conversation_id:
+            return self.conversation_id
+
+        conversation = Conversation.objects.annotate(count=models.Count('participants')).filter(
+            count=2, participants=self.patient_id
+        ).filter(participants=self.doctor_id).filter(connection__isnull=True).first()
+        created = conversation is None
+        if created:
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.patient_id, self.doctor_id])
+
+        linked = DoctorPatientConnection.objects.filter(id=self.id, conversation__isnull=True).update(conversation=conversation)
+        if not linked:
+            # Another socket linked one first: use theirs
+            if created:
+                conversation.delete()
+            self.conversation_id = DoctorPatientConnection.objects.values_list('conversation_id', flat=True).get(id=self.id)
+        else:
+            self.conversation_id = conversation.id
+        return self.conversation_id
+
 class Appointment(models.Model):
     class AppointmentStatus(models.TextChoices):
         AVAILABLE = 'AVAILABLE', 'Available'
@@ -146,6 +189,8 @@ class Appointment(models.Model):
     class Meta:
         ordering = ['start_time']
         unique_together = ('doctor', 'start_time')
+        # Completion job: BOOKED rows by end_time (core/appointment_scheduler.py)
+        indexes = [models.Index(fields=['status', 'end_time'], name='appointment_due_idx')]
     def __str__(self):
         if self.patient: return f"Appt for {self.patient.email} with Dr. {self.doctor.doctor_profile.name} at {self.start_time}"
         return f"Available slot for Dr. {self.doctor.doctor_profile.name} at {self.start_time}"
@@ -160,12 +205,27 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField(blank=True, null=True)
     file = models.FileField(upload_to='chat_files/', blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add so write-behind batches keep the time each message was sent
+    timestamp = models.DateTimeField(default=timezone.now)
     read = models.BooleanField(default=False)
-    deleted_by = models.ManyToManyField(User, related_name='deleted_messages', blank=True)
-    class Meta: ordering = ['timestamp']
+    class Meta:
+        ordering = ['timestamp']
+        # Serves the keyset-paginated history query (latest N, then older pages)
+        indexes = [models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_ts_id_idx')]
     def __str__(self): return f"Message from {self.sender.email} at {self.timestamp}"
 
+class ConversationClearMark(models.Model):
+    """
+    Per-participant "clear history" watermark: messages with id <= cleared_up_to
+    are hidden from that user. Clearing is one upsert however long the thread is.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='clear_marks')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_clear_marks')
+    cleared_up_to = models.BigIntegerField(default=0)
+    cleared_at = models.DateTimeField(auto_now=True)
+    class Meta: unique_together = ('conversation', 'user')
+    def __str__(self): return f"{self.user.email} cleared conversation {self.conversation_id} up to message {self.cleared_up_to}"
+
 class PatientHealthMetric(models.Model):
     patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name='health_metrics')
     recorded_at = models.DateTimeField(auto_now_add=True)
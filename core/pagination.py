@@ -0,0 +1,68 @@
+# core/pagination.py
+"""
+Opt-in keyset pagination for the list endpoints. A page is the `limit` rows
+after an opaque cursor in a fixed ordering, so page N costs the same as page 1
+(no OFFSET). The ordering must end with a unique field.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def wants_page(params):
+    return 'limit' in params or 'cursor' in params
+
+
+def parse_limit(params):
+    """`limit` query param clamped to 1..MAX_LIMIT; raises ValueError when not a number."""
+    return max(1, min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """Raises ValueError for anything that isn't a cursor we issued for this ordering."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def after(ordering, values):
+    """Q selecting rows strictly after `values` in `ordering` ('-field' = descending)."""
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=DEFAULT_LIMIT):
+    """Returns (rows, next_cursor); next_cursor is None on the last page."""
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        try:
+            queryset = queryset.filter(after(ordering, decode_cursor(cursor, len(ordering))))
+        except (TypeError, ValidationError):
+            # Well-formed cursor carrying values the fields can't take
+            raise ValueError("Invalid cursor.")
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
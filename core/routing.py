@@ -5,4 +5,7 @@ from . import consumers
 websocket_urlpatterns = [
     # We will make this URL more specific later
     re_path(r'ws/chat/(?P<connection_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    # One socket for all of a user's accepted connections, frames tagged by connection_id
+    re_path(r'ws/chat/$', consumers.UserChatConsumer.as_asgi()),
+    re_path(r'ws/ai-chat/$', consumers.AIChatConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -93,7 +93,7 @@ class MedicalReportSerializer(serializers.ModelSerializer):
 # --- Serializer for Public Doctor List (with Connection Status) ---
 class DoctorPublicProfileSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(source='user.email', read_only=True)
-    user_id = serializers.IntegerField(source='user.id', read_only=True)
+    user_id = serializers.IntegerField(read_only=True)
     connection_status = serializers.SerializerMethodField()
 
     class Meta:
@@ -107,12 +107,16 @@ class DoctorPublicProfileSerializer(serializers.ModelSerializer):
     def get_connection_status(self, obj):
         if 'request' not in self.context or self.context['request'] is None:
             return None
-        doctor_user = obj.user
         patient_user = self.context['request'].user
         
-        if doctor_user == patient_user:
+        if obj.user_id == patient_user.id:
             return "SELF" 
-            
+
+        # VerifiedDoctorListView annotates the status in its one query
+        if hasattr(obj, 'patient_connection_status'):
+            return obj.patient_connection_status
+
+        doctor_user = obj.user
         try:
             connection = DoctorPatientConnection.objects.get(
                 patient=patient_user, 
@@ -176,6 +180,15 @@ class ConnectionListSerializer(serializers.ModelSerializer):
         model = DoctorPatientConnection
         fields = ('id', 'patient_profile', 'doctor_profile', 'status', 'created_at')
 
+    def to_representation(self, instance):
+        # A patient's status with this doctor is this row's status; hand it to
+        # the nested doctor serializer instead of letting it query per row
+        try:
+            instance.doctor.doctor_profile.patient_connection_status = instance.status
+        except DoctorProfile.DoesNotExist:
+            pass
+        return super().to_representation(instance)
+
 # --- Serializer for Patient Health Metrics ---
 class PatientHealthMetricSerializer(serializers.ModelSerializer):
     class Meta:
@@ -221,4 +234,11 @@ class AppointmentSerializer(serializers.ModelSerializer):
         read_only_fields = (
             'doctor', 'doctor_name', 'patient_name', 'start_time', 'end_time',
             'notes', 'prescription'
-        )
\ No newline at end of file
+        )
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Ended but not yet marked by the completion job: report what it will store
+        if instance.status == Appointment.AppointmentStatus.BOOKED and instance.end_time < timezone.now():
+            data['status'] = Appointment.AppointmentStatus.COMPLETED
+        return data
\ No newline at end of file
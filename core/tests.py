@@ -1,3 +1,1445 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection as db_connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import ai_utils, ai_worker, chat_state, middleware
+from .appointment_scheduler import complete_past_appointments
+from .models import User, DoctorProfile, PatientProfile, DoctorPatientConnection, Appointment
+
+# --- Shared fixtures ---
+
+_user_numbers = count(1)
+
+
+def make_patient(name=None):
+    number = next(_user_numbers)
+    patient = User.objects.create_user(f'patient{number}@example.com', User.UserType.PATIENT, 'Passw0rd!')
+    PatientProfile.objects.create(user=patient, name=name or f'Patient {number}')
+    return patient
+
+
+def make_doctor(name=None, **profile):
+    number = next(_user_numbers)
+    doctor = User.objects.create_user(f'doctor{number}@example.com', User.UserType.DOCTOR, 'Passw0rd!')
+    profile.setdefault('verification_status', DoctorProfile.VerificationStatus.VERIFIED)
+    DoctorProfile.objects.create(user=doctor, name=name or f'Doctor {number}', **profile)
+    return doctor
+
+
+def connect(patient, doctor, status=DoctorPatientConnection.ConnectionStatus.ACCEPTED):
+    return DoctorPatientConnection.objects.create(patient=patient, doctor=doctor, status=status)
+
+
+TINY_INTENTS = {'intents': [
+    {'tag': 'greeting', 'patterns': ['hello there', 'hi', 'good morning'], 'responses': ['Hello!']},
+    {'tag': 'sad', 'patterns': ['i feel sad', 'i am so unhappy', 'feeling down today'], 'responses': ['I am sorry.']},
+    {'tag': 'sleep', 'patterns': ['i cannot sleep', 'insomnia keeps me awake'], 'responses': ['Sleep matters.']},
+]}
+
+
+def tiny_index(version='tiny'):
+    from .intent_index import IntentIndex
+    return IntentIndex.from_intents(TINY_INTENTS, version=version)
+
+
+def keep_ai_index(test):
+    """Restores the process-wide AI index when `test` finishes."""
+    saved = (ai_utils._INDEX, ai_utils._INDEX_LOADED, ai_utils._SOURCE_SIGNATURE)
+
+    def restore():
+        ai_utils._INDEX, ai_utils._INDEX_LOADED, ai_utils._SOURCE_SIGNATURE = saved
+    test.addCleanup(restore)
+
+
+class TinyIndexMixin:
+    """Serves TINY_INTENTS as the active AI index, in-process, for the test's duration."""
+
+    def setUp(self):
+        super().setUp()
+        keep_ai_index(self)
+        self.index = tiny_index()
+        ai_utils.swap_index(self.index)
+        settings_override = override_settings(AI_WORKER_PROCESSES=0, AI_INDEX_RELOAD_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+def access_token(user):
+    from .serializers import MyTokenObtainPairSerializer
+    return str(MyTokenObtainPairSerializer.get_token(user).access_token)
+
+
+class ChatSocketMixin:
+    """Opens chat websockets against the real routing and middleware, with fresh chat state per test."""
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.CHAT_STATE_CACHE].clear()
+        middleware._ACTIVE_USERS.clear()  # user ids are reused between tests
+        self.sockets = []
+
+    async def open_socket(self, user, path, accepted=True):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from .middleware import TokenAuthMiddlewareStack
+        from .routing import websocket_urlpatterns
+
+        socket = WebsocketCommunicator(TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns)), f'{path}?token={access_token(user)}')
+        connected, _ = await socket.connect()
+        self.assertEqual(connected, accepted)
+        self.sockets.append(socket)
+        return socket
+
+    async def close_sockets(self):
+        for socket in self.sockets:
+            await socket.disconnect()
+
+    async def receive(self, socket):
+        return json.loads(await socket.receive_from(timeout=5))
+
+    async def send(self, socket, **frame):
+        await socket.send_to(text_data=json.dumps(frame))
+        return await self.receive(socket)
+
+    async def statements_during(self, awaitable):
+        """(result, SQL verbs run meanwhile). The ORM runs on the sync thread, so its query log is read there."""
+        from channels.db import database_sync_to_async
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        queries = CaptureQueriesContext(connection)
+        await database_sync_to_async(queries.__enter__)()
+        try:
+            result = await awaitable
+        finally:
+            await database_sync_to_async(queries.__exit__)(None, None, None)
+        return result, await database_sync_to_async(lambda: [q['sql'].split()[0] for q in queries.captured_queries])()
+
+
+# Fast hashing: tests create many users
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MediPriorTestCase(TestCase):
+    def api_client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class IntentIndexTests(SimpleTestCase):
+    """The precomputed index must score exactly like fitting TF-IDF per request did."""
+
+    def test_scores_match_cosine_similarity(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        index = tiny_index()
+        patterns = [p for intent in TINY_INTENTS['intents'] for p in intent['patterns']]
+        vectorizer = TfidfVectorizer().fit(patterns)
+        for text in ['i feel so sad today', 'hello', 'awake all night, cannot sleep']:
+            expected = cosine_similarity(vectorizer.transform([text]), vectorizer.transform(patterns)).ravel()
+            self.assertEqual(index.scores(text).round(9).tolist(), expected.round(9).tolist())
+
+    def test_best_match_and_response(self):
+        index = tiny_index()
+        self.assertEqual(index.best_match('Hello there, friend')[0], 'greeting')
+        self.assertEqual(ai_utils.get_ai_response('I feel sad', index), {'response': 'I am sorry.', 'tag': 'sad'})
+        # Below CONFIDENCE_THRESHOLD the caller falls back
+        self.assertIsNone(ai_utils.get_ai_response('quantum chromodynamics', index))
+
+    def test_top_k_is_ranked(self):
+        ranked = tiny_index().top_k('i feel sad and cannot sleep', k=3)
+        confidences = [confidence for _, confidence in ranked]
+        self.assertEqual(confidences, sorted(confidences, reverse=True))
+        self.assertEqual({tag for tag, _ in ranked[:2]}, {'sad', 'sleep'})
+
+    def test_batch_score_block_is_bounded(self):
+        index = tiny_index()
+        texts = ['i feel sad', 'hello', 'cannot sleep', 'gibberish'] * 5
+        expected = [index.best_match(text) for text in texts]
+        transform = index.vectorizer.transform
+        for block_bytes, rows in [(10**9, len(texts)), (3 * 8 * index.matrix.shape[0], 3), (1, 1)]:
+            with self.subTest(block_bytes=block_bytes), \
+                    mock.patch.object(index.vectorizer, 'transform', side_effect=transform) as transform_mock:
+                self.assertEqual(index.best_matches(texts, block_bytes=block_bytes), expected)
+                self.assertEqual(max(len(call.args[0]) for call in transform_mock.call_args_list), rows)
+
+
+class AnalyzeBatchTests(TinyIndexMixin, MediPriorTestCase):
+    """Batch analysis returns what per-message analysis would, in input order."""
+
+    TEXTS = ['hello there', 'I want to die', 'i feel sad', 'gibberish words', 'i cannot sleep']
+
+    def test_batch_equals_single(self):
+        self.assertEqual(ai_utils.analyze_messages(self.TEXTS), [ai_utils.analyze_message(t) for t in self.TEXTS])
+
+    def test_batch_api(self):
+        client = self.api_client(make_patient())
+        response = client.post('/api/ai-chat/batch/', {'messages': self.TEXTS}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['action'] for r in results], ['REPLY', 'CRISIS', 'REPLY', 'REPLY', 'REPLY'])
+        self.assertEqual([r['emotion'] for r in results], ['Good', 'Crisis', 'Low/Sad', 'Neutral', 'Neutral'])
+        self.assertEqual({r['model_version'] for r in results}, {'tiny'})
+
+    def test_batch_api_validation(self):
+        client = self.api_client(make_patient())
+        for body in [{}, {'messages': []}, {'messages': 'hello'}, {'messages': ['ok', '']}, {'messages': ['ok', 3]}]:
+            with self.subTest(body=body):
+                self.assertEqual(client.post('/api/ai-chat/batch/', body, format='json').status_code, 400)
+
+
+class CrisisMatcherTests(SimpleTestCase):
+    """Crisis screening is safety-critical: phrases start a word, may end mid-word."""
+
+    def assertFlags(self, text, expected=True):
+        with self.subTest(text=text):
+            self.assertEqual(ai_utils.CrisisMatcher(ai_utils.CRISIS_KEYWORDS).search(text) is not None, expected)
+
+    def test_hits(self):
+        for text in ["I want to die", "thinking about suicide", "i might hurt myself tonight",
+                     "I just want to end it all", "I can't handle this anymore"]:
+            self.assertFlags(text)
+
+    def test_misses(self):
+        for text in ["I feel a bit tired today", "Thanks doctor, see you at the appointment", ""]:
+            self.assertFlags(text, expected=False)
+
+    def test_case_and_punctuation(self):
+        for text in ["SUICIDE", "Kill Myself.", "...hopeless!!!", "(disappear)", "i can\u2019t handle this"]:
+            self.assertFlags(text)
+
+    def test_inflections_hit(self):
+        for text in ["the hopelessness is back", "my dog died", "I wish I could just disappear forever"]:
+            self.assertFlags(text)
+
+    def test_words_merely_containing_a_phrase_miss(self):
+        for text in ["I studied all night", "the bodies", "pretend it all went well", "studies show"]:
+            self.assertFlags(text, expected=False)
+
+    def test_words_starting_with_a_phrase_still_hit(self):
+        # Kept on purpose: a trailing boundary would also lose "died"/"dies"
+        for text in ["new diet plan", "diesel"]:
+            self.assertFlags(text)
+
+    def test_phrase_must_be_contiguous(self):
+        self.assertFlags("kill the bug, then myself a coffee", expected=False)
+
+    def test_large_list(self):
+        keywords = [f'phrase number {n}' for n in range(200)] + ['hopeless']
+        matcher = ai_utils.CrisisMatcher(keywords)
+        self.assertEqual(matcher.search("Phrase Number 150 here"), 'phrase number 1')  # shortest prefix wins
+        self.assertEqual(matcher.search("feeling HOPELESSNESS"), 'hopeless')
+        self.assertIsNone(matcher.search("phrase numbers"))
+        self.assertIsNone(matcher.search("paraphrase number 7"))
+
+    def test_empty_list_never_matches(self):
+        self.assertIsNone(ai_utils.CrisisMatcher([' ', '']).search("I want to die"))
+
+
+class IndexArtifactTests(SimpleTestCase):
+    """A saved artifact, memory-mapped back, must behave exactly like the index that wrote it."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_round_trip(self):
+        from .intent_index import IntentIndex
+
+        built = tiny_index('v1')
+        built.save(self.root)
+        loaded = IntentIndex.load(self.root, expected_version='v1')
+
+        self.assertEqual(loaded.version, 'v1')
+        self.assertEqual(list(loaded.tag_names), ['greeting', 'sad', 'sleep'])
+        self.assertEqual(loaded.responses['sleep'], ['Sleep matters.'])
+        for text in ['hello there', 'I feel SAD', 'cannot sleep, awake', 'nothing in common']:
+            self.assertEqual(loaded.scores(text).tolist(), built.scores(text).tolist())
+            self.assertEqual(loaded.best_match(text), built.best_match(text))
+        self.assertEqual(loaded.best_matches(['hi', 'unhappy']), built.best_matches(['hi', 'unhappy']))
+
+    def test_nothing_parsed_per_worker(self):
+        tiny_index('v1').save(self.root)
+        with open(os.path.join(self.root, 'v1', 'meta.json')) as file:
+            self.assertEqual(set(json.load(file)), {'format', 'version', 'shape'})
+
+    def test_stale_or_missing_artifact(self):
+        from .intent_index import IntentIndex
+
+        self.assertIsNone(IntentIndex.load(self.root))
+        tiny_index('v1').save(self.root)
+        self.assertIsNone(IntentIndex.load(self.root, expected_version='v2'))
+        tiny_index('v2').save(self.root)
+        self.assertEqual(IntentIndex.load(self.root, expected_version='v2').version, 'v2')
+
+    def test_string_table(self):
+        from .intent_index import StringTable
+
+        table = StringTable.from_strings(['pear', 'apple', 'çava', ''], sort=True)
+        self.assertEqual(list(table), ['pear', 'apple', 'çava', ''])
+        self.assertEqual([table.find(v) for v in ['apple', 'çava', '', 'kiwi']], [1, 2, 3, None])
+
+
+class LazyEngineTests(SimpleTestCase):
+    """Nothing pays for the AI engine until it is used, and it is loaded exactly once."""
+
+    def test_app_import_skips_heavy_modules(self):
+        # numpy itself may arrive through daphne/autobahn; scipy and sklearn must not
+        code = (
+            "import sys, django; django.setup();"
+            "import core.ai_utils, core.ai_worker, core.views, core.consumers, core.urls;"
+            "print(','.join(m for m in ('scipy', 'sklearn', 'pandas') if m in sys.modules))"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='mediprior_backend.settings')
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), '')
+
+    def test_concurrent_first_use_loads_once(self):
+        keep_ai_index(self)
+        ai_utils._INDEX, ai_utils._INDEX_LOADED = None, False
+        loads = []
+
+        def slow_load():
+            loads.append(1)
+            time.sleep(0.05)
+            return tiny_index()
+
+        seen = []
+        with mock.patch.object(ai_utils, 'load_and_train_model', slow_load):
+            threads = [threading.Thread(target=lambda: seen.append(ai_utils.get_index())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len({id(index) for index in seen}), 1)
+
+
+class HotReloadTests(SimpleTestCase):
+    """A changed corpus is swapped in atomically; requests holding the old index keep it."""
+
+    def setUp(self):
+        keep_ai_index(self)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.intents = os.path.join(self.root, 'intents.json')
+        self.write_intents(TINY_INTENTS)
+        patcher = mock.patch.object(ai_utils, 'intents_path', return_value=self.intents)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        overrides = override_settings(
+            AI_INDEX_DIR=os.path.join(self.root, 'index'), AI_INDEX_RELOAD_INTERVAL=0.01,
+            AI_MATCH_MODE='exact', AI_MATCH_CACHE_SIZE=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        ai_utils._INDEX, ai_utils._INDEX_LOADED = None, False
+
+    def write_intents(self, data):
+        with open(self.intents, 'w') as file:
+            json.dump(data, file)
+
+    def with_anger_intent(self):
+        return {'intents': TINY_INTENTS['intents'] + [
+            {'tag': 'angry', 'patterns': ['i am furious', 'so angry right now'], 'responses': ['Let it out.']},
+        ]}
+
+    def test_reload_swaps_in_new_corpus(self):
+        old = ai_utils.get_index()
+        self.assertNotEqual(old.best_match('furious and angry')[0], 'angry')
+
+        self.write_intents(self.with_anger_intent())
+        version = ai_utils.reload_index()
+
+        new = ai_utils.get_index()
+        self.assertEqual(new.version, version)
+        self.assertNotEqual(new.version, old.version)
+        self.assertEqual(new.best_match('furious and angry')[0], 'angry')
+        # The old index object is untouched for whoever still holds it
+        self.assertEqual(old.best_match('hello there')[0], 'greeting')
+        self.assertEqual(ai_utils.analyze_message('so angry right now')['model_version'], version)
+
+    def test_changed_file_is_picked_up_in_background(self):
+        old = ai_utils.get_index()
+        self.write_intents(self.with_anger_intent())
+        os.utime(self.intents, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+
+        deadline = time.monotonic() + 10
+        while ai_utils.get_index() is old and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(ai_utils.get_index().best_match('so angry right now')[0], 'angry')
+
+    def test_missing_corpus_keeps_serving_old_index(self):
+        old = ai_utils.get_index()
+        os.remove(self.intents)
+        self.assertIsNone(ai_utils.reload_index())
+        self.assertIs(ai_utils.get_index(), old)
+
+
+class MatchCacheTests(SimpleTestCase):
+    """The LRU returns what an uncached lookup would, keyed on normalized text, per index."""
+
+    def test_cached_results_equal_uncached(self):
+        plain = tiny_index()
+        cached = tiny_index().enable_cache(2)
+        for text in ['hello there', 'I feel sad', 'hello there', 'zzz', 'I cannot sleep', 'I feel sad']:
+            self.assertEqual(cached.best_match(text), plain.best_match(text))
+        self.assertEqual(cached.cache_info(), {'hits': 1, 'misses': 5, 'size': 2, 'maxsize': 2})
+
+    def test_case_and_whitespace_share_an_entry(self):
+        index = tiny_index().enable_cache(16)
+        index.best_match('I feel sad')
+        index.best_match('  i FEEL\tsad ')
+        self.assertEqual(index.cache_info()['hits'], 1)
+
+    def test_new_index_starts_empty(self):
+        old = tiny_index().enable_cache(16)
+        old.best_match('hello there')
+        self.assertEqual(tiny_index().enable_cache(16).cache_info()['size'], 0)
+        self.assertIsNone(tiny_index().cache_info())
+
+
+class WorkerPoolTests(SimpleTestCase):
+    """Admission slots belong to the pool that admitted a request; crisis replies never queue."""
+
+    def setUp(self):
+        keep_ai_index(self)
+        ai_utils.swap_index(tiny_index('pool-test'))
+        saved = ai_worker._POOL
+        self.addCleanup(setattr, ai_worker, '_POOL', saved)
+        self.gate = threading.Event()
+
+    def fake_pool(self, slots=1):
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown, wait=True)
+        self.addCleanup(self.gate.set)  # cleanups run last-in first-out
+        ai_worker._POOL = (executor, threading.BoundedSemaphore(slots))
+        return ai_worker._POOL
+
+    def test_late_finish_releases_its_own_pool_slot(self):
+        old_executor, old_slots = self.fake_pool()
+        _, late = ai_worker._submit(self.gate.wait)
+        ai_worker._reset_pool(old_executor)
+
+        _, new_slots = self.fake_pool()
+        blocker = threading.Event()
+        self.addCleanup(blocker.set)
+        ai_worker._submit(blocker.wait)
+        self.gate.set()
+        late.result(timeout=5)
+
+        # The replaced pool got its slot back; the new pool's slot is still taken
+        self.assertTrue(old_slots.acquire(blocking=False))
+        with self.assertRaises(ai_worker.AIUnavailable):
+            ai_worker._submit(blocker.wait)
+
+    @override_settings(AI_WORKER_PROCESSES=1)
+    def test_full_queue_degrades_to_busy_reply(self):
+        self.fake_pool(slots=1)
+        ai_worker._submit(self.gate.wait)
+        self.assertEqual(ai_worker.analyze('hello there'), ai_utils.busy_result())
+
+    @override_settings(AI_WORKER_PROCESSES=1)
+    def test_crisis_reply_skips_saturated_pool_and_carries_version(self):
+        self.fake_pool(slots=1)
+        ai_worker._submit(self.gate.wait)
+        result = ai_worker.analyze('I want to kill myself')
+        self.assertEqual(result['action'], 'CRISIS')
+        self.assertEqual(result['model_version'], 'pool-test')
+        result = async_to_sync(ai_worker.analyze_async)('I want to kill myself')
+        self.assertEqual(result['model_version'], 'pool-test')
+
+
+class BenchAITests(SimpleTestCase):
+    """The synthetic corpora are reproducible and the report is machine-readable."""
+
+    def test_synthetic_corpus_has_requested_size_and_is_seeded(self):
+        from random import Random
+        from .management.commands.bench_ai import synthetic_intents, synthetic_queries
+
+        data, vocab = synthetic_intents(501, Random(3))
+        self.assertEqual(sum(len(intent['patterns']) for intent in data['intents']), 501)
+        self.assertEqual(len({intent['tag'] for intent in data['intents']}), len(data['intents']))
+        self.assertEqual(synthetic_intents(501, Random(3)), (data, vocab))
+        self.assertEqual(len(synthetic_queries(data, vocab, 40, Random(3))), 40)
+
+    def test_percentile(self):
+        from .management.commands.bench_ai import percentile
+
+        values = [i / 100 for i in range(101)]
+        self.assertEqual(percentile(values, 50), 0.5)
+        self.assertEqual(percentile(values, 99), 0.99)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    @override_settings(AI_INDEX_RELOAD_INTERVAL=0)
+    def test_command_writes_json_report(self):
+        from django.core.management import call_command
+
+        keep_ai_index(self)
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('bench_ai', sizes=[200, 400], queries=30, batch_size=8, output=output, stdout=io.StringIO())
+
+        with open(output) as file:
+            report = json.load(file)
+        self.assertEqual(report['benchmark'], 'ai_intent_matching')
+        self.assertEqual([row['patterns'] for row in report['results']], [200, 400])
+        for row in report['results']:
+            self.assertLessEqual(row['single']['p50_ms'], row['single']['p99_ms'])
+            self.assertEqual(row['batch']['batch_size'], 8)
+            self.assertGreater(row['batch']['throughput_per_s'], 0)
+
+
+class ApproximateMatchTests(SimpleTestCase):
+    """ANN candidate pruning re-ranks exactly, and with unbounded knobs equals exact search."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from random import Random
+        from .intent_index import IntentIndex
+        from .management.commands.bench_ai import synthetic_intents, synthetic_queries
+
+        rng = Random(7)
+        data, vocab = synthetic_intents(2000, rng)
+        cls.queries = synthetic_queries(data, vocab, 200, rng)
+        cls.exact = IntentIndex.from_intents(data, version='ann-test')
+        cls.approx = IntentIndex.from_intents(data, version='ann-test')
+
+    def test_unbounded_ann_equals_exact(self):
+        self.approx.enable_ann(query_terms=10**6, postings_per_term=10**9)
+        for text in self.queries:
+            # Ties may resolve to a different row, never to a worse score
+            self.assertAlmostEqual(self.approx.best_match(text)[1], self.exact.best_match(text)[1], places=12)
+
+    def test_pruned_candidates_are_scored_exactly(self):
+        self.approx.enable_ann(query_terms=2, postings_per_term=20)
+        for text in self.queries:
+            row, confidence = self.approx.ann_top(text)
+            self.assertAlmostEqual(confidence, self.exact.scores(text)[row], places=12)
+            self.assertLessEqual(confidence, self.exact.best_match(text)[1] + 1e-12)
+
+    def test_query_without_known_terms_scores_zero(self):
+        self.approx.enable_ann()
+        self.assertEqual(self.approx.best_match('qqqq zzzz')[1], 0.0)
+
+    def test_postings_survive_the_artifact(self):
+        from .intent_index import IntentIndex
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.exact.save(root)
+        loaded = IntentIndex.load(root).enable_ann(query_terms=10**6, postings_per_term=10**9)
+        for text in self.queries[:50]:
+            self.assertAlmostEqual(loaded.best_match(text)[1], self.exact.best_match(text)[1], places=12)
+
+    @override_settings(AI_INDEX_RELOAD_INTERVAL=0)
+    def test_bench_reports_recall_against_exact(self):
+        from django.core.management import call_command
+
+        keep_ai_index(self)
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('bench_ai', sizes=[300], queries=30, ann=True, ann_terms=[10**6], ann_postings=[10**9],
+                     output=output, stdout=io.StringIO())
+
+        with open(output) as file:
+            rows = json.load(file)['results'][0]['ann']
+        self.assertEqual([row['mode'] for row in rows], ['exact', 'ann'])
+        self.assertEqual(rows[1]['recall_at_1'], 1.0)
+
+
+class StreamedCorpusTests(SimpleTestCase):
+    """The one-pass builder matches the list build, and generate() streams CSV -> intents.json + index."""
+
+    def test_generator_build_equals_list_build(self):
+        from .intent_index import IntentIndex
+
+        streamed = IntentIndex.from_intent_stream(intent for intent in TINY_INTENTS['intents'])
+        listed = tiny_index()
+        self.assertEqual(streamed.tag_names, listed.tag_names)
+        self.assertEqual(list(streamed.tag_ids), list(listed.tag_ids))
+        for text in ['hello there', 'I feel sad', 'insomnia', 'zzz']:
+            self.assertEqual(streamed.scores(text).tolist(), listed.scores(text).tolist())
+        for intent in TINY_INTENTS['intents']:
+            self.assertEqual(streamed.responses[intent['tag']], intent['responses'])
+
+    def test_streamed_responses(self):
+        from .intent_index import IntentIndex
+
+        index = IntentIndex.from_intent_stream(iter([
+            {'tag': 'a', 'patterns': ['first pattern'], 'responses': ['old']},
+            {'tag': 'b', 'patterns': ['second pattern'], 'responses': []},
+            {'tag': 'c', 'patterns': ['third pattern'], 'responses': ['naïve ☕', '']},
+            {'tag': 'a', 'patterns': ['fourth pattern'], 'responses': ['new', 'newer']},
+        ]))
+        self.assertEqual(index.responses['a'], ['new', 'newer'])
+        self.assertEqual(index.responses['b'], [])
+        self.assertEqual(index.responses['c'], ['naïve ☕', ''])
+        self.assertEqual(index.best_match('fourth')[0], 'a')
+
+    def test_generate_streams_csv_into_intents_and_index(self):
+        from contextlib import redirect_stdout
+        from .generate_intents import conversational_intents, generate
+        from .intent_index import IntentIndex
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        csv_path = os.path.join(root, 'faq.csv')
+        with open(csv_path, 'w') as file:
+            file.write('Question_ID,Questions,Answers\n'
+                       '1,What is anxiety?,A feeling of worry.\n'
+                       '2,what  is ANXIETY?,Duplicate answer.\n'
+                       '3,,No question.\n'
+                       '4,How do I sleep better?,Keep a routine.\n')
+        output = os.path.join(root, 'intents.json')
+        with redirect_stdout(io.StringIO()):
+            generate(csv_path, output, os.path.join(root, 'index'), chunksize=2)
+
+        with open(output) as file:
+            intents = json.load(file)['intents']
+        facts = intents[len(conversational_intents):]
+        self.assertEqual([intent['tag'] for intent in facts], ['fact-1', 'fact-4'])
+        self.assertEqual(facts[0]['responses'], ['A feeling of worry.'])
+
+        index = IntentIndex.load(os.path.join(root, 'index'))
+        self.assertEqual(index.best_match('how to sleep better')[0], 'fact-4')
+        self.assertEqual(index.responses['fact-1'], ['A feeling of worry.'])
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=3)
+class ChatHistoryTests(ChatSocketMixin, MediPriorTestCase):
+    """Connect sends the latest page; load_older walks back by (timestamp, id), ties included."""
+
+    def setUp(self):
+        super().setUp()
+        from .models import Message
+
+        self.patient, self.doctor = make_patient(), make_doctor()
+        self.connection = connect(self.patient, self.doctor)
+        conversation_id = self.connection.get_or_create_conversation_id()
+        start = timezone.now() - timedelta(hours=1)
+        # Messages 3-5 share a timestamp: only the id orders them
+        offsets = [0, 1, 2, 3, 3, 3, 4, 5]
+        Message.objects.bulk_create([
+            Message(conversation_id=conversation_id, sender=self.doctor if i % 2 else self.patient,
+                    content=f'm{i}', timestamp=start + timedelta(minutes=offset))
+            for i, offset in enumerate(offsets)
+        ])
+        self.contents = [f'm{i}' for i in range(len(offsets))]
+
+    async def test_latest_page_then_older_pages(self):
+        socket = await self.open_socket(self.patient, f'/ws/chat/{self.connection.id}/')
+        history = await self.receive(socket)
+        self.assertEqual(history['type'], 'history')
+        self.assertEqual([m['message'] for m in history['messages']], ['m5', 'm6', 'm7'])
+        self.assertTrue(history['has_more'])
+        self.assertEqual((await self.receive(socket))['type'], 'doctor_status')
+
+        seen = history['messages']
+        while True:
+            oldest = seen[0]
+            page = await self.send(socket, command='load_older', before={'id': oldest['id'], 'timestamp': oldest['timestamp']})
+            self.assertEqual(page['type'], 'older_history')
+            seen = page['messages'] + seen
+            if not page['has_more']:
+                break
+        self.assertEqual([m['message'] for m in seen], self.contents)
+        await self.close_sockets()
+
+    async def test_bad_cursor_is_rejected(self):
+        socket = await self.open_socket(self.patient, f'/ws/chat/{self.connection.id}/')
+        await self.receive(socket)  # history
+        await self.receive(socket)  # doctor_status
+        for before in [{'id': 'x', 'timestamp': '2024-01-01T00:00:00Z'}, {'id': 1, 'timestamp': 'soon'}, 'nope']:
+            self.assertEqual((await self.send(socket, command='load_older', before=before))['code'], 'bad_cursor')
+        await self.close_sockets()
+
+
+class ConversationLinkTests(ChatSocketMixin, MediPriorTestCase):
+    """Each connection resolves its conversation once; a chat message is then a single INSERT."""
+
+    def setUp(self):
+        super().setUp()
+        self.patient, self.doctor = make_patient(), make_doctor()
+        self.connection = connect(self.patient, self.doctor)
+
+    def test_conversation_is_created_once_and_linked(self):
+        from .models import Conversation
+
+        conversation_id = self.connection.get_or_create_conversation_id()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.connection.get_or_create_conversation_id(), conversation_id)
+        reloaded = DoctorPatientConnection.objects.get(id=self.connection.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(reloaded.get_or_create_conversation_id(), conversation_id)
+        self.assertEqual(set(Conversation.objects.get(id=conversation_id).participants.all()), {self.patient, self.doctor})
+
+    def test_existing_conversation_is_reused(self):
+        from .models import Conversation
+
+        existing = Conversation.objects.create()
+        existing.participants.set([self.patient, self.doctor])
+        self.assertEqual(self.connection.get_or_create_conversation_id(), existing.id)
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_losing_a_link_race_uses_the_winner(self):
+        from .models import Conversation
+
+        stale = DoctorPatientConnection.objects.get(id=self.connection.id)
+        winner = self.connection.get_or_create_conversation_id()
+        self.assertEqual(stale.get_or_create_conversation_id(), winner)
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    async def test_message_send_is_one_insert(self):
+        from channels.db import database_sync_to_async
+        from .models import Message
+
+        socket = await self.open_socket(self.doctor, f'/ws/chat/{self.connection.id}/')
+        await self.receive(socket)  # history
+        await self.receive(socket)  # doctor_status
+        await self.send(socket, message='first')  # seeds the spam-rule window
+        relayed, statements = await self.statements_during(self.send(socket, message='second'))
+        self.assertEqual(statements, ['INSERT'])
+        conversation_id = await database_sync_to_async(self.connection.get_or_create_conversation_id)()
+        saved = await database_sync_to_async(Message.objects.get)(id=relayed['id'])
+        self.assertEqual((saved.conversation_id, saved.content), (conversation_id, 'second'))
+        await self.close_sockets()
+
+
+class ClearMarkMigrationTests(TransactionTestCase):
+    """0016 collapses each (conversation, user) set of deleted_by rows into one watermark, and back."""
+
+    before = [('core', '0015_connection_conversation')]
+    after = [('core', '0016_conversation_clear_mark')]
+
+    def setUp(self):
+        self.addCleanup(self.migrate)
+        self.apps = self.migrate(self.before)
+
+    def migrate(self, targets=None):
+        """Migrates core to `targets` (default: latest) and returns the historical apps there."""
+        from django.db.migrations.executor import MigrationExecutor
+
+        executor = MigrationExecutor(db_connection)
+        targets = targets or executor.loader.graph.leaf_nodes('core')
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def seed(self):
+        apps = self.apps
+        User, Conversation, Message = (apps.get_model('core', name) for name in ('User', 'Conversation', 'Message'))
+        patient = User.objects.create(email='patient@example.com', user_type='PATIENT')
+        doctor = User.objects.create(email='doctor@example.com', user_type='DOCTOR')
+        cleared, untouched = Conversation.objects.create(), Conversation.objects.create()
+        messages = [Message.objects.create(conversation=cleared, sender=patient, content=f'm{i}') for i in range(4)]
+        other = Message.objects.create(conversation=untouched, sender=doctor, content='other')
+        # The patient cleared after m2; the doctor cleared the whole thread
+        for message in messages[:3]:
+            message.deleted_by.add(patient)
+        for message in messages:
+            message.deleted_by.add(doctor)
+        return patient, doctor, cleared, untouched, messages, other
+
+    def test_deleted_by_becomes_watermarks(self):
+        patient, doctor, cleared, untouched, messages, _ = self.seed()
+        apps = self.migrate(self.after)
+
+        marks = apps.get_model('core', 'ConversationClearMark').objects.values_list('conversation_id', 'user_id', 'cleared_up_to')
+        self.assertEqual(sorted(marks), sorted([
+            (cleared.id, patient.id, messages[2].id),
+            (cleared.id, doctor.id, messages[3].id),
+        ]))
+
+    def test_reverse_restores_deleted_by(self):
+        patient, doctor, _, _, messages, other = self.seed()
+        self.migrate(self.after)
+        apps = self.migrate(self.before)
+
+        through = apps.get_model('core', 'Message').deleted_by.through
+        self.assertEqual(sorted(through.objects.values_list('message_id', 'user_id')), sorted(
+            [(m.id, patient.id) for m in messages[:3]] + [(m.id, doctor.id) for m in messages]
+        ))
+
+
+class SpamRuleTests(ChatSocketMixin, MediPriorTestCase):
+    """Repeat and 5-in-a-row rules, reset by a doctor reply, with a shared tail that may be stale."""
+
+    def setUp(self):
+        super().setUp()
+        self.patient, self.doctor = make_patient(), make_doctor()
+        self.connection = connect(self.patient, self.doctor)
+        self.conversation_id = self.connection.get_or_create_conversation_id()
+
+    async def open_chat(self, user):
+        socket = await self.open_socket(user, f'/ws/chat/{self.connection.id}/')
+        await self.receive(socket)  # history
+        await self.receive(socket)  # doctor_status
+        return socket
+
+    async def test_repeated_message_is_blocked(self):
+        patient = await self.open_chat(self.patient)
+        self.assertEqual((await self.send(patient, message='Hello doctor'))['type'], 'message')
+        self.assertEqual((await self.send(patient, message='hello DOCTOR'))['code'], 'spam')
+        await self.close_sockets()
+
+    async def test_limit_resets_after_doctor_reply(self):
+        patient, doctor = await self.open_chat(self.patient), await self.open_chat(self.doctor)
+        for i in range(5):
+            self.assertEqual((await self.send(patient, message=f'message {i}'))['type'], 'message')
+        self.assertEqual((await self.send(patient, message='one more'))['code'], 'limit_reached')
+
+        await doctor.send_to(text_data=json.dumps({'message': 'I am here'}))
+        self.assertEqual((await self.receive(patient))['message'], 'I am here')
+        self.assertEqual((await self.send(patient, message='one more'))['type'], 'message')
+        await self.close_sockets()
+
+    async def test_stale_shared_tail_loses_to_socket_window(self):
+        patient, doctor = await self.open_chat(self.patient), await self.open_chat(self.doctor)
+        for i in range(5):
+            await self.send(patient, message=f'message {i}')
+        stale = await chat_state.get_tail(self.conversation_id)
+        await doctor.send_to(text_data=json.dumps({'message': 'I am here'}))
+        await self.receive(patient)
+
+        # A per-process cache on another worker never saw the doctor's reply
+        await chat_state.set_tail(self.conversation_id, stale)
+        self.assertEqual((await self.send(patient, message='thanks'))['type'], 'message')
+        await self.close_sockets()
+
+    async def test_newer_shared_tail_is_honored(self):
+        patient = await self.open_chat(self.patient)
+        relayed = await self.send(patient, message='first')
+        # Sent from the patient's other socket and not relayed here yet
+        await chat_state.set_tail(self.conversation_id, chat_state.next_tail(
+            await chat_state.get_tail(self.conversation_id), relayed['id'] + 1, self.patient.id, 'Elsewhere'
+        ))
+        self.assertEqual((await self.send(patient, message='elsewhere'))['code'], 'spam')
+        await self.close_sockets()
+
+    def test_tail_without_id_counts_as_oldest(self):
+        window = chat_state.MessageWindow([(7, self.doctor.id, 'hi'), (8, self.patient.id, 'Hey')])
+        legacy = {'sender_id': self.patient.id, 'content': 'hey', 'streak': 5}
+        self.assertEqual(chat_state.newest(legacy, window.tail()), {'id': 8, 'sender_id': self.patient.id, 'content': 'hey', 'streak': 1})
+        self.assertIsNone(chat_state.newest(None, None))
+
+
+class DoctorStatusTests(ChatSocketMixin, MediPriorTestCase):
+    """A chat_status change through ProfileView is pushed to open chats and enforced without queries."""
+
+    def setUp(self):
+        super().setUp()
+        self.patient, self.doctor = make_patient(), make_doctor()
+        self.connection = connect(self.patient, self.doctor)
+
+    async def set_status(self, status):
+        from channels.db import database_sync_to_async
+
+        client = self.api_client(self.doctor)
+        response = await database_sync_to_async(client.post)('/api/profile/', {'chat_status': status}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_status_change_is_pushed_and_enforced(self):
+        patient = await self.open_socket(self.patient, f'/ws/chat/{self.connection.id}/')
+        await self.receive(patient)  # history
+        self.assertEqual((await self.receive(patient))['status'], 'AVAILABLE')
+        await self.send(patient, message='hi')  # seeds the spam-rule window
+
+        for status, code in [('BUSY', 'busy'), ('OFFLINE', 'offline')]:
+            await self.set_status(status)
+            self.assertEqual(await self.receive(patient), {'type': 'doctor_status', 'doctor_id': self.doctor.id, 'status': status})
+            reply, statements = await self.statements_during(self.send(patient, message=f'are you there? {code}'))
+            self.assertEqual((reply['code'], statements), (code, []))
+
+        await self.set_status('AVAILABLE')
+        await self.receive(patient)
+        self.assertEqual((await self.send(patient, message='hello'))['type'], 'message')
+        await self.close_sockets()
+
+    async def test_unchanged_status_is_not_broadcast(self):
+        patient = await self.open_socket(self.patient, f'/ws/chat/{self.connection.id}/')
+        await self.receive(patient)
+        await self.receive(patient)
+        await self.set_status('AVAILABLE')
+        self.assertTrue(await patient.receive_nothing())
+        await self.close_sockets()
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """Cross-process delivery through the shared SQLite file: two layers stand in for two workers."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.path = os.path.join(root, 'layer.sqlite3')
+
+    def layer(self, **config):
+        from .channel_layers import SQLiteChannelLayer
+        return SQLiteChannelLayer(self.path, **config)
+
+    async def receive(self, layer, channel, timeout=2):
+        return await asyncio.wait_for(layer.receive(channel), timeout)
+
+    async def test_send_and_receive_across_processes(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+        await sender.send(channel, {'type': 'hello', 'n': 1})
+        await sender.send(channel, {'type': 'hello', 'n': 2})
+        self.assertEqual(await self.receive(receiver, channel), {'type': 'hello', 'n': 1})
+        self.assertEqual(await self.receive(receiver, channel), {'type': 'hello', 'n': 2})
+
+        # Non-specific channels go to whichever process asks first
+        await receiver.send('jobs', {'type': 'job'})
+        self.assertEqual(await self.receive(sender, 'jobs'), {'type': 'job'})
+
+    async def test_group_fan_out(self):
+        sender, worker_a, worker_b = self.layer(), self.layer(), self.layer()
+        a, b, gone = await worker_a.new_channel(), await worker_b.new_channel(), await worker_b.new_channel()
+        for channel in (a, b, gone):
+            await sender.group_add('chat_1', channel)
+        await sender.group_discard('chat_1', gone)
+
+        await sender.group_send('chat_1', {'type': 'chat.message', 'text': 'hi'})
+        self.assertEqual(await self.receive(worker_a, a), {'type': 'chat.message', 'text': 'hi'})
+        self.assertEqual(await self.receive(worker_b, b), {'type': 'chat.message', 'text': 'hi'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.receive(worker_b, gone, timeout=0.2)
+
+    async def test_capacity(self):
+        from channels.exceptions import ChannelFull
+
+        sender, receiver = self.layer(capacity=2), self.layer(capacity=2)
+        full, free = await receiver.new_channel(), await receiver.new_channel()
+        await sender.send(full, {'type': 'm', 'n': 1})
+        await sender.send(full, {'type': 'm', 'n': 2})
+        with self.assertRaises(ChannelFull):
+            await sender.send(full, {'type': 'm', 'n': 3})
+
+        # group_send skips full members instead of failing
+        await sender.group_add('g', full)
+        await sender.group_add('g', free)
+        await sender.group_send('g', {'type': 'm', 'n': 'group'})
+        self.assertEqual(await self.receive(receiver, free), {'type': 'm', 'n': 'group'})
+        self.assertEqual([(await self.receive(receiver, full))['n'] for _ in range(2)], [1, 2])
+
+    async def test_expired_messages_are_not_delivered(self):
+        sender, receiver = self.layer(expiry=0.1), self.layer(expiry=0.1)
+        channel = await receiver.new_channel()
+        await sender.send(channel, {'type': 'stale'})
+        await asyncio.sleep(0.2)
+        await sender.send(channel, {'type': 'fresh'})
+        self.assertEqual(await self.receive(receiver, channel), {'type': 'fresh'})
+
+    async def test_unreceived_channels_are_evicted(self):
+        sender, receiver = self.layer(expiry=0.2), self.layer(expiry=0.2)
+        listening = await receiver.new_channel()
+        orphans = [await receiver.new_channel() for _ in range(50)]
+        for channel in orphans:
+            await sender.group_add('g', channel)
+        await sender.group_send('g', {'type': 'nobody listens'})
+        await sender.send(listening, {'type': 'm'})
+        self.assertEqual(await self.receive(receiver, listening), {'type': 'm'})
+
+        state = receiver._loops[asyncio.get_running_loop()]
+        self.assertEqual(len(state.queues), 50)  # buffered for late receivers...
+        await asyncio.sleep(0.5)
+        self.assertEqual(state.queues, {})       # ...until they expire
+        self.assertIsNone(state.poller)
+
+    async def test_local_send_skips_idle_back_off(self):
+        layer = self.layer(max_poll_interval=5)
+        channel = await layer.new_channel()
+        waiting = asyncio.ensure_future(layer.receive(channel))
+        await asyncio.sleep(0.5)  # long enough to back off to the maximum
+        await layer.send(channel, {'type': 'm'})
+        self.assertEqual(await asyncio.wait_for(waiting, 1), {'type': 'm'})
+
+
+class MultiplexedChatTests(ChatSocketMixin, MediPriorTestCase):
+    """ws/chat/: one socket for all of a user's accepted connections, every frame tagged by connection_id."""
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = make_doctor()
+        self.patients = [make_patient() for _ in range(3)]
+        self.connections = [connect(patient, self.doctor) for patient in self.patients]
+        self.pending = connect(make_patient(), self.doctor, status=DoctorPatientConnection.ConnectionStatus.PENDING)
+
+    async def test_rooms_then_tagged_traffic(self):
+        dashboard = await self.open_socket(self.doctor, '/ws/chat/')
+        rooms = await self.receive(dashboard)
+        self.assertEqual(rooms['type'], 'rooms')
+        self.assertEqual(sorted(room['connection_id'] for room in rooms['rooms']), sorted(c.id for c in self.connections))
+
+        first = self.connections[0]
+        history = await self.send(dashboard, command='load_history', connection_id=first.id)
+        self.assertEqual((history['type'], history['connection_id'], history['messages']), ('history', first.id, []))
+
+        patient = await self.open_socket(self.patients[1], f'/ws/chat/{self.connections[1].id}/')
+        await self.receive(patient)  # history
+        await self.receive(patient)  # doctor_status
+        await self.send(patient, message='hello from patient 1')
+        relayed = await self.receive(dashboard)
+        self.assertEqual((relayed['connection_id'], relayed['message']), (self.connections[1].id, 'hello from patient 1'))
+
+        reply = await self.send(dashboard, connection_id=self.connections[1].id, message='hello back')
+        self.assertEqual((reply['connection_id'], reply['message']), (self.connections[1].id, 'hello back'))
+        self.assertEqual((await self.receive(patient))['message'], 'hello back')
+        await self.close_sockets()
+
+    async def test_unknown_and_pending_connections_are_refused(self):
+        dashboard = await self.open_socket(self.doctor, '/ws/chat/')
+        await self.receive(dashboard)
+        for connection_id in [self.pending.id, 10**9, 'x']:
+            error = await self.send(dashboard, command='load_history', connection_id=connection_id)
+            self.assertEqual(error['code'], 'unknown_connection')
+        await self.close_sockets()
+
+    async def test_connection_accepted_later_is_joined_on_first_use(self):
+        from channels.db import database_sync_to_async
+
+        dashboard = await self.open_socket(self.doctor, '/ws/chat/')
+        await self.receive(dashboard)
+        self.pending.status = DoctorPatientConnection.ConnectionStatus.ACCEPTED
+        await database_sync_to_async(self.pending.save)()
+        history = await self.send(dashboard, command='load_history', connection_id=self.pending.id)
+        self.assertEqual((history['type'], history['connection_id']), ('history', self.pending.id))
+        await self.close_sockets()
+
+    async def test_one_status_frame_per_doctor(self):
+        from channels.db import database_sync_to_async
+
+        # Three rooms with the same doctor still make one status subscription
+        dashboard = await self.open_socket(self.doctor, '/ws/chat/')
+        await self.receive(dashboard)
+        await database_sync_to_async(chat_state.broadcast_doctor_status)(self.doctor.id, 'BUSY')
+        self.assertEqual(await self.receive(dashboard), {'type': 'doctor_status', 'doctor_id': self.doctor.id, 'status': 'BUSY'})
+        self.assertTrue(await dashboard.receive_nothing())
+        await self.close_sockets()
+
+
+class ChatLoadTestTests(ChatSocketMixin, MediPriorTestCase):
+    """load_test_chat's seeding and its in-process run, at a tiny scale."""
+
+    def setUp(self):
+        super().setUp()
+        from .management.commands.load_test_chat import seed
+        self.pairs = seed(doctors=2, patients_per_doctor=2, history=5)
+
+    def test_seed(self):
+        from .models import Message
+
+        self.assertEqual(len(self.pairs), 4)
+        for connection_id, patient, doctor in self.pairs:
+            connection = DoctorPatientConnection.objects.get(id=connection_id)
+            self.assertEqual((connection.patient_id, connection.doctor_id), (patient.id, doctor.id))
+            self.assertEqual(Message.objects.filter(conversation_id=connection.conversation_id).count(), 5)
+
+    def test_query_counter(self):
+        from .management.commands.load_test_chat import QueryCounter
+
+        counter = QueryCounter()
+        counter.install()
+        try:
+            list(User.objects.all())
+            DoctorPatientConnection.objects.count()
+        finally:
+            counter.uninstall()
+        User.objects.count()
+        self.assertEqual(counter.count, 2)
+
+    async def test_run_reports_every_message(self):
+        from .management.commands.load_test_chat import Command
+
+        for multiplex in (False, True):
+            report = await Command().run(self.pairs, {
+                'history': 5, 'rounds': 2, 'multiplex': multiplex, 'concurrency': 4, 'timeout': 5,
+            })
+            self.assertEqual((report['sockets'], report['messages'], report['errors']), (6 if multiplex else 8, 16, 0))
+            self.assertIsNotNone(report['delivery_p99_ms'])
+            # Each message is one INSERT; the spam-rule window is seeded once per socket
+            self.assertLessEqual(report['queries_per_message'], 1.5)
+
+
+class WriteBehindTests(ChatSocketMixin, MediPriorTestCase):
+    """Write-behind ids are exact in JavaScript and time-ordered; batches land, failures are reported."""
+
+    def setUp(self):
+        super().setUp()
+        self.patient, self.doctor = make_patient(), make_doctor()
+        self.connection = connect(self.patient, self.doctor)
+        self.conversation_id = self.connection.get_or_create_conversation_id()
+
+    def writer(self, **options):
+        from .chat_writer import MessageWriter
+        options = {'batch_size': 100, 'flush_interval': 60, 'retries': 0, 'worker_id': 3, **options}
+        return MessageWriter(**options)
+
+    def test_ids_fit_in_a_javascript_number_and_grow(self):
+        from .chat_writer import SnowflakeIds
+
+        a, b = SnowflakeIds(1), SnowflakeIds(2)
+        ids = [a.next_id() for _ in range(1000)]  # far more than 16 per millisecond
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all(i < 2**53 for i in ids))
+        self.assertTrue(set(ids).isdisjoint(b.next_id() for _ in range(1000)))
+
+    async def test_batch_is_saved_and_pending_ids_are_visible(self):
+        from channels.db import database_sync_to_async
+        from .models import Message
+
+        writer = self.writer()
+        messages = [writer.enqueue(self.conversation_id, self.patient.id, f'm{i}') for i in range(3)]
+        self.assertEqual(writer.latest_id(self.conversation_id), messages[-1].id)
+
+        await writer.flush()
+        self.assertIsNone(writer.latest_id(self.conversation_id))
+        saved = await database_sync_to_async(lambda: list(
+            Message.objects.filter(conversation_id=self.conversation_id).values_list('id', 'content')
+        ))()
+        self.assertEqual(saved, [(m.id, m.content) for m in messages])
+
+        # Rows saved later without write-behind still sort after the written ids
+        later = await database_sync_to_async(Message.objects.create)(
+            conversation_id=self.conversation_id, sender=self.doctor, content='plain insert'
+        )
+        self.assertGreater(later.id, messages[-1].id)
+
+    async def test_failed_rows_are_reported_to_the_sender(self):
+        from channels.db import database_sync_to_async
+        from channels.layers import get_channel_layer
+        from django.db import DatabaseError
+        from .models import Message
+
+        writer = self.writer()
+        write = writer._write
+
+        def failing_write(batch):
+            if any(p.message.content == 'bad' for p in batch):
+                raise DatabaseError("boom")
+            return write(batch)
+
+        layer = get_channel_layer()
+        reply_channel = await layer.new_channel()
+        good = writer.enqueue(self.conversation_id, self.patient.id, 'good')
+        bad = writer.enqueue(self.conversation_id, self.patient.id, 'bad', reply_channel=reply_channel, connection_id=self.connection.id)
+        with mock.patch.object(writer, '_write', failing_write), self.assertLogs('core.chat_writer', 'ERROR'):
+            await writer.flush()
+
+        event = await asyncio.wait_for(layer.receive(reply_channel), 1)
+        self.assertEqual(event, {'type': 'chat_message_failed', 'connection_id': self.connection.id, 'id': bad.id})
+        saved = await database_sync_to_async(lambda: list(Message.objects.values_list('id', flat=True)))()
+        self.assertEqual(saved, [good.id])
+
+    async def test_id_taken_by_another_message_is_reported(self):
+        from channels.db import database_sync_to_async
+        from channels.layers import get_channel_layer
+        from .models import Message
+
+        writer = self.writer()
+        layer = get_channel_layer()
+        reply_channel = await layer.new_channel()
+        message = writer.enqueue(self.conversation_id, self.patient.id, 'mine', reply_channel=reply_channel, connection_id=self.connection.id)
+        # Another worker with the same worker id already saved a row under this id
+        await database_sync_to_async(Message.objects.create)(
+            id=message.id, conversation_id=self.conversation_id, sender=self.doctor, content='theirs'
+        )
+        with self.assertLogs('core.chat_writer', 'ERROR'):
+            await writer.flush()
+
+        event = await asyncio.wait_for(layer.receive(reply_channel), 1)
+        self.assertEqual(event['id'], message.id)
+        self.assertEqual(await database_sync_to_async(lambda: Message.objects.get(id=message.id).content)(), 'theirs')
+
+    def test_shutdown_flush_keeps_committed_rows_and_reports_collisions(self):
+        from .models import Message
+
+        writer = self.writer()
+        with mock.patch.object(writer, '_ensure_task'):  # no event loop here
+            committed, clashing, queued = (
+                writer.enqueue(self.conversation_id, self.patient.id, content)
+                for content in ('committed', 'clashing', 'queued')
+            )
+        # The first batch committed just before exit, so it is still in flight...
+        writer._inflight, writer._queue = writer._queue[:1], writer._queue[1:]
+        writer._write(writer._inflight)
+        # ...and another worker took the id of a queued message
+        Message.objects.create(id=clashing.id, conversation_id=self.conversation_id, sender=self.doctor, content='theirs')
+        with self.assertLogs('core.chat_writer', 'ERROR') as logs:
+            writer.flush_sync()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn(str(clashing.id), logs.output[0])
+        self.assertEqual(
+            dict(Message.objects.values_list('id', 'content')),
+            {committed.id: 'committed', clashing.id: 'theirs', queued.id: 'queued'},
+        )
+
+    def test_pid_worker_id_needs_a_single_worker(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from .chat_writer import get_writer, worker_id
+
+        self.assertEqual(worker_id(), os.getpid())
+        sqlite_layer = {'default': {'BACKEND': 'core.channel_layers.SQLiteChannelLayer'}}
+        with override_settings(CHANNEL_LAYERS=sqlite_layer), mock.patch('core.chat_writer._WRITER', None):
+            with self.assertRaises(ImproperlyConfigured):
+                get_writer()
+            with override_settings(CHAT_WRITE_BEHIND_WORKER_ID=7):
+                self.assertEqual(get_writer().ids.worker_id, 7)
+        with override_settings(CHAT_WRITE_BEHIND_WORKER_ID=256), self.assertRaises(ImproperlyConfigured):
+            worker_id()
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    async def test_socket_send_is_relayed_before_it_is_saved(self):
+        from .chat_writer import get_writer
+
+        writer = self.writer()
+        with mock.patch('core.chat_writer._WRITER', writer):
+            self.assertIs(get_writer(), writer)
+            patient = await self.open_socket(self.patient, f'/ws/chat/{self.connection.id}/')
+            await self.receive(patient)  # history
+            await self.receive(patient)  # doctor_status
+            await self.send(patient, message='seed')
+            relayed, statements = await self.statements_during(self.send(patient, message='hello'))
+            self.assertEqual(statements, [])
+
+            # Clearing covers the message still in the queue
+            self.assertEqual((await self.send(patient, command='clear_history'))['type'], 'cleared')
+            await writer.flush()
+            await patient.disconnect()
+            patient = await self.open_socket(self.patient, f'/ws/chat/{self.connection.id}/')
+            self.assertEqual((await self.receive(patient))['messages'], [])
+            doctor = await self.open_socket(self.doctor, f'/ws/chat/{self.connection.id}/')
+            history = await self.receive(doctor)
+            self.assertEqual([m['id'] for m in history['messages']][-1], relayed['id'])
+        await self.close_sockets()
+
+
+class TokenAuthTests(ChatSocketMixin, MediPriorTestCase):
+    """Sockets authenticate from token claims, plus an is_active check cached for WS_TOKEN_CACHE_TTL."""
+
+    def setUp(self):
+        super().setUp()
+        self.patient, self.doctor = make_patient(), make_doctor()
+        self.connection = connect(self.patient, self.doctor)
+
+    async def test_principal_from_claims_with_one_cached_lookup(self):
+        token = access_token(self.patient)
+        principal, statements = await self.statements_during(middleware.get_user(token))
+        self.assertIsInstance(principal, middleware.TokenPrincipal)
+        self.assertEqual((principal.id, principal.email, principal.user_type), (self.patient.id, self.patient.email, 'PATIENT'))
+        self.assertEqual(statements, ['SELECT'])
+        _, statements = await self.statements_during(middleware.get_user(token))
+        self.assertEqual(statements, [])
+
+    async def test_deactivated_user_is_refused_after_one_ttl(self):
+        from channels.db import database_sync_to_async
+
+        token = access_token(self.patient)
+        await middleware.get_user(token)
+        self.patient.is_active = False
+        await database_sync_to_async(self.patient.save)()
+        # Within the TTL the cached flag still admits the token (the documented window)...
+        self.assertIsInstance(await middleware.get_user(token), middleware.TokenPrincipal)
+        # ...after it, the user is refused
+        later = time.time() + settings.WS_TOKEN_CACHE_TTL + 1
+        with mock.patch('core.middleware.time.time', return_value=later):
+            self.assertTrue((await middleware.get_user(token)).is_anonymous)
+
+    async def test_deleted_user_cannot_open_a_socket(self):
+        from channels.db import database_sync_to_async
+
+        token_user = self.patient
+        await database_sync_to_async(User.objects.filter(id=self.patient.id).delete)()
+        self.assertTrue((await middleware.get_user(access_token(token_user))).is_anonymous)
+        await self.open_socket(token_user, f'/ws/chat/{self.connection.id}/', accepted=False)
+
+    async def test_tokens_without_custom_claims_load_the_user(self):
+        from channels.db import database_sync_to_async
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        token = str(AccessToken.for_user(self.doctor))
+        self.assertEqual(await middleware.get_user(token), self.doctor)
+        self.doctor.is_active = False
+        await database_sync_to_async(self.doctor.save)()
+        self.assertTrue((await middleware.get_user(token)).is_anonymous)
+
+    async def test_invalid_tokens_are_anonymous(self):
+        token = access_token(self.patient)
+        for bad in ['', 'not-a-token', token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1]]:
+            self.assertTrue((await middleware.get_user(bad)).is_anonymous)
+
+
+class VerifiedDoctorListQueryTests(MediPriorTestCase):
+    """/api/doctors/ must cost the same number of queries at any directory size."""
+
+    def setUp(self):
+        self.patient = make_patient()
+        self.client = self.api_client(self.patient)
+        self.doctors = []
+
+    def add_doctors(self, count):
+        # Doctors are named 'Doctor 01', 'Doctor 02'... in creation order; every other one is connected
+        for _ in range(count):
+            doctor = make_doctor(f'Doctor {len(self.doctors) + 1:02}')
+            if len(self.doctors) % 2 == 0:
+                connect(self.patient, doctor)
+            self.doctors.append(doctor)
+
+    def test_query_count_is_constant(self):
+        self.add_doctors(2)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/doctors/')
+        self.assertEqual(len(response.data), 2)
+
+        self.add_doctors(25)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/doctors/')
+        self.assertEqual(len(response.data), 27)
+
+    def test_connection_status_per_doctor(self):
+        self.add_doctors(3)
+        response = self.client.get('/api/doctors/')
+        statuses = {row['user_id']: row['connection_status'] for row in response.data}
+        self.assertEqual(statuses, {
+            self.doctors[0].id: 'ACCEPTED',
+            self.doctors[1].id: None,
+            self.doctors[2].id: 'ACCEPTED',
+        })
+
+    def test_search_and_keyset_pages(self):
+        self.add_doctors(5)
+        DoctorProfile.objects.filter(user=self.doctors[1]).update(specialization='Cardiology')
+        DoctorProfile.objects.filter(user=self.doctors[3]).update(bio='Cardiac surgeon')
+
+        response = self.client.get('/api/doctors/', {'q': 'cardi'})
+        self.assertEqual({row['user_id'] for row in response.data}, {self.doctors[1].id, self.doctors[3].id})
+
+        ids, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/doctors/', params)
+            ids += [row['user_id'] for row in response.data['results']]
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(ids, [doctor.id for doctor in self.doctors])
+
+        self.assertEqual(self.client.get('/api/doctors/', {'cursor': 'nope'}).status_code, 400)
+
+
+class ConnectionListQueryTests(MediPriorTestCase):
+    """/api/connections/ must cost the same number of queries at any list size."""
+
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient_count = 0
+
+    def add_patients(self, count):
+        # Every third connection is PENDING, the rest ACCEPTED
+        for _ in range(count):
+            self.patient_count += 1
+            patient = make_patient()
+            connect(patient, self.doctor, 'PENDING' if self.patient_count % 3 == 0 else 'ACCEPTED')
+        return patient
+
+    def test_query_count_is_constant(self):
+        self.client = self.api_client(self.doctor)
+        self.add_patients(2)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/connections/')
+        self.assertEqual(len(response.data), 2)
+
+        self.add_patients(25)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/connections/')
+        self.assertEqual(len(response.data), 27)
+        self.assertEqual({row['doctor_profile']['connection_status'] for row in response.data}, {'SELF'})
+
+    def test_patient_sees_row_status(self):
+        patient = self.add_patients(3)
+        self.client = self.api_client(patient)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/connections/')
+        self.assertEqual(response.data[0]['doctor_profile']['connection_status'], 'PENDING')
+
+    def test_status_filter_and_keyset_pages(self):
+        self.client = self.api_client(self.doctor)
+        self.add_patients(7)
+        response = self.client.get('/api/connections/', {'status': 'pending'})
+        self.assertEqual([row['status'] for row in response.data], ['PENDING', 'PENDING'])
+        self.assertEqual(self.client.get('/api/connections/', {'status': 'LOST'}).status_code, 400)
+
+        ids, cursor = [], None
+        while True:
+            params = {'status': 'ACCEPTED', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get('/api/connections/', params)
+            ids += [row['id'] for row in response.data['results']]
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        accepted = DoctorPatientConnection.objects.filter(status='ACCEPTED').order_by('-created_at', '-id')
+        self.assertEqual(ids, [connection.id for connection in accepted])
+
+        self.assertEqual(self.client.get('/api/connections/', {'cursor': 'WyJ4IiwgMV0='}).status_code, 400)
+
+
+class AppointmentCompletionTests(MediPriorTestCase):
+    """Reading appointments never writes; the completion job stores the status."""
+
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+
+    def add_appointment(self, hours_from_now, status=Appointment.AppointmentStatus.BOOKED):
+        start = timezone.now() + timedelta(hours=hours_from_now)
+        return Appointment.objects.create(
+            doctor=self.doctor, patient=self.patient, status=status,
+            start_time=start, end_time=start + timedelta(minutes=30),
+        )
+
+    def test_list_reports_ended_bookings_without_writing(self):
+        ended = self.add_appointment(-2)
+        upcoming = self.add_appointment(2)
+        client = self.api_client(self.patient)
+
+        with self.assertNumQueries(1):
+            response = client.get('/api/appointments/')
+        statuses = {row['id']: row['status'] for row in response.data}
+        self.assertEqual(statuses, {ended.id: 'COMPLETED', upcoming.id: 'BOOKED'})
+        ended.refresh_from_db()
+        self.assertEqual(ended.status, Appointment.AppointmentStatus.BOOKED)
+
+    def test_job_completes_only_ended_bookings(self):
+        ended = [self.add_appointment(-hours) for hours in range(1, 6)]
+        upcoming = self.add_appointment(2)
+        canceled = self.add_appointment(-10, Appointment.AppointmentStatus.CANCELED)
+
+        self.assertEqual(complete_past_appointments(batch=2), 5)
+        self.assertEqual(complete_past_appointments(batch=2), 0)
+        self.assertEqual(
+            Appointment.objects.filter(status=Appointment.AppointmentStatus.COMPLETED).count(), len(ended)
+        )
+        upcoming.refresh_from_db()
+        canceled.refresh_from_db()
+        self.assertEqual(upcoming.status, Appointment.AppointmentStatus.BOOKED)
+        self.assertEqual(canceled.status, Appointment.AppointmentStatus.CANCELED)
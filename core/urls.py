@@ -12,7 +12,8 @@ from .views import (
     PatientHealthMetricView,
     AppointmentListView,
     AppointmentDetailView,
-    AIChatView
+    AIChatView,
+    AIChatBatchView
 )
 
 urlpatterns = [
@@ -31,4 +32,5 @@ urlpatterns = [
     path('appointments/', AppointmentListView.as_view(), name='appointment-list'),
     path('appointments/<int:pk>/', AppointmentDetailView.as_view(), name='appointment-detail'),
     path('ai-chat/', AIChatView.as_view(), name='ai-chat'),
+    path('ai-chat/batch/', AIChatBatchView.as_view(), name='ai-chat-batch'),
 ]
\ No newline at end of file
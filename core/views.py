@@ -2,11 +2,15 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, viewsets
-from .ai_utils import analyze_message, COPING_TOOLS
+from .ai_utils import COPING_TOOLS
+from . import ai_worker, chat_state
+from .doctor_search import search_doctors
+from .pagination import wants_page, parse_limit, keyset_page
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.http import Http404
 from django.utils import timezone
+from django.db.models import OuterRef, Subquery
 
 # Import all models
 from .models import (
@@ -70,8 +74,12 @@ class ProfileView(APIView):
             serializer = DoctorProfileSerializer(instance=profile, data=request.data, partial=True)
         else:
             return Response({"error": "Invalid user type"}, status=status.HTTP_400_BAD_REQUEST)
+        old_chat_status = getattr(profile, 'chat_status', None)
         if serializer.is_valid():
             serializer.save(user=user) 
+            # Open chats cache the doctor's status; push the change to them
+            if user.user_type == 'DOCTOR' and profile.chat_status != old_chat_status:
+                chat_state.broadcast_doctor_status(user.id, profile.chat_status)
             return Response(serializer.data, status=status.HTTP_200_OK if not created else status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -106,18 +114,59 @@ class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
 class VerifiedDoctorListView(APIView):
+    """
+    Doctor directory. Optional query params:
+      q                      full-text search (ranked by relevance)
+      consultation_type      ONLINE / IN_PERSON (doctors offering BOTH match either)
+      chat_status            AVAILABLE / BUSY / OFFLINE
+      min_experience, max_experience   years
+      limit, cursor          keyset pagination -> {"results": [...], "next_cursor": ...}
+    Without limit/cursor the response stays a plain list, as before.
+    """
     permission_classes = [permissions.IsAuthenticated] 
     def get(self, request):
+        params = request.query_params
+        # One query at any directory size: the user row is joined and this
+        # patient's connection status comes from a correlated subquery
+        connection_status = DoctorPatientConnection.objects.filter(
+            patient_id=request.user.id, doctor_id=OuterRef('user_id')
+        ).values('status')[:1]
         verified_profiles = DoctorProfile.objects.filter(
             verification_status=DoctorProfile.VerificationStatus.VERIFIED
-        ).exclude(user=request.user) # Exclude self
-        
-        serializer = DoctorPublicProfileSerializer(
-            verified_profiles, 
-            many=True,
-            context={'request': request} 
+        ).exclude(user=request.user).select_related('user').annotate(  # Exclude self
+            patient_connection_status=Subquery(connection_status)
         )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+        consultation_type = params.get('consultation_type')
+        if consultation_type:
+            verified_profiles = verified_profiles.filter(
+                consultation_type__in=[consultation_type, DoctorProfile.ConsultationType.BOTH]
+            )
+        if params.get('chat_status'):
+            verified_profiles = verified_profiles.filter(chat_status=params['chat_status'])
+        try:
+            if params.get('min_experience'):
+                verified_profiles = verified_profiles.filter(years_of_experience__gte=int(params['min_experience']))
+            if params.get('max_experience'):
+                verified_profiles = verified_profiles.filter(years_of_experience__lte=int(params['max_experience']))
+        except ValueError:
+            return Response({"error": "Experience filters must be whole numbers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        verified_profiles, ranked = search_doctors(verified_profiles, params.get('q'))
+        ordering = ('search_rank', 'user_id') if ranked else ('name', 'user_id')
+
+        if not wants_page(params):
+            if ranked or params:
+                verified_profiles = verified_profiles.order_by(*ordering)
+            serializer = DoctorPublicProfileSerializer(verified_profiles, many=True, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        try:
+            rows, next_cursor = keyset_page(verified_profiles, ordering, params.get('cursor'), parse_limit(params))
+        except ValueError:
+            return Response({"error": "Invalid cursor or limit."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = DoctorPublicProfileSerializer(rows, many=True, context={'request': request})
+        return Response({"results": serializer.data, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 class ConnectionRequestView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -135,17 +184,41 @@ class ConnectionRequestView(APIView):
 
 # --- THIS IS THE MISSING VIEW ---
 class DoctorConnectionView(APIView):
+    """
+    GET: the caller's connections. Optional query params:
+      status           PENDING / ACCEPTED / REJECTED, comma-separated for several
+      limit, cursor    keyset pagination, newest first -> {"results": [...], "next_cursor": ...}
+    Without limit/cursor the response stays a plain list, as before.
+    """
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
+        params = request.query_params
         if request.user.user_type == User.UserType.DOCTOR:
             connections = DoctorPatientConnection.objects.filter(doctor=request.user)
         elif request.user.user_type == User.UserType.PATIENT:
             connections = DoctorPatientConnection.objects.filter(patient=request.user)
         else:
             return Response({"error": "Invalid user type."}, status=403)
-            
-        serializer = ConnectionListSerializer(connections, many=True, context={'request': request})
-        return Response(serializer.data)
+
+        # Both nested profiles come from the same query
+        connections = connections.select_related('patient__patient_profile', 'doctor__doctor_profile')
+
+        if params.get('status'):
+            statuses = [value.strip().upper() for value in params['status'].split(',')]
+            if not set(statuses) <= set(DoctorPatientConnection.ConnectionStatus.values):
+                return Response({"error": "Invalid status filter."}, status=status.HTTP_400_BAD_REQUEST)
+            connections = connections.filter(status__in=statuses)
+
+        if not wants_page(params):
+            serializer = ConnectionListSerializer(connections, many=True, context={'request': request})
+            return Response(serializer.data)
+
+        try:
+            rows, next_cursor = keyset_page(connections, ('-created_at', '-id'), params.get('cursor'), parse_limit(params))
+        except ValueError:
+            return Response({"error": "Invalid cursor or limit."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ConnectionListSerializer(rows, many=True, context={'request': request})
+        return Response({"results": serializer.data, "next_cursor": next_cursor})
 
     def post(self, request): # This is for doctors to ACCEPT/REJECT
         if request.user.user_type != User.UserType.DOCTOR:
@@ -217,13 +290,8 @@ class AppointmentListView(APIView):
         user = request.user
         doctor_id = self.request.query_params.get('doctor_id')
 
-        # --- NEW: Auto-complete past appointments ---
-        # Find booked appointments in the past and mark them complete
-        Appointment.objects.filter(
-            status=Appointment.AppointmentStatus.BOOKED,
-            end_time__lt=timezone.now()
-        ).update(status=Appointment.AppointmentStatus.COMPLETED)
-        # ---------------------------------------------
+        # Past BOOKED appointments are reported as COMPLETED by the serializer;
+        # core/appointment_scheduler.py updates the stored status later.
         
         if user.user_type == 'PATIENT':
             if doctor_id:
@@ -242,7 +310,9 @@ class AppointmentListView(APIView):
         
         else:
             return Response({"error": "Invalid user type"}, status=400)
-            
+
+        # Names for both sides come from the same query
+        queryset = queryset.select_related('patient__patient_profile', 'doctor__doctor_profile')
         serializer = AppointmentSerializer(queryset, many=True)
         return Response(serializer.data, status=200)
     
@@ -319,7 +389,32 @@ class AIChatView(APIView):
         if not user_message:
             return Response({"error": "Message is required"}, status=400)
 
-        # Analyze the text
-        result = analyze_message(user_message)
+        # Analyze the text (in the AI worker pool, with a fallback if it's busy)
+        result = ai_worker.analyze(user_message)
         
-        return Response(result)
\ No newline at end of file
+        return Response(result)
+
+class AIChatBatchView(APIView):
+    """
+    Batch API for the AI Health Assistant: scores many messages in one
+    vectorized pass (chat log / journal replays).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    MAX_MESSAGES = 10000
+
+    def post(self, request):
+        messages = request.data.get('messages')
+
+        if not isinstance(messages, list) or not messages:
+            return Response({"error": "'messages' must be a non-empty list"}, status=400)
+        if len(messages) > self.MAX_MESSAGES:
+            return Response({"error": f"At most {self.MAX_MESSAGES} messages per request"}, status=400)
+        if not all(isinstance(m, str) and m for m in messages):
+            return Response({"error": "Every message must be a non-empty string"}, status=400)
+
+        try:
+            results = ai_worker.analyze_batch(messages)
+        except ai_worker.AIUnavailable:
+            return Response({"error": "AI service is busy, please retry shortly"}, status=503)
+
+        return Response({"results": results})
@@ -1,21 +1,36 @@
 # mediprior_backend/asgi.py
 import os
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 
-# --- THIS IS THE CHANGE ---
-from core.middleware import TokenAuthMiddlewareStack
-# ---------------------------
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediprior_backend.settings')
 
-import core.routing
+# Set up Django (apps registry, settings) BEFORE importing anything that touches models
+django_asgi_app = get_asgi_application()
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediprior_backend.settings')
+from core.middleware import TokenAuthMiddlewareStack  # noqa: E402
+import core.routing  # noqa: E402
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": TokenAuthMiddlewareStack( # <-- USE OUR NEW MIDDLEWARE
         URLRouter(
             core.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
+
+# Start the AI workers (or load the engine) now so the first chat request doesn't pay for it
+if getattr(settings, 'AI_WARMUP_ON_STARTUP', False):
+    from core.ai_worker import warm_up
+    warm_up()
+
+# Refuse to start with a write-behind worker id other workers may share
+from core import chat_writer  # noqa: E402
+if chat_writer.enabled():
+    chat_writer.get_writer()
+
+# Complete ended appointments in the background (every APPOINTMENT_SCHEDULER_INTERVAL seconds; 0 turns it off)
+from core import appointment_scheduler  # noqa: E402
+appointment_scheduler.start()
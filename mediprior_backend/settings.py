@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -81,6 +82,63 @@ CHANNEL_LAYERS = {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
 }
+# InMemory only reaches sockets in the same process. To run several daphne
+# workers on one host, point them all at the same SQLite file instead
+# (see core/channel_layers.py).
+CHANNEL_LAYER_SQLITE_PATH = os.environ.get("CHANNEL_LAYER_SQLITE_PATH")
+if CHANNEL_LAYER_SQLITE_PATH:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "core.channel_layers.SQLiteChannelLayer",
+            "CONFIG": {
+                "path": CHANNEL_LAYER_SQLITE_PATH,
+                "expiry": 60,
+                "capacity": 100,
+            },
+        }
+    }
+
+# Websocket auth (core/middleware.py): sockets are authenticated from the JWT
+# claims; decoded tokens and each user's is_active flag are cached for
+# reconnects. A deactivated or deleted user's tokens keep opening sockets for
+# up to WS_TOKEN_CACHE_TTL seconds afterwards (sockets already open stay open).
+WS_TOKEN_CACHE_SIZE = 10000
+WS_TOKEN_CACHE_TTL = 60  # seconds, never past the token's own expiry
+
+# Chat: messages sent on connect / per 'load_older' page
+CHAT_HISTORY_PAGE_SIZE = 50
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+# Cache holding each conversation's recent-sender state for the chat spam rules.
+# LocMem covers every socket in one process; point this at a cache shared by all
+# workers (e.g. FileBasedCache or Redis) when running more than one.
+CHAT_STATE_CACHE = "default"
+CHAT_STATE_TTL = 24 * 60 * 60
+
+# Chat write-behind (core/chat_writer.py): fan messages out immediately and
+# save them in batches. Off by default; every message is one INSERT then.
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "") == "1"
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+CHAT_WRITE_BEHIND_INTERVAL = 0.05  # seconds
+CHAT_WRITE_BEHIND_RETRIES = 3
+# 8-bit id (0-255) of this process in message ids. Required, and distinct per
+# worker, when running several (any channel layer but InMemory): workers
+# sharing an id issue the same message ids. A single worker defaults to its pid.
+CHAT_WRITE_BEHIND_WORKER_ID = os.environ.get("CHAT_WRITE_BEHIND_WORKER_ID")
+if CHAT_WRITE_BEHIND_WORKER_ID is not None:
+    CHAT_WRITE_BEHIND_WORKER_ID = int(CHAT_WRITE_BEHIND_WORKER_ID)
+
+# Appointment completion (core/appointment_scheduler.py): BOOKED appointments
+# that have ended are marked COMPLETED by a thread in each server process
+# every N seconds. Set it to 0 to turn the thread off, but then run
+# `manage.py complete_appointments` from cron instead, or the stored status
+# stays BOOKED (reads report such rows as COMPLETED either way).
+APPOINTMENT_SCHEDULER_INTERVAL = int(os.environ.get("APPOINTMENT_SCHEDULER_INTERVAL", "60"))
+APPOINTMENT_SCHEDULER_BATCH_SIZE = 500
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -146,3 +204,28 @@ REST_FRAMEWORK = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+
+# AI companion
+# The engine (numpy/scikit-learn + intent index) loads lazily on first use;
+# with warm-up on, the ASGI server starts loading it in the background at boot.
+AI_WARMUP_ON_STARTUP = True
+AI_INDEX_DIR = BASE_DIR / 'core' / 'ai_index'
+# Seconds between checks for a changed intents.json / rebuilt index. A change is
+# loaded in a background thread and swapped in atomically (0 disables).
+AI_INDEX_RELOAD_INTERVAL = 5
+# LRU of normalized chat input -> (matched tag, confidence); 0 disables
+AI_MATCH_CACHE_SIZE = 4096
+# 'exact' scores every pattern; 'ann' probes the query's AI_ANN_QUERY_TERMS
+# strongest terms in an impact-ordered inverted index (AI_ANN_POSTINGS_PER_TERM
+# rows each) and re-ranks those candidates exactly. Worth it for very large
+# FAQ corpora; compare with `manage.py bench_ai --ann`.
+AI_MATCH_MODE = 'exact'
+AI_ANN_QUERY_TERMS = 8
+AI_ANN_POSTINGS_PER_TERM = 2000
+# Classification runs in this many worker processes, off the ASGI event loop
+# (0 runs it in-process). Requests beyond AI_WORKER_MAX_PENDING queued, or slower
+# than AI_WORKER_TIMEOUT seconds, get a fallback reply instead of waiting.
+AI_WORKER_PROCESSES = 2
+AI_WORKER_MAX_PENDING = 32
+AI_WORKER_TIMEOUT = 5
+AI_WORKER_BATCH_TIMEOUT = 60
@@ -18,10 +18,10 @@ function ChatList({ onSelectConversation }) {
         setLoading(true);
         try {
             const response = await axios.get('http://127.0.0.1:8000/api/connections/', {
+                params: { status: 'ACCEPTED' },
                 headers: { Authorization: `Bearer ${authTokens.access}` }
             });
-            const accepted = response.data.filter(c => c.status === 'ACCEPTED');
-            setConnections(accepted);
+            setConnections(response.data);
         } catch (err) {
             setError('Could not load connections.');
         } finally {
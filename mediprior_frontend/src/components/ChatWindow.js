@@ -42,6 +42,7 @@ const EmergencyContactCard = ({ doctorProfile }) => (
 
 function ChatWindow({ conversation }) {
     const [messageHistory, setMessageHistory] = useState([]);
+    const [hasMore, setHasMore] = useState(false);
     const [message, setMessage] = useState('');
     const [inputDisabled, setInputDisabled] = useState(false);
     const [showToast, setShowToast] = useState(false);
@@ -54,6 +55,7 @@ function ChatWindow({ conversation }) {
 
     const { user, authTokens } = useAuth();
     const lastMessageRef = useRef(null); 
+    const keepScrollRef = useRef(false);
 
     const otherPerson = user.user_type === 'PATIENT' ? conversation.doctor_profile : conversation.patient_profile;
     const socketUrl = `ws://127.0.0.1:8000/ws/chat/${conversation.id}/?token=${authTokens.access}`;
@@ -96,14 +98,26 @@ function ChatWindow({ conversation }) {
     useEffect(() => {
         if (lastMessage !== null) {
             const data = JSON.parse(lastMessage.data);
-            if (data.type === 'history') { setMessageHistory(data.messages); } 
+            if (data.type === 'history') { setMessageHistory(data.messages); setHasMore(data.has_more); } 
+            else if (data.type === 'older_history') { keepScrollRef.current = true; setMessageHistory((prev) => [...data.messages, ...prev]); setHasMore(data.has_more); } 
             else if (data.type === 'message') { setMessageHistory((prev) => [...prev, data]); if (user.user_type === 'PATIENT' && data.sender_id !== user.user_id) setInputDisabled(false); } 
+            else if (data.type === 'doctor_status') { setDoctorStatus(data.status); }
             else if (data.type === 'cleared') { setMessageHistory([]); setToastMessage('History cleared.'); setToastVariant('info'); setShowToast(true); } 
             else if (data.type === 'error') { setToastMessage(data.message); setToastVariant('danger'); setShowToast(true); if (data.code === 'limit_reached') setInputDisabled(true); }
         }
     }, [lastMessage, user]);
 
-    useEffect(() => { lastMessageRef.current?.scrollIntoView({ behavior: 'smooth' }); }, [messageHistory]);
+    useEffect(() => {
+        // Don't jump to the bottom when an older page was prepended
+        if (keepScrollRef.current) { keepScrollRef.current = false; return; }
+        lastMessageRef.current?.scrollIntoView({ behavior: 'smooth' });
+    }, [messageHistory]);
+
+    const handleLoadOlder = () => {
+        const oldest = messageHistory[0];
+        if (!oldest) return;
+        sendMessage(JSON.stringify({ 'command': 'load_older', 'before': { 'id': oldest.id, 'timestamp': oldest.timestamp } }));
+    };
 
     const handleSend = () => {
         if (message.trim() === '') return;
@@ -120,7 +134,7 @@ function ChatWindow({ conversation }) {
                     <Card.Header className="d-flex align-items-center justify-content-between">
                         <div className="d-flex align-items-center">
                             <img src={getAvatar(otherPerson)} alt="avatar" style={{ width: '40px', height: '40px', borderRadius: '50%', marginRight: '15px' }} />
-                            <div><h5 className="theme-title mb-0">{otherPerson.name}</h5><small className="text-muted">{readyState === ReadyState.OPEN ? 'Online' : 'Connecting...'}</small></div>
+                            <div><h5 className="theme-title mb-0">{otherPerson.name}</h5><small className="text-muted">{readyState !== ReadyState.OPEN ? 'Connecting...' : (user.user_type === 'PATIENT' && doctorStatus !== 'AVAILABLE' ? (doctorStatus === 'BUSY' ? 'Busy' : 'Offline') : 'Online')}</small></div>
                         </div>
                         <div className="d-flex align-items-center">
                              <Button variant="link" className="text-danger me-2" onClick={handleClearChat} title="Clear Chat History"><FiTrash2 /></Button>
@@ -138,6 +152,9 @@ function ChatWindow({ conversation }) {
                                 <Toast.Body className="text-white">{toastMessage}</Toast.Body>
                             </Toast>
                         </ToastContainer>
+                        {hasMore && (
+                            <Button variant="link" size="sm" className="align-self-center mb-2" onClick={handleLoadOlder}>Load older messages</Button>
+                        )}
                         {messageHistory.map((msg, idx) => {
                             const isSent = msg.sender_id === user.user_id;
                             return (
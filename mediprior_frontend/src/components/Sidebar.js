@@ -51,9 +51,10 @@ function Sidebar() {
             const fetchPendingConnections = async () => {
                 try {
                     const response = await axios.get('http://127.0.0.1:8000/api/connections/', {
+                        params: { status: 'PENDING' },
                         headers: { Authorization: `Bearer ${authTokens.access}` }
                     });
-                    const count = response.data.filter(conn => conn.status === 'PENDING').length;
+                    const count = response.data.length;
                     setPendingCount(count);
                 } catch (err) {
                     console.error("Could not fetch connection count", err);